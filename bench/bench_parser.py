@@ -0,0 +1,72 @@
+"""
+Benchmark dos backends de parsing do ficheiro SNAP ('text' e 'bytes').
+
+Para cada backend mede, sobre o mesmo ficheiro:
+- o tempo total, os MB/s e os produtos/s de uma leitura completa;
+- numa segunda leitura, com o tracemalloc ativo, o pico médio de memória alocada por
+  produto (produto + objetos temporários) e o pico global.
+
+Uso:
+    python bench/bench_parser.py --input data/snap_amazon.txt [--limit 50000]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from itertools import islice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from utils import PARSER_BACKENDS, iter_snap
+
+
+def run_throughput(path, backend, limit):
+    start = time.perf_counter()
+    products = 0
+    for _ in islice(iter_snap(path, backend=backend), limit):
+        products += 1
+    return products, time.perf_counter() - start
+
+
+def run_allocations(path, backend, limit):
+    # mede, com o tracemalloc, o pico de memória alocada enquanto cada produto é construído
+    # (o produto em si mais todos os objetos temporários criados pelas linhas dele)
+    tracemalloc.start()
+    products = 0
+    per_product_peak = 0
+    iterator = islice(iter_snap(path, backend=backend), limit)
+    while True:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        product = next(iterator, None)
+        if product is None:
+            break
+        per_product_peak += tracemalloc.get_traced_memory()[1] - before
+        products += 1
+        del product
+    overall_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return products, per_product_peak / max(products, 1), overall_peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos backends de parsing do ficheiro SNAP.")
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--limit", type=int, default=None, help="Número máximo de produtos lidos por execução")
+    args = parser.parse_args()
+
+    size_mb = os.path.getsize(args.input) / (1024 * 1024)
+    print(f"Ficheiro: {args.input} ({size_mb:.1f} MB)")
+    for backend in PARSER_BACKENDS:
+        products, elapsed = run_throughput(args.input, backend, args.limit)
+        _, per_product, peak = run_allocations(args.input, backend, args.limit)
+        throughput = f"{products / elapsed:,.0f} produtos/s"
+        if args.limit is None:
+            throughput += f", {size_mb / elapsed:.1f} MB/s"
+        print(f"[{backend}] {products} produtos em {elapsed:.3f} s ({throughput}) | "
+              f"memória por produto: {per_product / 1024:.1f} KiB | pico global: {peak / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
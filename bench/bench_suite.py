@@ -0,0 +1,242 @@
+"""
+Suite de benchmarks repetíveis: parser, etapas do ETL e consultas do dashboard.
+
+Para cada fator de escala (--scales) gera um ficheiro SNAP sintético e determinístico
+(bench/snap_generator.py) e mede, `--repeat` vezes:
+- o parser sozinho, com cada backend (produtos/s e MB/s);
+- com os parâmetros de conexão, cada etapa do ETL (tp1_3.2.py) contra um PostgreSQL local:
+  as etapas são as funções com @log_time, mais o tempo total e o pico de memória;
+- a seguir, cada consulta do dashboard (tp1_3.3.py), para o produto com mais reviews.
+
+O ETL e o dashboard correm como processos separados, como em produção, e os tempos são
+lidos das linhas de cada etapa e consulta. O resultado é gravado em JSON (--json), com a
+versão do código (commit do git) e a máquina, para comparar versões: com --baseline os
+tempos são comparados com um JSON anterior e são indicadas as regressões.
+
+ATENÇÃO: o ETL recria as tabelas do banco indicado. Use um banco só para os benchmarks.
+
+Uso:
+    python bench/bench_suite.py --scales 0.5 1 2 --json bench.json
+    python bench/bench_suite.py --scales 1 --db-host localhost --db-name bench --db-user postgres --db-pass postgres \\
+        --etl-args "--loader copy --bulk" --repeat 3 --json bench.json --baseline bench_anterior.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+from bench_parser import run_throughput
+from snap_generator import add_scale_arguments, generate_snap, scale_from_args
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src'))
+from utils import PARSER_BACKENDS
+
+ETL_SCRIPT = os.path.join(PROJECT_ROOT, 'src', 'tp1_3.2.py')
+DASHBOARD_SCRIPT = os.path.join(PROJECT_ROOT, 'src', 'tp1_3.3.py')
+
+ETL_STAGE_RE = re.compile(r"<- Etapa '(\w+)' concluída em ([\d.]+) segundos\.")
+ETL_TOTAL_RE = re.compile(r"Tempo total de execução: ([\d.]+) segundos\. Pico de memória: (\d+) MB")
+QUERY_RE = re.compile(r"<- Consulta '(\w+)' concluída em ([\d.]+) segundos\.")
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def summarize(values):
+    return {'runs': values, 'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def bench_parser(path, size_bytes, repeat):
+    results = {}
+    for backend in PARSER_BACKENDS:
+        times = []
+        for _ in range(repeat):
+            products, elapsed = run_throughput(path, backend, None)
+            times.append(elapsed)
+        seconds = summarize(times)
+        results[backend] = {
+            'products': products,
+            'seconds': seconds,
+            'products_per_second': products / seconds['median'],
+            'mb_per_second': size_bytes / (1024 * 1024) / seconds['median'],
+        }
+    return results
+
+
+def _run(command, label):
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stdout[-4000:] + completed.stderr[-4000:])
+        raise RuntimeError(f"{label} terminou com o código {completed.returncode}")
+    return completed.stdout
+
+
+def _db_arguments(args):
+    return ['--db-host', args.db_host, '--db-port', str(args.db_port), '--db-name', args.db_name,
+            '--db-user', args.db_user, '--db-pass', args.db_pass]
+
+
+def bench_etl(path, args):
+    stages, totals, peaks = {}, [], []
+    for _ in range(args.repeat):
+        output = _run([sys.executable, ETL_SCRIPT, *_db_arguments(args), '--input', path,
+                       *shlex.split(args.etl_args)], "ETL")
+        if "Processo de ETL concluído com sucesso" not in output:
+            sys.stderr.write(output[-4000:])
+            raise RuntimeError("o ETL não terminou com sucesso")
+        seen = {}
+        for name, seconds in ETL_STAGE_RE.findall(output):
+            seen[name] = seen.get(name, 0) + 1 # etapas executadas mais de uma vez (ex.: create_schema)
+            key = name if seen[name] == 1 else f"{name}_{seen[name]}"
+            stages.setdefault(key, []).append(float(seconds))
+        total, peak = ETL_TOTAL_RE.search(output).groups()
+        totals.append(float(total))
+        peaks.append(int(peak))
+    return {
+        'stages': {name: summarize(times) for name, times in stages.items()},
+        'total_seconds': summarize(totals),
+        'peak_rss_mb': max(peaks),
+    }
+
+
+def bench_dashboard(asin, args):
+    queries = {}
+    for _ in range(args.repeat):
+        output = _run([sys.executable, DASHBOARD_SCRIPT, *_db_arguments(args), '--product-asin', asin,
+                       '--preview-rows', '0', *shlex.split(args.dashboard_args)], "dashboard")
+        for name, seconds in QUERY_RE.findall(output):
+            queries.setdefault(name, []).append(float(seconds))
+    return {'product_asin': asin, 'queries': {name: summarize(times) for name, times in queries.items()}}
+
+
+def timings(report):
+    """
+    Devolve {(escala, secção, nome): mediana em segundos} de um relatório, para comparação.
+    """
+    result = {}
+    for run in report['results']:
+        scale = run['scale']
+        for backend, data in run['parser'].items():
+            result[(scale, 'parser', backend)] = data['seconds']['median']
+        if 'etl' in run:
+            for name, data in run['etl']['stages'].items():
+                result[(scale, 'etl', name)] = data['median']
+            result[(scale, 'etl', 'total')] = run['etl']['total_seconds']['median']
+        if 'dashboard' in run:
+            for name, data in run['dashboard']['queries'].items():
+                result[(scale, 'dashboard', name)] = data['median']
+    return result
+
+
+def compare(report, baseline, threshold):
+    """
+    Imprime as medições mais lentas (ou mais rápidas) do que no relatório `baseline` por mais
+    de `threshold` e devolve o número de regressões.
+    """
+    current, previous = timings(report), timings(baseline)
+    regressions = 0
+    print(f"\nComparação com {baseline['environment'].get('commit') or 'o relatório anterior'}:")
+    for key in sorted(current.keys() & previous.keys(), key=str):
+        if previous[key] <= 0:
+            continue
+        change = current[key] / previous[key] - 1
+        if abs(change) > threshold:
+            label = "REGRESSÃO" if change > 0 else "melhoria"
+            regressions += change > 0
+            print(f"  - {label}: escala {key[0]} {key[1]}/{key[2]}: {previous[key]:.4f} s -> {current[key]:.4f} s ({change:+.0%})")
+    print(f"{regressions} regressões acima de {threshold:.0%}.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do parser, do ETL e do dashboard sobre ficheiros SNAP sintéticos.")
+    parser.add_argument("--scales", type=float, nargs='+', default=[1.0],
+                        help="Fatores de escala dos ficheiros gerados (1 = 10 000 produtos)")
+    add_scale_arguments(parser)
+    parser.add_argument("--work-dir", default=os.path.join(PROJECT_ROOT, 'out', 'bench'),
+                        help="Diretório dos ficheiros gerados (reutilizados se já existirem)")
+    parser.add_argument("--repeat", type=int, default=3, help="Número de execuções de cada medição")
+    parser.add_argument("--json", help="Ficheiro JSON onde gravar os resultados")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior, para comparar os tempos")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="Variação relativa a partir da qual uma diferença é indicada (0.10 = 10%%)")
+    parser.add_argument("--db-host", help="Host do banco de dados (sem ele só o parser é medido)")
+    parser.add_argument("--db-port", type=int, default=5432)
+    parser.add_argument("--db-name")
+    parser.add_argument("--db-user")
+    parser.add_argument("--db-pass")
+    parser.add_argument("--etl-args", default="--loader copy", help="Argumentos extra do tp1_3.2.py")
+    parser.add_argument("--dashboard-args", default="", help="Argumentos extra do tp1_3.3.py")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat deve ser pelo menos 1")
+    if args.db_host and not (args.db_name and args.db_user and args.db_pass):
+        parser.error("com --db-host são precisos também --db-name, --db-user e --db-pass")
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key != 'db_pass'}
+    report = {'environment': environment(), 'config': config, 'results': []}
+    for scale_factor in args.scales:
+        scale = scale_from_args(args, scale_factor)
+        name = '_'.join(f"{field}{value}" for field, value in scale._asdict().items() if value is not None)
+        path = os.path.join(args.work_dir, f"snap_{name}.txt")
+        meta_path = path + '.json'
+        if os.path.exists(path) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                dataset = json.load(f)
+        else:
+            print(f"A gerar {path}...")
+            dataset = generate_snap(path, scale)
+            with open(meta_path, 'w') as f:
+                json.dump(dataset, f)
+        print(f"\n===== Escala {scale_factor}: {dataset['products']} produtos, {dataset['reviews']} reviews "
+              f"({dataset['bytes'] / (1024 * 1024):.1f} MB) =====")
+
+        run = {'scale': scale_factor, 'parameters': scale._asdict(), 'dataset': dataset}
+        run['parser'] = bench_parser(path, dataset['bytes'], args.repeat)
+        for backend, data in run['parser'].items():
+            print(f"parser [{backend}]: {data['seconds']['median']:.3f} s "
+                  f"({data['products_per_second']:,.0f} produtos/s, {data['mb_per_second']:.1f} MB/s)")
+        if args.db_host:
+            run['etl'] = bench_etl(path, args)
+            for stage, data in run['etl']['stages'].items():
+                print(f"etl {stage}: {data['median']:.3f} s")
+            print(f"etl total: {run['etl']['total_seconds']['median']:.3f} s, pico de memória {run['etl']['peak_rss_mb']} MB")
+            run['dashboard'] = bench_dashboard(dataset['busiest_asin'], args)
+            for query, data in run['dashboard']['queries'].items():
+                print(f"dashboard {query}: {data['median']:.4f} s")
+        report['results'].append(run)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados gravados em: {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        compare(report, baseline, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
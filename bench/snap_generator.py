@@ -0,0 +1,182 @@
+"""
+Gerador determinístico de ficheiros sintéticos no formato SNAP (o formato lido pelo parse_snap).
+
+Com a mesma semente e os mesmos parâmetros o ficheiro gerado é sempre igual, byte a byte,
+por isso serve para benchmarks repetíveis sem o ficheiro original (977 MB). A escala é dada
+por um fator (--scale, 1 = 10 000 produtos) ou diretamente pelo número de produtos, e pode
+ser ajustada com:
+- o número médio de reviews por produto (entre 0 e o dobro da média, mais alguns produtos
+  muito comentados);
+- a profundidade da árvore de categorias (e o número de filhos de cada categoria);
+- o número de produtos similares de cada produto (alguns com ASINs que não existem no
+  ficheiro, como no dump original).
+
+Uso:
+    python bench/snap_generator.py --output /tmp/snap_sf1.txt --scale 1
+    python bench/snap_generator.py --output /tmp/snap.txt.gz --products 50000 --reviews-per-product 8 --category-depth 6
+"""
+
+import argparse
+import gzip
+import random
+from collections import namedtuple
+
+PRODUCTS_PER_SCALE = 10000
+GROUPS = ('Book', 'Music', 'DVD', 'Video', 'Toy', 'Software')
+TITLE_WORDS = ('amazon', 'guide', 'history', 'music', 'love', 'world', 'complete', 'edition',
+               'children', 'science', 'café', 'über', 'night', 'garden', 'river', 'secret')
+ROOT_CATEGORY = ('Books', 283155)
+DISCONTINUED_EVERY = 50     # 1 em cada 50 produtos é "discontinued product" (só Id e ASIN)
+UNKNOWN_SIMILAR_RATE = 0.05 # fração dos similares com ASINs que não estão no ficheiro
+HEAVY_REVIEWS_RATE = 0.01   # fração dos produtos com 20x a média de reviews
+
+# parâmetros de escala de um ficheiro gerado
+SnapScale = namedtuple('SnapScale', ['products', 'reviews_per_product', 'category_depth',
+                                     'category_fanout', 'similar_fanout', 'customers', 'seed'])
+SnapScale.__new__.__defaults__ = (PRODUCTS_PER_SCALE, 5, 4, 4, 5, None, 42)
+
+
+def scale_for(scale_factor, **overrides):
+    """
+    Parâmetros para um fator de escala (1 = PRODUCTS_PER_SCALE produtos), com os restantes
+    parâmetros por padrão ou dados em `overrides`.
+    """
+    overrides.setdefault('products', int(scale_factor * PRODUCTS_PER_SCALE))
+    return SnapScale(**overrides)
+
+
+def _asin(index):
+    # ASINs de 10 caracteres, alguns terminados em X como os ISBN
+    asin = f"{index:010d}"
+    return asin[:-1] + 'X' if index % 7 == 0 else asin
+
+
+class _CategoryTree:
+    """
+    Árvore de categorias com `depth` níveis abaixo da raiz e `fanout` filhos por categoria.
+    Os IDs são atribuídos pela ordem em que cada categoria aparece pela primeira vez.
+    """
+
+    def __init__(self, depth, fanout):
+        self.depth = depth
+        self.fanout = fanout
+        self._ids = {}
+
+    def random_path(self, rnd):
+        path = [ROOT_CATEGORY]
+        key = ()
+        for level in range(1, rnd.randint(1, self.depth) + 1):
+            key += (rnd.randrange(self.fanout),)
+            if key not in self._ids:
+                self._ids[key] = 1000 + len(self._ids)
+            path.append((f"Level{level} {'-'.join(map(str, key))}", self._ids[key]))
+        return path
+
+    def __len__(self):
+        return len(self._ids) + 1
+
+
+def _review_count(rnd, mean):
+    if rnd.random() < HEAVY_REVIEWS_RATE:
+        return mean * 20
+    return rnd.randint(0, 2 * mean)
+
+
+def _review_line(rnd, customers):
+    return (f"    {rnd.randint(1995, 2005)}-{rnd.randint(1, 12)}-{rnd.randint(1, 28)}"
+            f"  cutomer: A{rnd.randrange(customers):09d}"
+            f"  rating: {rnd.randint(1, 5)}  votes: {rnd.randint(0, 30):>3}  helpful: {rnd.randint(0, 10):>3}\n")
+
+
+def generate_snap(path, scale=SnapScale()):
+    """
+    Grava em `path` (comprimido se terminar em .gz) um ficheiro SNAP com os parâmetros de
+    `scale` e devolve um dicionário com o que foi gerado: número de produtos, reviews,
+    categorias e similares, tamanho em bytes e o ASIN do produto com mais reviews.
+    """
+    rnd = random.Random(scale.seed)
+    customers = scale.customers or max(1, scale.products // 2)
+    tree = _CategoryTree(scale.category_depth, scale.category_fanout)
+    stats = {'products': scale.products, 'reviews': 0, 'similar': 0, 'busiest_asin': None, 'busiest_reviews': -1}
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8', newline='\n') as f:
+        f.write("# Full information about Amazon Share the Love products\n")
+        f.write(f"Total items: {scale.products}\n\n")
+        for index in range(scale.products):
+            f.write(f"Id:   {index}\nASIN: {_asin(index)}\n")
+            if index % DISCONTINUED_EVERY == DISCONTINUED_EVERY - 1:
+                f.write("  discontinued product\n\n")
+                continue
+            words = ' '.join(rnd.sample(TITLE_WORDS, 3))
+            f.write(f"  title: Product {index} {words}\n")
+            f.write(f"  group: {rnd.choice(GROUPS)}\n")
+            f.write(f"  salesrank: {rnd.randint(0, 20 * scale.products)}\n")
+
+            similar = []
+            for _ in range(rnd.randint(0, 2 * scale.similar_fanout)):
+                if rnd.random() < UNKNOWN_SIMILAR_RATE:
+                    similar.append(_asin(scale.products + rnd.randrange(scale.products)))
+                else:
+                    similar.append(_asin(rnd.randrange(scale.products)))
+            f.write(f"  similar: {len(similar)}" + ''.join(f"  {asin}" for asin in similar) + "\n")
+            stats['similar'] += len(similar)
+
+            paths = [tree.random_path(rnd) for _ in range(rnd.randint(0, 3))]
+            f.write(f"  categories: {len(paths)}\n")
+            for category_path in paths:
+                f.write("   " + ''.join(f"|{name}[{category_id}]" for name, category_id in category_path) + "\n")
+
+            reviews = _review_count(rnd, scale.reviews_per_product)
+            f.write(f"  reviews: total: {reviews}  downloaded: {reviews}  avg rating: {rnd.choice(('3', '4', '4.5', '5'))}\n")
+            for _ in range(reviews):
+                f.write(_review_line(rnd, customers))
+            f.write("\n")
+            stats['reviews'] += reviews
+            if reviews > stats['busiest_reviews']:
+                stats['busiest_asin'], stats['busiest_reviews'] = _asin(index), reviews
+
+    stats['categories'] = len(tree)
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        stats['bytes'] = f.tell()
+    return stats
+
+
+def add_scale_arguments(parser):
+    parser.add_argument("--products", type=int, help=f"Número de produtos (por padrão, {PRODUCTS_PER_SCALE} vezes o fator de escala)")
+    parser.add_argument("--reviews-per-product", type=int, default=SnapScale().reviews_per_product,
+                        help="Número médio de reviews por produto")
+    parser.add_argument("--category-depth", type=int, default=SnapScale().category_depth,
+                        help="Profundidade máxima da árvore de categorias, abaixo da raiz")
+    parser.add_argument("--category-fanout", type=int, default=SnapScale().category_fanout,
+                        help="Número de filhos de cada categoria")
+    parser.add_argument("--similar-fanout", type=int, default=SnapScale().similar_fanout,
+                        help="Número médio de produtos similares de cada produto")
+    parser.add_argument("--seed", type=int, default=SnapScale().seed, help="Semente do gerador (a mesma semente gera o mesmo ficheiro)")
+
+
+def scale_from_args(args, scale_factor):
+    options = {
+        'reviews_per_product': args.reviews_per_product, 'category_depth': args.category_depth,
+        'category_fanout': args.category_fanout, 'similar_fanout': args.similar_fanout, 'seed': args.seed,
+    }
+    if args.products is not None:
+        options['products'] = args.products
+    return scale_for(scale_factor, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera um ficheiro SNAP sintético e determinístico.")
+    parser.add_argument("--output", required=True, help="Ficheiro gerado (comprimido com gzip se terminar em .gz)")
+    parser.add_argument("--scale", type=float, default=1.0, help=f"Fator de escala (1 = {PRODUCTS_PER_SCALE} produtos)")
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+
+    stats = generate_snap(args.output, scale_from_args(args, args.scale))
+    print(f"{args.output}: {stats['products']} produtos, {stats['reviews']} reviews, "
+          f"{stats['categories']} categorias, {stats['similar']} similares ({stats['bytes'] / (1024 * 1024):.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+--chaves estrangeiras e índices secundários, separados do schema.sql para que a carga inicial
+--em massa (--bulk) possa criá-los só depois de todos os dados carregados.
+--Cada comando é executado como um passo separado pelo ETL (src/constraints.py), que ignora os
+--índices e chaves que já existem; as chaves estrangeiras são criadas como NOT VALID e validadas
+--a seguir, para que a validação de tabelas diferentes possa correr em paralelo
+
+-- Índices para joins e recursão
+CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_code
+    ON Customers(customer_code);
+
+CREATE INDEX IF NOT EXISTS idx_reviews_product_id
+    ON Reviews(product_id);
+
+CREATE INDEX IF NOT EXISTS idx_product_category_product_id
+    ON Product_category(product_id);
+
+-- procura de produtos pelo título no dashboard (src/title_search.py): prefixo e texto completo;
+-- o índice de trigramas (pg_trgm) só é criado, pelo src/constraints.py, se o servidor tiver a extensão
+CREATE INDEX IF NOT EXISTS idx_products_titulo_prefix
+    ON Products(lower(titulo) text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS idx_products_titulo_fts
+    ON Products USING GIN (to_tsvector('simple', titulo));
+
+-- a chave primária de Related_products já serve as buscas por product1_id
+CREATE INDEX IF NOT EXISTS idx_related_products_product2_id
+    ON Related_products(product2_id);
+
+CREATE INDEX IF NOT EXISTS idx_product_category_category_id
+    ON Product_category(category_id);
+
+CREATE INDEX IF NOT EXISTS idx_categories_parent_id
+    ON Category_Hierarchy(parent_category_id);
+
+CREATE INDEX IF NOT EXISTS idx_child_category_id
+    ON Category_Hierarchy(child_category_id);
+CREATE INDEX IF NOT EXISTS idx_category_closure_descendant_id
+    ON Category_Closure(descendant_id);
+
+-- Chaves estrangeiras (com os mesmos nomes que o PostgreSQL dava às chaves declaradas no CREATE TABLE)
+ALTER TABLE Category_Hierarchy ADD CONSTRAINT category_hierarchy_parent_category_id_fkey
+    FOREIGN KEY (parent_category_id) REFERENCES Categories(category_id);
+
+ALTER TABLE Category_Hierarchy ADD CONSTRAINT category_hierarchy_child_category_id_fkey
+    FOREIGN KEY (child_category_id) REFERENCES Categories(category_id);
+
+ALTER TABLE Category_Closure ADD CONSTRAINT category_closure_ancestor_id_fkey
+    FOREIGN KEY (ancestor_id) REFERENCES Categories(category_id);
+
+ALTER TABLE Category_Closure ADD CONSTRAINT category_closure_descendant_id_fkey
+    FOREIGN KEY (descendant_id) REFERENCES Categories(category_id);
+
+ALTER TABLE reviews ADD CONSTRAINT reviews_product_id_fkey
+    FOREIGN KEY (product_id) REFERENCES Products(source_id);
+
+ALTER TABLE reviews ADD CONSTRAINT reviews_customer_id_fkey
+    FOREIGN KEY (customer_id) REFERENCES Customers(customer_id);
+
+ALTER TABLE Related_products ADD CONSTRAINT related_products_product1_id_fkey
+    FOREIGN KEY (product1_id) REFERENCES Products(source_id);
+
+ALTER TABLE Related_products ADD CONSTRAINT related_products_product2_id_fkey
+    FOREIGN KEY (product2_id) REFERENCES Products(source_id);
+
+ALTER TABLE Product_category ADD CONSTRAINT product_category_product_id_fkey
+    FOREIGN KEY (product_id) REFERENCES Products(source_id);
+
+ALTER TABLE Product_category ADD CONSTRAINT product_category_category_id_fkey
+    FOREIGN KEY (category_id) REFERENCES Categories(category_id);
@@ -1,31 +1,39 @@
---limpeza de tabelas antigas caso por algum motivo não tenham sido apagadas
-DROP TABLE IF EXISTS Product_category CASCADE;
-DROP TABLE IF EXISTS Related_products CASCADE;
-DROP TABLE IF EXISTS Reviews CASCADE;
-DROP TABLE IF EXISTS Products CASCADE;
-DROP TABLE IF EXISTS Category_Hierarchy CASCADE;
-DROP TABLE IF EXISTS Categories CASCADE;
-DROP MATERIALIZED VIEW IF EXISTS ProductReviewSummary; -- Adicionado por segurança
+--criação das tabelas. Todos os comandos são idempotentes (IF NOT EXISTS) para que o esquema
+--possa ser aplicado sobre uma base já carregada no modo incremental (--incremental).
+--As tabelas só têm as chaves primárias/únicas (usadas pelos upserts do ETL) e os CHECKs; as chaves
+--estrangeiras e os índices secundários estão em constraints.sql, aplicado antes da carga ou,
+--no modo --bulk, só depois de todos os dados carregados
 
 --tabela que guarda as categorias
-CREATE TABLE Categories (
+CREATE TABLE IF NOT EXISTS Categories (
     category_id SERIAL PRIMARY KEY,
     category_source_id INT UNIQUE NOT NULL,
     category_name TEXT NOT NULL
 );
 
 -- Tabela que armazena explicitamente as relações de hierarquia
-CREATE TABLE Category_Hierarchy (
-    parent_category_id INT REFERENCES Categories(category_id),
-    child_category_id INT REFERENCES Categories(category_id),
+CREATE TABLE IF NOT EXISTS Category_Hierarchy (
+    parent_category_id INT,
+    child_category_id INT,
     PRIMARY KEY (parent_category_id, child_category_id),
     CHECK (parent_category_id <> child_category_id)
 );
 
---tabela que guarda os produtos
-CREATE TABLE Products (
-    source_id INT NOT NULL UNIQUE,
-    asin VARCHAR(20) PRIMARY KEY,
+-- fecho transitivo da hierarquia: uma linha por (ancestral, descendente) a qualquer distância,
+-- incluindo a própria categoria (depth = 0). Calculado pelo ETL a partir da hierarquia lida
+CREATE TABLE IF NOT EXISTS Category_Closure (
+    ancestor_id INT,
+    descendant_id INT,
+    depth SMALLINT NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id),
+    CHECK (depth >= 0)
+);
+
+--tabela que guarda os produtos. A chave é o source_id (o Id do ficheiro), um inteiro usado
+--por todas as tabelas que referenciam produtos; o ASIN só aparece aqui
+CREATE TABLE IF NOT EXISTS Products (
+    source_id INT PRIMARY KEY,
+    asin VARCHAR(20) NOT NULL UNIQUE,
     titulo TEXT NOT NULL,
     group_name TEXT NOT NULL,
     salesrank INT,
@@ -36,11 +44,18 @@ CREATE TABLE Products (
     categories_count INT DEFAULT 0 NOT NULL
 );
 
+--dimensão dos clientes: o código do ficheiro (ex.: A2JW67OY8U6HHK) é guardado uma só vez e as
+--reviews referenciam o cliente por um ID inteiro, atribuído pelo próprio ETL durante o parsing
+CREATE TABLE IF NOT EXISTS Customers (
+    customer_id   INT PRIMARY KEY,
+    customer_code VARCHAR(20) NOT NULL
+);
+
 --tabela que relaciona as reviews com os consumidores, os produtos e diz informações sobre essas reviews
-CREATE TABLE reviews (
+CREATE TABLE IF NOT EXISTS reviews (
     review_id      SERIAL PRIMARY KEY,
-    product_asin   VARCHAR(20) NOT NULL REFERENCES Products(asin),         
-    customer_id    VARCHAR(20) NOT NULL,                
+    product_id     INT NOT NULL,         
+    customer_id    INT NOT NULL,                
     rating         SMALLINT NOT NULL,            
     review_date    DATE NOT NULL,
     votes          INT DEFAULT 0 NOT NULL, 
@@ -49,32 +64,54 @@ CREATE TABLE reviews (
 );
 
 --tabela que guarda os produtos relacionados entre si
-CREATE TABLE Related_products (
-    product1_asin VARCHAR(20) REFERENCES Products(asin),
-    product2_asin VARCHAR(20) REFERENCES Products(asin),
-    PRIMARY KEY (product1_asin, product2_asin),
-    CHECK (product1_asin < product2_asin)
+CREATE TABLE IF NOT EXISTS Related_products (
+    product1_id INT,
+    product2_id INT,
+    PRIMARY KEY (product1_id, product2_id),
+    CHECK (product1_id < product2_id)
 );
 
-CREATE TABLE Product_category (
-    product_asin VARCHAR(20) REFERENCES Products(asin),
-    category_id INT REFERENCES Categories(category_id),
-    PRIMARY KEY (product_asin, category_id) --já torna os 2 em not null
+CREATE TABLE IF NOT EXISTS Product_category (
+    product_id INT,
+    category_id INT,
+    PRIMARY KEY (product_id, category_id) --já torna os 2 em not null
 );
 
 
--- Índices para joins e recursão
-CREATE INDEX idx_reviews_product_asin
-    ON Reviews(product_asin);
+-- Tabelas de controle do ETL incremental/retomável
 
-CREATE INDEX idx_product_category_product_asin
-    ON Product_category(product_asin);
+-- ponto de retomada de cada ficheiro de entrada: posição (em bytes) e source_id do último
+-- produto gravado num lote já confirmado (commit). load_id identifica a carga (uma carga
+-- retomada continua com o mesmo load_id)
+CREATE TABLE IF NOT EXISTS etl_checkpoint (
+    input_name     TEXT PRIMARY KEY,
+    input_size     BIGINT NOT NULL,
+    load_id        INT NOT NULL,
+    byte_offset    BIGINT,
+    last_source_id INT,
+    completed      BOOLEAN DEFAULT FALSE NOT NULL,
+    updated_at     TIMESTAMPTZ DEFAULT now() NOT NULL
+);
 
-CREATE INDEX idx_product_category_category_id
-    ON Product_category(category_id);
+-- hash do conteúdo de cada produto (campos, categorias, similares e reviews), usado para
+-- aplicar apenas os produtos alterados quando um novo dump é carregado, e a carga que o gravou
+CREATE TABLE IF NOT EXISTS etl_product_hash (
+    asin         VARCHAR(20) PRIMARY KEY,
+    content_hash BYTEA NOT NULL,
+    load_id      INT NOT NULL
+);
 
-CREATE INDEX idx_categories_parent_id
-    ON Category_Hierarchy(parent_category_id);
+-- pares de produtos similares (já ordenados, product1_asin < product2_asin) acumulados ao longo
+-- da carga, para que sobrevivam a uma interrupção; são filtrados e copiados para Related_products no fim
+CREATE TABLE IF NOT EXISTS etl_related_staging (
+    product1_asin VARCHAR(20) NOT NULL,
+    product2_asin VARCHAR(20) NOT NULL
+);
 
-CREATE INDEX idx_child_category_id
-    ON Category_Hierarchy(child_category_id);
\ No newline at end of file
+-- versão dos dados (uma única linha): um identificador novo gravado no fim de cada carga
+-- concluída e apagado no início de cada carga, usado pela cache de resultados do dashboard
+CREATE TABLE IF NOT EXISTS etl_data_version (
+    id        BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version   TEXT NOT NULL,
+    loaded_at TIMESTAMPTZ DEFAULT now() NOT NULL
+);
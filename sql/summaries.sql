@@ -0,0 +1,86 @@
+--tabelas de resumo (materialized views) lidas pelas consultas gerais do dashboard (4 a 7)
+--criadas vazias (WITH NO DATA) e preenchidas no fim de cada execução do ETL (src/summaries.py)
+--os índices únicos são necessários para o REFRESH ... CONCURRENTLY
+
+--consulta 5: estatísticas das avaliações positivas (rating >= 3) de cada produto
+CREATE MATERIALIZED VIEW IF NOT EXISTS ProductReviewSummary AS
+    SELECT
+        r.product_id,
+        SUM(r.helpful) AS total_helpful,
+        AVG(r.helpful) AS media_avaliacoes_uteis,
+        COUNT(r.review_id) AS total_avaliacoes_positivas
+    FROM reviews r
+    WHERE r.rating >= 3
+    GROUP BY r.product_id
+WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_product_review_summary_product_id ON ProductReviewSummary(product_id);
+CREATE INDEX IF NOT EXISTS idx_product_review_summary_media ON ProductReviewSummary(media_avaliacoes_uteis DESC);
+
+--consulta 6: totais de cada categoria sobre toda a sua subárvore, a partir do resumo por produto.
+--cada produto conta uma vez por categoria, mesmo que esteja ligado a várias categorias da subárvore
+--(um produto é ligado a todas as categorias do caminho até à raiz)
+CREATE MATERIALIZED VIEW IF NOT EXISTS CategoryReviewSummary AS
+    WITH
+    SubtreeProducts AS (
+        SELECT DISTINCT cc.ancestor_id AS category_id, pc.product_id
+        FROM Product_category pc
+        JOIN Category_Closure cc ON cc.descendant_id = pc.category_id
+    ),
+    SubtreeTotals AS (
+        SELECT
+            sp.category_id,
+            SUM(prs.total_helpful) AS total_helpful,
+            SUM(prs.total_avaliacoes_positivas) AS total_reviews
+        FROM SubtreeProducts sp
+        JOIN ProductReviewSummary prs ON prs.product_id = sp.product_id
+        GROUP BY sp.category_id
+    )
+    SELECT
+        cat.category_id,
+        cat.category_name,
+        ROUND(st.total_helpful::DECIMAL / st.total_reviews, 2) AS media_avaliacoes_uteis,
+        st.total_reviews AS total_reviews_agregado
+    FROM SubtreeTotals st
+    JOIN Categories cat ON cat.category_id = st.category_id
+    WHERE st.total_reviews > 0
+WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_category_review_summary_category_id ON CategoryReviewSummary(category_id);
+CREATE INDEX IF NOT EXISTS idx_category_review_summary_media ON CategoryReviewSummary(media_avaliacoes_uteis DESC);
+
+--consulta 4: os 10 produtos com melhor salesrank de cada grupo
+CREATE MATERIALIZED VIEW IF NOT EXISTS GroupSalesRanking AS
+    WITH RankedProducts AS (
+        SELECT
+            p.source_id,
+            p.titulo,
+            p.group_name,
+            p.salesrank,
+            ROW_NUMBER() OVER(PARTITION BY p.group_name ORDER BY p.salesrank ASC) AS rank_in_group
+        FROM Products p
+        WHERE p.salesrank > 0 AND p.group_name IS NOT NULL
+    )
+    SELECT group_name, rank_in_group, source_id, titulo, salesrank
+    FROM RankedProducts
+    WHERE rank_in_group <= 10
+WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_group_sales_ranking ON GroupSalesRanking(group_name, rank_in_group);
+
+--consulta 7: os 10 clientes com mais avaliações em cada grupo de produtos
+CREATE MATERIALIZED VIEW IF NOT EXISTS GroupCustomerRanking AS
+    WITH CustomerRankByGroup AS (
+        SELECT
+            r.customer_id,
+            p.group_name,
+            COUNT(r.review_id) AS total_comentarios,
+            ROW_NUMBER() OVER(PARTITION BY p.group_name ORDER BY COUNT(r.review_id) DESC) AS rank_in_group
+        FROM reviews r
+        JOIN Products p ON r.product_id = p.source_id
+        WHERE p.group_name IS NOT NULL
+        GROUP BY r.customer_id, p.group_name
+    )
+    SELECT cr.group_name, cr.rank_in_group, cr.customer_id, c.customer_code, cr.total_comentarios
+    FROM CustomerRankByGroup cr
+    JOIN Customers c ON c.customer_id = cr.customer_id
+    WHERE cr.rank_in_group <= 10
+WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_group_customer_ranking ON GroupCustomerRanking(group_name, rank_in_group);
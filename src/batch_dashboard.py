@@ -0,0 +1,275 @@
+"""
+Consultas 1, 2 e 3 do dashboard para uma lista de produtos (tp1_3.3.py --products-file).
+
+Em vez de um processo (e uma conexão e três consultas) por produto, os produtos do
+ficheiro são procurados com uma só consulta (= ANY(%s)) e cada consulta é executada uma
+vez para todos os produtos de um lote:
+- consulta 1: as 5 avaliações mais úteis de cada produto, pelas duas ordens, com
+  ROW_NUMBER() OVER (PARTITION BY produto);
+- consulta 2: os produtos similares de todos os produtos do lote;
+- consulta 3: a evolução diária das médias, agrupada por produto e dia.
+
+Os resultados são gravados num CSV por produto (os mesmos ficheiros do modo de um só
+produto) ou num único CSV por consulta, com a coluna asin (--combined).
+"""
+
+import csv
+import os
+import sys
+import time
+
+from metrics import METRICS
+from title_search import search_titles
+
+# tipos de identificador aceites no ficheiro de produtos
+PRODUCT_KEYS = ('asin', 'id', 'title')
+DEFAULT_BATCH_SIZE = 1000
+MAX_SOURCE_ID = 2 ** 31 - 1 # source_id é INT4
+
+RESOLVE_SQL = {
+    'asin': "SELECT asin, source_id, asin FROM Products WHERE asin = ANY(%s)",
+    'id': "SELECT source_id, source_id, asin FROM Products WHERE source_id = ANY(%s::int[])",
+    # título exato (sem distinguir maiúsculas), pelo índice idx_products_titulo_prefix
+    'title': """
+        SELECT DISTINCT ON (lower(titulo)) lower(titulo), source_id, asin FROM Products
+        WHERE lower(titulo) = ANY(%s)
+        ORDER BY lower(titulo), source_id
+    """,
+}
+
+BATCH_Q1_SQL = """
+    SELECT product_id, pos, neg, rating, helpful, votes, customer_id, review_date
+    FROM (
+        SELECT
+            r.product_id, r.rating, r.helpful, r.votes, c.customer_code AS customer_id, r.review_date,
+            ROW_NUMBER() OVER (PARTITION BY r.product_id ORDER BY r.helpful DESC, r.rating DESC) AS pos,
+            ROW_NUMBER() OVER (PARTITION BY r.product_id ORDER BY r.helpful DESC, r.rating ASC) AS neg
+        FROM reviews r
+        JOIN Customers c ON c.customer_id = r.customer_id
+        WHERE r.product_id = ANY(%s)
+    ) ranked
+    WHERE pos <= 5 OR neg <= 5
+"""
+BATCH_Q2_SQL = """
+    WITH Targets AS (
+        SELECT source_id, salesrank FROM Products WHERE source_id = ANY(%s)
+    ),
+    SimilarProducts AS (
+        SELECT t.source_id AS target_id, t.salesrank AS target_salesrank, rp.product2_id AS similar_id
+        FROM Targets t JOIN Related_products rp ON rp.product1_id = t.source_id
+        UNION ALL
+        SELECT t.source_id, t.salesrank, rp.product1_id
+        FROM Targets t JOIN Related_products rp ON rp.product2_id = t.source_id AND rp.product1_id <> t.source_id
+    )
+    SELECT s.target_id, p.asin, p.titulo, p.salesrank
+    FROM SimilarProducts s
+    JOIN Products p ON p.source_id = s.similar_id
+    WHERE p.salesrank IS NOT NULL
+      AND p.salesrank > 0
+      AND p.salesrank < s.target_salesrank
+    ORDER BY s.target_id, p.salesrank ASC
+"""
+BATCH_Q3_SQL = """
+    SELECT
+        product_id,
+        review_date,
+        COUNT(rating) AS num_avaliacoes,
+        CAST(AVG(rating) AS DECIMAL(3, 2)) AS media_avaliacoes
+    FROM reviews
+    WHERE product_id = ANY(%s)
+    GROUP BY product_id, review_date
+    ORDER BY product_id, review_date ASC
+"""
+
+Q1_COLUMNS = ['rating', 'helpful', 'votes', 'customer_id', 'review_date']
+Q2_COLUMNS = ['asin', 'titulo', 'salesrank']
+Q3_COLUMNS = ['review_date', 'num_avaliacoes', 'media_avaliacoes']
+
+# (nome do resultado, prefixo do ficheiro CSV, colunas)
+BATCH_RESULTS = (
+    ('q1_pos', 'q1_top5_reviews_pos', Q1_COLUMNS),
+    ('q1_neg', 'q1_top5_reviews_neg', Q1_COLUMNS),
+    ('q2', 'q2_similar_products_sales_melhor', Q2_COLUMNS),
+    ('q3', 'q3_evolucao_media_avaliacoes', Q3_COLUMNS),
+)
+
+
+def read_products_file(path):
+    """
+    Lê os identificadores do ficheiro, um por linha, sem repetições e pela ordem do ficheiro
+    (linhas vazias e começadas por '#' são ignoradas).
+    """
+    identifiers = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                identifiers.setdefault(line, None)
+    return list(identifiers)
+
+
+def resolve_products(cur, identifiers, key):
+    """
+    Devolve (produtos, não encontrados, repetidos): a lista de (identificador, source_id, asin)
+    pela ordem de `identifiers`, a lista dos identificadores sem produto e a lista de
+    (identificador, primeiro identificador) dos que indicam um produto já indicado antes,
+    que não é repetido nos resultados.
+    Os títulos que não são exatamente o título de um produto são procurados um a um com a
+    procura pelo título do dashboard (usado o produto mais parecido).
+    """
+    if key == 'id':
+        lookup = {}
+        for identifier in identifiers:
+            # um id fora do INT4 não pode ser um source_id e faria falhar o ::int[] do lote inteiro
+            if identifier.isascii() and identifier.isdigit() and int(identifier) <= MAX_SOURCE_ID:
+                lookup[identifier] = int(identifier)
+    elif key == 'title':
+        lookup = {identifier: identifier.lower() for identifier in identifiers}
+    else:
+        lookup = {identifier: identifier for identifier in identifiers}
+
+    cur.execute(RESOLVE_SQL[key], (list(set(lookup.values())),))
+    found = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+    products, missing, duplicates = [], [], []
+    first = {} # source_id -> primeiro identificador que o indicou
+    for identifier in identifiers:
+        product = found.get(lookup.get(identifier))
+        if product is None and key == 'title':
+            candidates, _ = search_titles(cur, identifier, limit=1)
+            product = candidates[0][:2] if candidates else None
+        if product is None:
+            missing.append(identifier)
+        elif product[0] in first:
+            duplicates.append((identifier, first[product[0]]))
+        else:
+            first[product[0]] = identifier
+            products.append((identifier, *product))
+    return products, missing, duplicates
+
+
+def run_batch_queries(cur, product_ids):
+    """
+    Executa as consultas 1, 2 e 3 para todos os produtos de `product_ids` e devolve, para
+    cada resultado de BATCH_RESULTS, um dicionário source_id -> linhas (pela ordem da consulta
+    de um só produto).
+    """
+    results = {name: {product_id: [] for product_id in product_ids} for name, _, _ in BATCH_RESULTS}
+
+    cur.execute(BATCH_Q1_SQL, (product_ids,))
+    pos, neg = [], []
+    for product_id, pos_rank, neg_rank, *row in cur.fetchall():
+        if pos_rank <= 5:
+            pos.append((product_id, pos_rank, row))
+        if neg_rank <= 5:
+            neg.append((product_id, neg_rank, row))
+    for name, ranked in (('q1_pos', pos), ('q1_neg', neg)):
+        for product_id, _, row in sorted(ranked, key=lambda item: (item[0], item[1])):
+            results[name][product_id].append(row)
+
+    cur.execute(BATCH_Q2_SQL, (product_ids,))
+    for product_id, *row in cur.fetchall():
+        results['q2'][product_id].append(row)
+
+    cur.execute(BATCH_Q3_SQL, (product_ids,))
+    for product_id, *row in cur.fetchall():
+        results['q3'][product_id].append(row)
+    return results
+
+
+def _write_csv(path, columns, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n') # como o DataFrame.to_csv do modo de um só produto
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+class BatchResultWriter:
+    """
+    Grava os resultados dos lotes: um CSV por produto e consulta ou, com `combined`, um
+    único CSV por consulta (com a coluna asin antes das restantes).
+    """
+
+    def __init__(self, output, combined=False):
+        self.output = output
+        self.combined = combined
+        self.files = 0
+        self.rows = {name: 0 for name, _, _ in BATCH_RESULTS}
+        self._combined_files = {}
+        if output:
+            os.makedirs(output, exist_ok=True)
+
+    def write(self, products, results):
+        for name, prefix, columns in BATCH_RESULTS:
+            for _, product_id, asin in products:
+                rows = results[name][product_id]
+                self.rows[name] += len(rows)
+                if not self.output:
+                    continue
+                if self.combined:
+                    self._combined_writer(name, prefix, columns).writerows([asin, *row] for row in rows)
+                elif rows: # como no modo de um só produto, sem resultados não há ficheiro
+                    _write_csv(os.path.join(self.output, f"{prefix}_{asin}.csv"), columns, rows)
+                    self.files += 1
+
+    def _combined_writer(self, name, prefix, columns):
+        if name not in self._combined_files:
+            f = open(os.path.join(self.output, f"{prefix}_batch.csv"), 'w', encoding='utf-8', newline='')
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['asin', *columns])
+            self._combined_files[name] = (f, writer)
+            self.files += 1
+        return self._combined_files[name][1]
+
+    def close(self):
+        for f, _ in self._combined_files.values():
+            f.close()
+        self._combined_files = {}
+
+
+def run_batch(conn, args):
+    """
+    Modo --products-file: procura os produtos do ficheiro e executa as consultas 1, 2 e 3
+    em lotes de `args.batch_size` produtos, mostrando no fim o débito em produtos por segundo.
+    """
+    start_time = time.perf_counter()
+    identifiers = read_products_file(args.products_file)
+    with METRICS.stage('resolve_products'), conn.cursor() as cur:
+        products, missing, duplicates = resolve_products(cur, identifiers, args.products_key)
+        METRICS.add_rows(len(products), os.path.getsize(args.products_file))
+    conn.commit()
+    resolve_time = time.perf_counter() - start_time
+    print(f"\n{len(identifiers)} identificadores lidos de '{args.products_file}': "
+          f"{len(products)} produtos encontrados em {resolve_time:.4f} segundos.")
+    for identifier in missing:
+        print(f"AVISO: Nenhum produto encontrado com {args.products_key} '{identifier}'.", file=sys.stderr)
+    for identifier, previous in duplicates:
+        print(f"AVISO: {args.products_key} '{identifier}' indica o mesmo produto que '{previous}'; ignorado.", file=sys.stderr)
+
+    writer = BatchResultWriter(args.output, combined=args.combined)
+    query_time = 0.0
+    try:
+        for start in range(0, len(products), args.batch_size):
+            batch = products[start:start + args.batch_size]
+            batch_start = time.perf_counter()
+            with METRICS.stage('batch_queries'):
+                with conn.cursor() as cur:
+                    results = run_batch_queries(cur, [product_id for _, product_id, _ in batch])
+                conn.commit()
+                query_time += time.perf_counter() - batch_start
+                writer.write(batch, results)
+                METRICS.add_rows(len(batch), products=len(batch),
+                                 **{name: sum(len(rows) for rows in results[name].values()) for name, _, _ in BATCH_RESULTS})
+            print(f"  - {min(start + args.batch_size, len(products))}/{len(products)} produtos processados")
+    finally:
+        writer.close()
+
+    total_time = time.perf_counter() - start_time
+    print(f"\n{'='*10} Consultas 1, 2 e 3 para {len(products)} produtos {'='*10}")
+    for name, prefix, _ in BATCH_RESULTS:
+        print(f"  - {prefix}: {writer.rows[name]} linhas")
+    if args.output:
+        print(f"--> {writer.files} ficheiros CSV gravados em: {args.output}")
+    print(f"Tempo das consultas: {query_time:.4f} s; tempo total: {total_time:.4f} s")
+    if total_time > 0:
+        print(f"Débito: {len(products) / total_time:.1f} produtos/s")
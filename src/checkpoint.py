@@ -0,0 +1,138 @@
+"""
+Ponto de retomada (checkpoint) do ETL, guardado na tabela etl_checkpoint.
+
+Para cada ficheiro de entrada (identificado pelo nome e pelo tamanho) é guardada a posição,
+em bytes, e o source_id do último produto de um lote já confirmado no banco. Se a carga for
+interrompida, uma nova execução com --incremental continua a leitura a partir desse produto
+em vez de recomeçar do início do ficheiro.
+
+Com várias threads escritoras os lotes podem ser confirmados fora de ordem, por isso a posição
+só avança até ao último lote de uma sequência contínua de lotes confirmados (CheckpointTracker).
+
+A tabela etl_data_version guarda a versão dos dados: é apagada no início de cada carga e
+recebe um identificador novo quando a carga termina, o que invalida a cache do dashboard.
+"""
+
+import os
+import threading
+import uuid
+
+READ_SQL = """
+    SELECT input_size, load_id, byte_offset, last_source_id, completed
+    FROM etl_checkpoint WHERE input_name = %s
+"""
+# cada nova carga (não retomada) recebe um load_id maior que todos os anteriores
+RESET_SQL = """
+    INSERT INTO etl_checkpoint (input_name, input_size, load_id, byte_offset, last_source_id, completed, updated_at)
+    VALUES (%s, %s, (SELECT COALESCE(MAX(load_id), 0) + 1 FROM etl_checkpoint), NULL, NULL, FALSE, now())
+    ON CONFLICT (input_name) DO UPDATE SET
+        input_size = EXCLUDED.input_size,
+        load_id = EXCLUDED.load_id,
+        byte_offset = NULL,
+        last_source_id = NULL,
+        completed = FALSE,
+        updated_at = now()
+    RETURNING load_id
+"""
+# a posição nunca recua, mesmo que duas escritoras gravem o checkpoint fora de ordem
+SAVE_SQL = """
+    UPDATE etl_checkpoint SET byte_offset = %s, last_source_id = %s, updated_at = now()
+    WHERE input_name = %s AND (byte_offset IS NULL OR byte_offset < %s)
+"""
+COMPLETE_SQL = "UPDATE etl_checkpoint SET completed = TRUE, updated_at = now() WHERE input_name = %s"
+CLEAR_VERSION_SQL = "DELETE FROM etl_data_version"
+STAMP_VERSION_SQL = """
+    INSERT INTO etl_data_version (id, version, loaded_at) VALUES (TRUE, %s, now())
+    ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, loaded_at = EXCLUDED.loaded_at
+"""
+
+
+def input_identity(path):
+    """
+    Devolve (nome, tamanho em bytes) do ficheiro de entrada, a chave do checkpoint.
+    """
+    return os.path.basename(path), os.path.getsize(path)
+
+
+def read_checkpoint(cur, input_name, input_size):
+    """
+    Devolve (load_id, byte_offset, last_source_id) se existir uma carga incompleta do
+    mesmo ficheiro que possa ser retomada, ou None caso contrário.
+    """
+    cur.execute(READ_SQL, (input_name,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    size, load_id, byte_offset, last_source_id, completed = row
+    if completed or size != input_size or byte_offset is None:
+        return None
+    return load_id, byte_offset, last_source_id
+
+
+def reset_checkpoint(cur, input_name, input_size):
+    """
+    Começa uma nova carga do ficheiro (sem posição de retomada) e devolve o seu load_id.
+    """
+    cur.execute(RESET_SQL, (input_name, input_size))
+    return cur.fetchone()[0]
+
+
+def save_checkpoint(cur, input_name, position):
+    byte_offset, source_id = position
+    cur.execute(SAVE_SQL, (byte_offset, source_id, input_name, byte_offset))
+
+
+def complete_checkpoint(cur, input_name):
+    cur.execute(COMPLETE_SQL, (input_name,))
+
+
+def clear_data_version(cur):
+    """
+    Marca os dados como em carga (sem versão): enquanto isso o dashboard não usa a cache.
+    """
+    cur.execute(CLEAR_VERSION_SQL)
+
+
+def stamp_data_version(cur):
+    """
+    Grava uma nova versão dos dados (fim de uma carga) e devolve-a.
+    """
+    version = uuid.uuid4().hex
+    cur.execute(STAMP_VERSION_SQL, (version,))
+    return version
+
+
+def read_data_version(cur):
+    """
+    Devolve a versão dos dados, ou None se houver uma carga em curso (ou a tabela não existir).
+    """
+    cur.execute("SELECT to_regclass('etl_data_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT version FROM etl_data_version")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+class CheckpointTracker:
+    """
+    Marca d'água dos lotes confirmados: cada lote tem um número de sequência (pela ordem
+    do ficheiro) e a posição do seu último produto. `commit()` devolve a nova posição de
+    retomada quando a sequência contínua de lotes confirmados avança.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = 0
+        self._done = {}
+
+    def commit(self, seq, position):
+        with self._lock:
+            self._done[seq] = position
+            advanced = None
+            while self._next in self._done:
+                position = self._done.pop(self._next)
+                if position is not None: # lote sem produtos válidos
+                    advanced = position
+                self._next += 1
+            return advanced
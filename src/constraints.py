@@ -0,0 +1,212 @@
+"""
+Chaves estrangeiras e índices secundários (sql/constraints.sql) e os passos da carga
+inicial em massa (--bulk) do ETL.
+
+Numa carga normal os índices e as chaves são criados antes dos dados, como sempre foi.
+No modo --bulk as tabelas são carregadas só com as chaves primárias (e, opcionalmente,
+como UNLOGGED, sem escrever WAL) e tudo o resto é feito no fim, quando já não há
+inserções a manter várias árvores B e a verificar chaves linha a linha:
+1. as tabelas UNLOGGED voltam a ser LOGGED;
+2. os índices secundários são criados;
+3. as chaves estrangeiras são criadas como NOT VALID e depois validadas;
+4. as estatísticas das tabelas são atualizadas (ANALYZE).
+Os passos de tabelas diferentes correm em paralelo, cada tabela numa conexão própria,
+e o tempo de cada passo é impresso no fim.
+
+Uma tabela particionada (a tabela reviews, ver partitions.py) não guarda dados: o UNLOGGED
+e o LOGGED são aplicados a cada partição. O PostgreSQL também não aceita chaves estrangeiras
+NOT VALID em tabelas particionadas, por isso essas são criadas já validadas, no passo da validação.
+
+O índice de trigramas da procura pelo título (title_search.py) precisa da extensão pg_trgm, que
+nem todas as instalações do PostgreSQL têm; por isso não está no sql/constraints.sql e só é criado,
+junto com os outros índices, quando a extensão existe no servidor.
+"""
+
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+
+# tabelas escritas pelo ETL (as que passam a UNLOGGED durante a carga em massa)
+LOAD_TABLES = (
+    'Categories', 'Category_Hierarchy', 'Category_Closure', 'Products', 'Customers', 'reviews', 'Related_products', 'Product_category',
+    'etl_checkpoint', 'etl_product_hash', 'etl_related_staging'
+)
+# memória usada por cada conexão na ordenação da criação de índices e na validação das chaves
+MAINTENANCE_WORK_MEM = '256MB'
+
+# partições finais (com dados) das tabelas do ETL; uma tabela não particionada é a sua própria partição
+LEAF_TABLES_SQL = """
+    SELECT c.relname, c.relpersistence
+    FROM unnest(%s::regclass[]) AS t(relid)
+    CROSS JOIN LATERAL pg_partition_tree(t.relid) p
+    JOIN pg_class c ON c.oid = p.relid
+    WHERE p.isleaf
+"""
+
+# índice de trigramas da procura por qualquer parte do título (ILIKE '%...%')
+TRIGRAM_EXTENSION = 'pg_trgm'
+TRIGRAM_INDEX = (
+    'products', 'idx_products_titulo_trgm',
+    "CREATE INDEX IF NOT EXISTS idx_products_titulo_trgm ON Products USING GIN (titulo gin_trgm_ops)"
+)
+
+_INDEX_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+ON\s+(\w+)", re.IGNORECASE)
+_FOREIGN_KEY_RE = re.compile(r"ALTER\s+TABLE\s+(\w+)\s+ADD\s+CONSTRAINT\s+(\w+)\s+FOREIGN\s+KEY", re.IGNORECASE)
+
+
+def read_constraints(path):
+    """
+    Lê o ficheiro de índices e chaves estrangeiras e devolve duas listas de
+    (tabela, nome, comando): os índices e as chaves estrangeiras.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = re.sub(r"--[^\n]*", "", f.read()) # remove os comentários
+    indexes, foreign_keys = [], []
+    for statement in text.split(';'):
+        statement = ' '.join(statement.split())
+        if not statement:
+            continue
+        match = _INDEX_RE.match(statement)
+        if match:
+            indexes.append((match.group(2).lower(), match.group(1), statement))
+            continue
+        match = _FOREIGN_KEY_RE.match(statement)
+        if match:
+            foreign_keys.append((match.group(1).lower(), match.group(2), statement))
+            continue
+        raise ValueError(f"Comando não suportado em {path}: {statement}")
+    return indexes, foreign_keys
+
+
+def _leaf_tables(cur):
+    """
+    Devolve (nome, relpersistence) de cada partição final das tabelas do ETL.
+    """
+    cur.execute(LEAF_TABLES_SQL, (list(LOAD_TABLES),))
+    return cur.fetchall()
+
+
+def set_unlogged(conn):
+    """
+    Passa as tabelas do ETL (acabadas de criar, ainda vazias e sem chaves estrangeiras) a UNLOGGED.
+    """
+    with conn.cursor() as cur:
+        for table, _ in _leaf_tables(cur):
+            cur.execute(f"ALTER TABLE {table} SET UNLOGGED")
+    conn.commit()
+
+
+def _group_by_table(steps):
+    groups = {}
+    for table, name, sql in steps:
+        groups.setdefault(table, []).append((name, sql))
+    return groups
+
+
+def _run_groups(connect, groups, jobs, timings, settings):
+    """
+    Executa os passos de cada tabela em sequência, numa conexão própria, com até `jobs`
+    tabelas em paralelo. Acrescenta (passo, segundos) a `timings`.
+    """
+    def run(steps):
+        conn = connect()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                for name, value in settings.items():
+                    cur.execute(f"SET {name} = '{value}'")
+                for name, sql in steps:
+                    start = time.perf_counter()
+                    cur.execute(sql)
+                    timings.append((name, time.perf_counter() - start))
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for future in [pool.submit(run, steps) for steps in groups.values()]:
+            future.result()
+
+
+def _trigram_index(conn):
+    """
+    Cria a extensão pg_trgm, se o servidor a tiver, e devolve o passo do índice de trigramas
+    ([] sem a extensão, com um aviso: a procura pelo título usa então um ILIKE limitado).
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = %s", (TRIGRAM_EXTENSION,))
+        available = cur.fetchone() is not None
+        if available:
+            try:
+                cur.execute(f"CREATE EXTENSION IF NOT EXISTS {TRIGRAM_EXTENSION}")
+            except psycopg.Error as e:
+                conn.rollback()
+                print(f"AVISO: não foi possível criar a extensão {TRIGRAM_EXTENSION} ({e}); "
+                      f"o índice {TRIGRAM_INDEX[1]} não será criado.", file=sys.stderr)
+                return []
+    conn.commit()
+    if not available:
+        print(f"AVISO: extensão {TRIGRAM_EXTENSION} indisponível no servidor; o índice {TRIGRAM_INDEX[1]} "
+              "não será criado e a procura por parte do título será limitada.", file=sys.stderr)
+        return []
+    return [TRIGRAM_INDEX]
+
+
+def run_phase(connect, title, steps, jobs, settings=None):
+    """
+    Executa os passos (tabela, nome, comando) agrupados por tabela, com até `jobs` tabelas
+    em paralelo, e imprime o tempo total e o de cada passo. `settings` são os parâmetros
+    do servidor definidos em cada conexão (por padrão, o maintenance_work_mem).
+    """
+    if not steps:
+        return
+    if settings is None:
+        settings = {'maintenance_work_mem': MAINTENANCE_WORK_MEM}
+    timings = []
+    start = time.perf_counter()
+    _run_groups(connect, _group_by_table(steps), jobs, timings, settings)
+    print(f"Pós-carga: {title} em {time.perf_counter() - start:.4f} s")
+    for name, seconds in timings:
+        print(f"  - {name}: {seconds:.4f} s")
+
+
+def apply_constraints(conn, connect, path, jobs=1, analyze=False):
+    """
+    Cria os índices e as chaves estrangeiras que ainda não existem e volta a tornar LOGGED
+    as tabelas do ETL que estejam UNLOGGED. Com `analyze=True` atualiza também as estatísticas.
+    `connect()` cria as conexões usadas pelos passos paralelos (até `jobs` ao mesmo tempo).
+    """
+    indexes, foreign_keys = read_constraints(path)
+    indexes += _trigram_index(conn)
+    with conn.cursor() as cur:
+        unlogged = [table for table, persistence in _leaf_tables(cur) if persistence == 'u']
+        cur.execute("SELECT conname FROM pg_constraint WHERE contype = 'f'")
+        existing_keys = {row[0] for row in cur.fetchall()}
+        cur.execute("SELECT relname FROM pg_class WHERE relkind = 'p'")
+        partitioned = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    foreign_keys = [fk for fk in foreign_keys if fk[1] not in existing_keys]
+
+    run_phase(connect, "tabelas LOGGED", [
+        (table, f"SET LOGGED {table}", f"ALTER TABLE {table} SET LOGGED") for table in unlogged
+    ], jobs)
+    run_phase(connect, "índices secundários", indexes, jobs)
+    if foreign_keys:
+        # criar a chave como NOT VALID é imediato; a verificação das linhas fica para o VALIDATE,
+        # que só bloqueia a escrita na própria tabela e por isso pode correr em paralelo
+        with conn.cursor() as cur:
+            for table, _, sql in foreign_keys:
+                if table not in partitioned:
+                    cur.execute(sql + " NOT VALID")
+        conn.commit()
+        run_phase(connect, "validação das chaves estrangeiras", [
+            (table, name, sql) if table in partitioned else
+            (table, f"VALIDATE {name}", f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+            for table, name, sql in foreign_keys
+        ], jobs)
+    if analyze:
+        run_phase(connect, "estatísticas", [
+            (table.lower(), f"ANALYZE {table}", f"ANALYZE {table}") for table in LOAD_TABLES
+        ], jobs)
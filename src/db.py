@@ -1,5 +1,85 @@
 import sys
+import time
 import psycopg
+from metrics import METRICS
+
+
+# as conexões abertas por este módulo medem cada ida ao banco (execute, executemany, COPY,
+# leituras de cursores do lado do servidor, commit e rollback) para o relatório de métricas
+def _timed(method):
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            METRICS.record_db(time.perf_counter() - start)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class _TimedCopy:
+    """
+    Mede o início e o fim de um COPY (uma ida ao banco) e, num COPY TO, a leitura de cada bloco.
+    As escritas de um COPY FROM são feitas em Python e não contam como espera pelo banco.
+    """
+
+    def __init__(self, context):
+        self._context = context
+        self._copy = None
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._copy = self._context.__enter__()
+        METRICS.record_db(time.perf_counter() - start)
+        # os métodos de escrita, chamados uma vez por linha, são usados diretamente
+        self.write, self.write_row, self.set_types = self._copy.write, self._copy.write_row, self._copy.set_types
+        return self
+
+    def __exit__(self, *exc):
+        start = time.perf_counter()
+        try:
+            return self._context.__exit__(*exc)
+        finally:
+            METRICS.record_db(time.perf_counter() - start, round_trips=0)
+
+    def __iter__(self):
+        blocks = iter(self._copy)
+        while True:
+            start = time.perf_counter()
+            data = next(blocks, None)
+            METRICS.record_db(time.perf_counter() - start, round_trips=0)
+            if data is None:
+                return
+            yield data
+
+    def __getattr__(self, name):
+        return getattr(self._copy, name)
+
+
+class InstrumentedCursor(psycopg.Cursor):
+    execute = _timed(psycopg.Cursor.execute)
+    executemany = _timed(psycopg.Cursor.executemany)
+
+    def copy(self, statement, params=None, **kwargs):
+        return _TimedCopy(super().copy(statement, params, **kwargs))
+
+
+class InstrumentedServerCursor(psycopg.ServerCursor):
+    execute = _timed(psycopg.ServerCursor.execute)
+    fetchone = _timed(psycopg.ServerCursor.fetchone)
+    fetchmany = _timed(psycopg.ServerCursor.fetchmany)
+    fetchall = _timed(psycopg.ServerCursor.fetchall)
+
+
+class InstrumentedConnection(psycopg.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+        self.server_cursor_factory = InstrumentedServerCursor
+
+    commit = _timed(psycopg.Connection.commit)
+    rollback = _timed(psycopg.Connection.rollback)
+
 
 # devovlve uma conexão com o banco de dados
 def get_conn(host, port, dbname, user, password):
@@ -9,8 +89,22 @@ def get_conn(host, port, dbname, user, password):
     """
     try:
         conn_string = f"host={host} port={port} dbname={dbname} user={user} password={password}"
-        return psycopg.connect(conn_string)
+        return InstrumentedConnection.connect(conn_string)
 
     except psycopg.OperationalError as e:
         print(f"Erro ao conectar ao banco de dados: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+
+# devolve um pool de conexões, usado pelo dashboard para correr consultas em paralelo
+def get_pool(host, port, dbname, user, password, size):
+    """
+    Cria e retorna um pool (psycopg_pool) com `size` conexões abertas ao banco de dados.
+    """
+    try:
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        raise RuntimeError(
+            "Para executar as consultas em paralelo é preciso instalar o pacote 'psycopg-pool' (pip install psycopg-pool)."
+        )
+    conn_string = f"host={host} port={port} dbname={dbname} user={user} password={password}"
+    return ConnectionPool(conn_string, connection_class=InstrumentedConnection, min_size=size, max_size=size, open=True)
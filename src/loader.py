@@ -0,0 +1,265 @@
+"""
+Este módulo contém as estratégias de escrita em lote usadas pelo ETL (tp1_3.2.py).
+
+Existem dois modos de carga:
+- 'executemany': INSERT ... ON CONFLICT linha a linha (modo original);
+- 'copy': COPY binário do psycopg 3. Os produtos e as categorias dos produtos passam
+  por tabelas temporárias de staging e depois são fundidos com um INSERT ... SELECT,
+  mantendo exatamente a mesma semântica de upsert do modo 'executemany'. As reviews
+  não têm chave natural, por isso vão diretamente para a tabela final (ou, com a tabela
+  reviews particionada, diretamente para cada partição: ver partitions.py).
+
+Além das tabelas finais, cada lote grava também os pares de produtos similares na tabela
+de staging etl_related_staging e o hash do conteúdo de cada produto (etl_product_hash),
+usados para retomar uma carga interrompida e para a carga incremental.
+
+As duas estratégias registam quantas linhas foram escritas e quanto tempo foi gasto
+em cada tabela, para que seja possível comparar os modos (linhas/segundo).
+"""
+
+import time
+
+LOADER_MODES = ('executemany', 'copy')
+
+PRODUCTS_SQL = """
+    INSERT INTO Products (
+        source_id, asin, titulo, group_name, salesrank,
+        total_reviews, average_rating, qntd_downloads,
+        similar_products_count, categories_count
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (asin) DO UPDATE SET
+        titulo = EXCLUDED.titulo,
+        group_name = EXCLUDED.group_name,
+        salesrank = EXCLUDED.salesrank,
+        total_reviews = EXCLUDED.total_reviews,
+        average_rating = EXCLUDED.average_rating,
+        qntd_downloads = EXCLUDED.qntd_downloads,
+        similar_products_count = EXCLUDED.similar_products_count,
+        categories_count = EXCLUDED.categories_count
+"""
+CUSTOMERS_SQL = "INSERT INTO Customers (customer_id, customer_code) VALUES (%s, %s)"
+PRODCAT_SQL = "INSERT INTO Product_category (product_id, category_id) VALUES (%s, %s) ON CONFLICT DO NOTHING"
+REVIEWS_SQL = "INSERT INTO reviews (product_id, customer_id, rating, review_date, votes, helpful) VALUES (%s,%s,%s,%s,%s,%s)"
+RELATED_STAGING_SQL = "INSERT INTO etl_related_staging (product1_asin, product2_asin) VALUES (%s, %s)"
+PRODUCT_HASH_SQL = """
+    INSERT INTO etl_product_hash (asin, content_hash, load_id) VALUES (%s, %s, %s)
+    ON CONFLICT (asin) DO UPDATE SET content_hash = EXCLUDED.content_hash, load_id = EXCLUDED.load_id
+"""
+
+# tabelas temporárias usadas pelo modo 'copy'. São esvaziadas automaticamente a cada commit,
+# ou seja, a cada lote. Os tipos são os tipos "naturais" dos valores python (ex.: float8 para a
+# média), porque o COPY binário exige que o tipo enviado seja exatamente o tipo da coluna
+STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS stage_products (
+        source_id INT4, asin TEXT, titulo TEXT, group_name TEXT, salesrank INT4,
+        total_reviews INT4, average_rating FLOAT8, qntd_downloads INT4,
+        similar_products_count INT4, categories_count INT4
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stage_product_category (
+        product_id INT4, category_id INT4
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS stage_product_hash (
+        asin TEXT, content_hash BYTEA, load_id INT4
+    ) ON COMMIT DELETE ROWS;
+"""
+STAGE_PRODUCTS_COPY = "COPY stage_products FROM STDIN (FORMAT BINARY)"
+STAGE_PRODUCTS_TYPES = ["int4", "text", "text", "text", "int4", "int4", "float8", "int4", "int4", "int4"]
+STAGE_PRODCAT_COPY = "COPY stage_product_category FROM STDIN (FORMAT BINARY)"
+STAGE_PRODCAT_TYPES = ["int4", "int4"]
+CUSTOMERS_COPY = "COPY Customers (customer_id, customer_code) FROM STDIN (FORMAT BINARY)"
+CUSTOMERS_TYPES = ["int4", "varchar"]
+REVIEWS_COPY = "COPY reviews (product_id, customer_id, rating, review_date, votes, helpful) FROM STDIN (FORMAT BINARY)"
+REVIEWS_TYPES = ["int4", "int4", "int2", "date", "int4", "int4"]
+REVIEWS_PARTITION_COPY = "COPY {} (product_id, customer_id, rating, review_date, votes, helpful) FROM STDIN (FORMAT BINARY)"
+RELATED_STAGING_COPY = "COPY etl_related_staging (product1_asin, product2_asin) FROM STDIN (FORMAT BINARY)"
+RELATED_STAGING_TYPES = ["varchar", "varchar"]
+STAGE_HASH_COPY = "COPY stage_product_hash FROM STDIN (FORMAT BINARY)"
+STAGE_HASH_TYPES = ["text", "bytea", "int4"]
+
+MERGE_PRODUCTS_SQL = """
+    INSERT INTO Products (
+        source_id, asin, titulo, group_name, salesrank,
+        total_reviews, average_rating, qntd_downloads,
+        similar_products_count, categories_count
+    )
+    SELECT source_id, asin, titulo, group_name, salesrank,
+           total_reviews, average_rating, qntd_downloads,
+           similar_products_count, categories_count
+    FROM stage_products
+    ON CONFLICT (asin) DO UPDATE SET
+        titulo = EXCLUDED.titulo,
+        group_name = EXCLUDED.group_name,
+        salesrank = EXCLUDED.salesrank,
+        total_reviews = EXCLUDED.total_reviews,
+        average_rating = EXCLUDED.average_rating,
+        qntd_downloads = EXCLUDED.qntd_downloads,
+        similar_products_count = EXCLUDED.similar_products_count,
+        categories_count = EXCLUDED.categories_count
+"""
+MERGE_PRODCAT_SQL = """
+    INSERT INTO Product_category (product_id, category_id)
+    SELECT product_id, category_id FROM stage_product_category
+    ON CONFLICT DO NOTHING
+"""
+MERGE_HASH_SQL = """
+    INSERT INTO etl_product_hash (asin, content_hash, load_id)
+    SELECT asin, content_hash, load_id FROM stage_product_hash
+    ON CONFLICT (asin) DO UPDATE SET content_hash = EXCLUDED.content_hash, load_id = EXCLUDED.load_id
+"""
+
+
+def new_load_stats():
+    """
+    Cria o dicionário de estatísticas de carga: tabela -> [linhas escritas, segundos gastos].
+    """
+    return {
+        'Products': [0, 0.0], 'Customers': [0, 0.0], 'Product_category': [0, 0.0], 'reviews': [0, 0.0],
+        'etl_related_staging': [0, 0.0], 'etl_product_hash': [0, 0.0]
+    }
+
+
+def merge_load_stats(stats_list):
+    """
+    Soma as estatísticas de várias conexões (ex.: uma por thread escritora do pipeline).
+    Os segundos são somados, ou seja, representam o tempo total de escrita de todas as threads.
+    """
+    merged = new_load_stats()
+    for stats in stats_list:
+        for table, (rows, seconds) in stats.items():
+            merged[table][0] += rows
+            merged[table][1] += seconds
+    return merged
+
+
+def _account(stats, table, rows, start_time):
+    entry = stats[table]
+    entry[0] += rows
+    entry[1] += time.perf_counter() - start_time
+
+
+def flush_executemany(cur, prod_batch, prodcat_batch, review_batch, related_batch, hash_batch, stats):
+    """
+    Escreve um lote com INSERTs individuais (executemany). Não faz commit.
+    """
+    if prod_batch:
+        start = time.perf_counter()
+        cur.executemany(PRODUCTS_SQL, prod_batch)
+        _account(stats, 'Products', len(prod_batch), start)
+    if prodcat_batch:
+        start = time.perf_counter()
+        cur.executemany(PRODCAT_SQL, prodcat_batch)
+        _account(stats, 'Product_category', len(prodcat_batch), start)
+    if review_batch:
+        start = time.perf_counter()
+        cur.executemany(REVIEWS_SQL, review_batch)
+        _account(stats, 'reviews', len(review_batch), start)
+    if related_batch:
+        start = time.perf_counter()
+        cur.executemany(RELATED_STAGING_SQL, related_batch)
+        _account(stats, 'etl_related_staging', len(related_batch), start)
+    if hash_batch:
+        start = time.perf_counter()
+        cur.executemany(PRODUCT_HASH_SQL, hash_batch)
+        _account(stats, 'etl_product_hash', len(hash_batch), start)
+
+
+def flush_customers(cur, customer_batch, loader_mode, stats):
+    """
+    Grava os clientes novos (customer_id, customer_code), com o mesmo modo de escrita
+    dos lotes. Os IDs são atribuídos pelo ETL, por isso não há conflitos. Não faz commit.
+    """
+    if not customer_batch:
+        return
+    start = time.perf_counter()
+    if loader_mode == 'copy':
+        with cur.copy(CUSTOMERS_COPY) as copy:
+            copy.set_types(CUSTOMERS_TYPES)
+            for row in customer_batch:
+                copy.write_row(row)
+    else:
+        cur.executemany(CUSTOMERS_SQL, customer_batch)
+    _account(stats, 'Customers', len(customer_batch), start)
+
+
+def prepare_copy(cur):
+    """
+    Cria (uma vez por conexão) as tabelas temporárias de staging usadas pelo modo 'copy'.
+    """
+    cur.execute(STAGING_SQL)
+
+
+def _dedup_products(prod_batch):
+    # o upsert do modo 'executemany' faz com que a última ocorrência de um ASIN vença,
+    # mas o source_id não é atualizado pelo ON CONFLICT, por isso mantemos o da primeira
+    unique = {}
+    for row in prod_batch:
+        previous = unique.get(row[1])
+        if previous is not None:
+            row = (previous[0],) + tuple(row[1:])
+        unique[row[1]] = row
+    return unique.values()
+
+
+def _copy_reviews(cur, sql, rows):
+    with cur.copy(sql) as copy:
+        copy.set_types(REVIEWS_TYPES)
+        for row in rows:
+            copy.write_row(row)
+
+
+def flush_copy(cur, prod_batch, prodcat_batch, review_batch, related_batch, hash_batch, stats, review_router=None):
+    """
+    Escreve um lote com COPY binário. Não faz commit (as tabelas de staging são
+    limpas no commit feito por quem chama). Com `review_router` (tabela reviews
+    particionada) as reviews são escritas com um COPY para cada partição.
+    """
+    if prod_batch:
+        start = time.perf_counter()
+        with cur.copy(STAGE_PRODUCTS_COPY) as copy:
+            copy.set_types(STAGE_PRODUCTS_TYPES)
+            for row in _dedup_products(prod_batch):
+                copy.write_row(row)
+        cur.execute(MERGE_PRODUCTS_SQL)
+        # as linhas escritas pelo INSERT ... SELECT (sem os ASINs repetidos no lote)
+        _account(stats, 'Products', max(cur.rowcount, 0), start)
+    if prodcat_batch:
+        start = time.perf_counter()
+        with cur.copy(STAGE_PRODCAT_COPY) as copy:
+            copy.set_types(STAGE_PRODCAT_TYPES)
+            for row in set(prodcat_batch):
+                copy.write_row(row)
+        cur.execute(MERGE_PRODCAT_SQL)
+        _account(stats, 'Product_category', max(cur.rowcount, 0), start)
+    if review_batch:
+        start = time.perf_counter()
+        if review_router is None:
+            _copy_reviews(cur, REVIEWS_COPY, review_batch)
+        else:
+            for leaf, rows in sorted(review_router.split(review_batch).items()):
+                _copy_reviews(cur, REVIEWS_PARTITION_COPY.format(leaf), rows)
+        _account(stats, 'reviews', len(review_batch), start)
+    if related_batch:
+        start = time.perf_counter()
+        with cur.copy(RELATED_STAGING_COPY) as copy:
+            copy.set_types(RELATED_STAGING_TYPES)
+            for row in related_batch:
+                copy.write_row(row)
+        _account(stats, 'etl_related_staging', len(related_batch), start)
+    if hash_batch:
+        start = time.perf_counter()
+        with cur.copy(STAGE_HASH_COPY) as copy:
+            copy.set_types(STAGE_HASH_TYPES)
+            for row in hash_batch: # um hash por ASIN (quem chama já elimina repetidos)
+                copy.write_row(row)
+        cur.execute(MERGE_HASH_SQL)
+        _account(stats, 'etl_product_hash', len(hash_batch), start)
+
+
+def print_load_stats(stats, mode):
+    """
+    Imprime o total de linhas e a taxa (linhas/segundo) de cada tabela para o modo usado.
+    """
+    print(f"Estatísticas de carga (modo '{mode}'):")
+    for table, (rows, seconds) in stats.items():
+        rate = rows / seconds if seconds > 0 else 0.0
+        print(f"  - {table}: {rows} linhas em {seconds:.4f} s ({rate:,.0f} linhas/s)")
@@ -0,0 +1,231 @@
+"""
+Métricas das etapas do ETL (tp1_3.2.py) e das consultas do dashboard (tp1_3.3.py).
+
+Cada etapa (as funções com @log_time) é medida dentro de METRICS.stage(nome), que regista:
+- o tempo total, as linhas processadas e os bytes lidos ou gravados (indicados pela própria
+  etapa com METRICS.add_rows), e daí as linhas/s e os bytes/s;
+- o pico de memória (RSS) do processo no fim da etapa;
+- as idas ao banco e o tempo à espera do banco, medidos pelas conexões de db.py: o tempo à
+  espera na thread da etapa separa o tempo no banco do tempo em Python; o das restantes
+  conexões (threads escritoras, atualização das tabelas de resumo) é somado à parte.
+
+As idas ao banco feitas numa thread sem etapa própria contam para a etapa aberta pela
+thread principal. No fim o relatório é gravado em JSON ou no formato de texto do Prometheus
+(--metrics-file / --metrics-format).
+"""
+
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_FORMATS = ('json', 'prometheus')
+METRIC_PREFIX = 'tp1'
+
+
+def peak_rss_mb():
+    # ru_maxrss vem em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class StageMetrics:
+    """
+    Números de uma execução de uma etapa.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.thread = threading.get_ident()
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.details = {}
+        self.peak_rss_mb = 0.0
+        self.db_round_trips = 0
+        self.db_wait_seconds = 0.0 # à espera do banco na thread da etapa
+        self.db_seconds_all = 0.0  # em todas as conexões usadas durante a etapa
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'seconds': self.seconds,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_second': self.rows / self.seconds if self.seconds else 0.0,
+            'bytes_per_second': self.bytes / self.seconds if self.seconds else 0.0,
+            'peak_rss_mb': self.peak_rss_mb,
+            'db_round_trips': self.db_round_trips,
+            'db_wait_seconds': self.db_wait_seconds,
+            'python_seconds': max(self.seconds - self.db_wait_seconds, 0.0),
+            'db_seconds_all_connections': self.db_seconds_all,
+            'details': self.details,
+        }
+
+
+class Metrics:
+    """
+    Registo das etapas de uma execução e dos totais das idas ao banco.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.db_round_trips = 0
+        self.db_seconds = 0.0
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main_stage = None
+
+    def current(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else self._main_stage
+
+    @contextmanager
+    def stage(self, name):
+        stage = StageMetrics(name)
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        self._local.stack.append(stage)
+        main = threading.current_thread() is threading.main_thread()
+        outer = self._main_stage
+        if main:
+            self._main_stage = stage
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            stage.peak_rss_mb = peak_rss_mb()
+            self._local.stack.pop()
+            if main:
+                self._main_stage = outer
+            with self._lock:
+                self.stages.append(stage)
+
+    def add_rows(self, rows=0, nbytes=0, **details):
+        """
+        Soma linhas, bytes e contadores (`details`) à etapa em curso.
+        """
+        stage = self.current()
+        if stage is None:
+            return
+        with self._lock:
+            stage.rows += rows
+            stage.bytes += nbytes
+            for key, value in details.items():
+                stage.details[key] = stage.details.get(key, 0) + value
+
+    def record_db(self, seconds, round_trips=1):
+        stage = self.current()
+        with self._lock:
+            self.db_round_trips += round_trips
+            self.db_seconds += seconds
+            if stage is not None:
+                stage.db_round_trips += round_trips
+                stage.db_seconds_all += seconds
+                if stage.thread == threading.get_ident():
+                    stage.db_wait_seconds += seconds
+
+    def report(self, script):
+        return {
+            'script': script,
+            'started_at': self.started_at,
+            'total_seconds': time.perf_counter() - self._start,
+            'peak_rss_mb': peak_rss_mb(),
+            'db_round_trips': self.db_round_trips,
+            'db_seconds': self.db_seconds,
+            'stages': [stage.as_dict() for stage in self.stages],
+        }
+
+    def write_report(self, path, script, file_format='json'):
+        report = self.report(script)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            if file_format == 'prometheus':
+                f.write(prometheus_text(report))
+            else:
+                json.dump(report, f, indent=2)
+        print(f"Relatório de métricas gravado em: {path}")
+
+
+# (nome da métrica, campo da etapa, descrição); etapas com o mesmo nome são somadas
+_PROMETHEUS_STAGE_METRICS = (
+    ('stage_seconds', 'seconds', 'Tempo total da etapa'),
+    ('stage_rows', 'rows', 'Linhas processadas pela etapa'),
+    ('stage_bytes', 'bytes', 'Bytes lidos ou gravados pela etapa'),
+    ('stage_db_round_trips', 'db_round_trips', 'Idas ao banco durante a etapa'),
+    ('stage_db_wait_seconds', 'db_wait_seconds', 'Tempo à espera do banco na thread da etapa'),
+    ('stage_python_seconds', 'python_seconds', 'Tempo da etapa fora do banco'),
+    ('stage_db_seconds_all_connections', 'db_seconds_all_connections', 'Tempo no banco somado em todas as conexões'),
+)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(report):
+    """
+    Converte o relatório para o formato de texto do Prometheus (gauges com os labels script e stage).
+    """
+    script = _label(report['script'])
+    totals = {}
+    for stage in report['stages']:
+        entry = totals.setdefault(stage['name'], {field: 0.0 for _, field, _ in _PROMETHEUS_STAGE_METRICS})
+        for _, field, _ in _PROMETHEUS_STAGE_METRICS:
+            entry[field] += stage[field]
+        entry['peak_rss_mb'] = max(entry.get('peak_rss_mb', 0.0), stage['peak_rss_mb'])
+
+    lines = []
+    def gauge(name, description, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            lines.append(f"{METRIC_PREFIX}_{name}{{{labels}}} {value}")
+
+    for name, field, description in _PROMETHEUS_STAGE_METRICS:
+        gauge(name, description,
+              [(f'script="{script}",stage="{_label(stage)}"', values[field]) for stage, values in totals.items()])
+    gauge('stage_peak_rss_bytes', 'Pico de memória do processo no fim da etapa',
+          [(f'script="{script}",stage="{_label(stage)}"', int(values['peak_rss_mb'] * 1024 * 1024)) for stage, values in totals.items()])
+    gauge('run_seconds', 'Tempo total da execução', [(f'script="{script}"', report['total_seconds'])])
+    gauge('run_peak_rss_bytes', 'Pico de memória do processo', [(f'script="{script}"', int(report['peak_rss_mb'] * 1024 * 1024))])
+    gauge('run_db_round_trips', 'Idas ao banco na execução', [(f'script="{script}"', report['db_round_trips'])])
+    gauge('run_db_seconds', 'Tempo no banco somado em todas as conexões', [(f'script="{script}"', report['db_seconds'])])
+    return '\n'.join(lines) + '\n'
+
+
+class Progress:
+    """
+    Progresso de uma leitura: fração feita (por uma posição entre `start` e `total`, ex.: bytes
+    do ficheiro), débito e tempo restante estimado.
+    """
+
+    def __init__(self, total=None, start=0, unit='produtos'):
+        self.total = total
+        self.start = start
+        self.unit = unit
+        self._start_time = time.perf_counter()
+
+    def status(self, position, items):
+        elapsed = time.perf_counter() - self._start_time
+        parts = [f"{items / elapsed:,.0f} {self.unit}/s" if elapsed > 0 else f"0 {self.unit}/s"]
+        if self.total and self.total > self.start and position is not None and position > self.start:
+            fraction = min((position - self.start) / (self.total - self.start), 1.0)
+            parts.insert(0, f"{fraction:.1%}")
+            parts.append(f"faltam ~{_format_duration(elapsed * (1 - fraction) / fraction)}")
+        return ', '.join(parts)
+
+
+METRICS = Metrics()
@@ -0,0 +1,171 @@
+"""
+Layout particionado (opcional) da tabela reviews.
+
+Em vez de um único heap, a tabela reviews pode ser criada:
+- com partições hash pelo produto (`hash_partitions` = N): reviews_p0 ... reviews_p{N-1};
+- com partições por ano da review (`by_year`): reviews_y1995 ... e reviews_ydefault;
+- com as duas coisas: cada partição hash subdividida por ano (reviews_p0_y1995, ...).
+
+As partições hash põem todas as reviews de um produto na mesma partição, por isso as
+agregações por produto do dashboard podem ser feitas partição a partição.
+
+No modo 'copy' o loader não envia as reviews para a tabela mãe: as linhas de cada produto
+são encaminhadas no próprio python para a sua partição hash (ReviewRouter), com um COPY por
+partição; a divisão por ano, dentro de cada partição, fica a cargo do PostgreSQL. Para isso
+o hash é calculado exatamente como o PostgreSQL o calcula (hashint4extended com a semente
+das partições hash).
+"""
+
+# anos com partição própria no particionamento por data; os restantes vão para a partição DEFAULT
+REVIEW_YEARS = range(1995, 2007)
+
+# constante HASH_PARTITION_SEED do PostgreSQL (src/include/catalog/partition.h)
+HASH_PARTITION_SEED = 0x7A5B22367996DCFD
+_MASK32 = 0xFFFFFFFF
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+REVIEWS_PARTITIONED_SQL = """
+    CREATE TABLE reviews (
+        review_id      SERIAL,
+        product_id     INT NOT NULL,
+        customer_id    INT NOT NULL,
+        rating         SMALLINT NOT NULL,
+        review_date    DATE NOT NULL,
+        votes          INT DEFAULT 0 NOT NULL,
+        helpful        INT DEFAULT 0 NOT NULL,
+        CHECK (rating >= 1 AND rating <= 5),
+        PRIMARY KEY ({primary_key})
+    ) PARTITION BY {partition_by}
+"""
+
+
+def _rot(x, k):
+    return ((x << k) | (x >> (32 - k))) & _MASK32
+
+
+def _mix(a, b, c):
+    a = (a - c) & _MASK32; a ^= _rot(c, 4); c = (c + b) & _MASK32
+    b = (b - a) & _MASK32; b ^= _rot(a, 6); a = (a + c) & _MASK32
+    c = (c - b) & _MASK32; c ^= _rot(b, 8); b = (b + a) & _MASK32
+    a = (a - c) & _MASK32; a ^= _rot(c, 16); c = (c + b) & _MASK32
+    b = (b - a) & _MASK32; b ^= _rot(a, 19); a = (a + c) & _MASK32
+    c = (c - b) & _MASK32; c ^= _rot(b, 4); b = (b + a) & _MASK32
+    return a, b, c
+
+
+def _final(a, b, c):
+    c ^= b; c = (c - _rot(b, 14)) & _MASK32
+    a ^= c; a = (a - _rot(c, 11)) & _MASK32
+    b ^= a; b = (b - _rot(a, 25)) & _MASK32
+    c ^= b; c = (c - _rot(b, 16)) & _MASK32
+    a ^= c; a = (a - _rot(c, 4)) & _MASK32
+    b ^= a; b = (b - _rot(a, 14)) & _MASK32
+    c ^= b; c = (c - _rot(b, 24)) & _MASK32
+    return a, b, c
+
+
+def _seeded_state():
+    a = b = c = (0x9e3779b9 + 4 + 3923095) & _MASK32
+    a = (a + (HASH_PARTITION_SEED >> 32)) & _MASK32
+    b = (b + (HASH_PARTITION_SEED & _MASK32)) & _MASK32
+    return _mix(a, b, c)
+
+_SEEDED_STATE = _seeded_state() # a parte do hash que só depende da semente
+
+
+def partition_hash(value):
+    """
+    Hash de um INT usado pelo PostgreSQL para escolher a partição hash
+    (hash_uint32_extended com a semente das partições, combinado com hash_combine64).
+    A partição de `value` é partition_hash(value) % número de partições.
+    """
+    a, b, c = _SEEDED_STATE
+    a, b, c = _final((a + (value & _MASK32)) & _MASK32, b, c)
+    row_hash = (b << 32) | c
+    return (row_hash + 0x49a0f4dd15e5a8e3) & _MASK64 # hash_combine64(0, row_hash)
+
+
+class ReviewRouter:
+    """
+    Encaminha linhas de reviews (produto, cliente, rating, data, votos, úteis) para a
+    partição hash do seu produto (reviews_p0 ... reviews_p{N-1}).
+    """
+
+    def __init__(self, hash_partitions):
+        self.hash_partitions = hash_partitions
+        self._names = [f"reviews_p{remainder}" for remainder in range(hash_partitions)]
+
+    def leaf(self, product_id):
+        return self._names[partition_hash(product_id) % self.hash_partitions]
+
+    def split(self, rows):
+        """
+        Agrupa as linhas por partição: devolve o dicionário partição -> lista de linhas.
+        O hash é calculado uma vez por produto (as reviews de um produto vêm seguidas).
+        """
+        leaves = {}
+        last_product, rows_of_leaf = None, None
+        for row in rows:
+            if row[0] != last_product:
+                last_product = row[0]
+                rows_of_leaf = leaves.setdefault(self.leaf(last_product), [])
+            rows_of_leaf.append(row)
+        return leaves
+
+
+def create_partitioned_reviews(conn, hash_partitions=0, by_year=False):
+    """
+    Cria a tabela reviews particionada (deve ser chamada antes do schema.sql, que então
+    não recria a tabela) e devolve o ReviewRouter das partições hash, ou None se só houver
+    partições por ano (nesse caso as linhas são encaminhadas pelo próprio PostgreSQL).
+
+    A chave primária inclui as colunas de particionamento, como o PostgreSQL exige.
+    """
+    primary_key = ", ".join(
+        ["review_id"] + (["product_id"] if hash_partitions else []) + (["review_date"] if by_year else [])
+    )
+    partition_by = "HASH (product_id)" if hash_partitions else "RANGE (review_date)"
+    statements = [REVIEWS_PARTITIONED_SQL.format(primary_key=primary_key, partition_by=partition_by)]
+
+    def year_partitions(parent):
+        for year in REVIEW_YEARS:
+            statements.append(
+                f"CREATE TABLE {parent}_y{year} PARTITION OF {parent} "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+        statements.append(f"CREATE TABLE {parent}_ydefault PARTITION OF {parent} DEFAULT")
+
+    if hash_partitions:
+        subpartition = " PARTITION BY RANGE (review_date)" if by_year else ""
+        for remainder in range(hash_partitions):
+            parent = f"reviews_p{remainder}"
+            statements.append(
+                f"CREATE TABLE {parent} PARTITION OF reviews "
+                f"FOR VALUES WITH (MODULUS {hash_partitions}, REMAINDER {remainder}){subpartition}"
+            )
+            if by_year:
+                year_partitions(parent)
+    else:
+        year_partitions("reviews")
+
+    with conn.cursor() as cur:
+        for sql in statements:
+            cur.execute(sql)
+    conn.commit()
+    return ReviewRouter(hash_partitions) if hash_partitions else None
+
+
+def read_review_router(conn):
+    """
+    Reconstrói o ReviewRouter a partir das partições hash existentes (ex.: numa carga
+    incremental), ou devolve None se a tabela reviews não tiver partições hash.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT count(*) FROM pg_partition_tree('reviews') t
+            JOIN pg_class c ON c.oid = t.relid
+            WHERE t.level = 1 AND c.relname LIKE 'reviews\\_p%'
+        """)
+        hash_partitions = cur.fetchone()[0]
+    conn.commit()
+    return ReviewRouter(hash_partitions) if hash_partitions else None
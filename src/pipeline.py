@@ -0,0 +1,110 @@
+"""
+Pipeline produtor/consumidor usado pelo ETL para sobrepor o parsing (CPU) e a escrita
+no banco de dados (I/O).
+
+O produtor (a thread principal, que faz o parsing) coloca lotes prontos numa fila
+limitada; uma ou mais threads escritoras retiram os lotes da fila e gravam-nos, cada
+uma com a sua própria conexão. Enquanto uma escritora espera pelo banco, o GIL fica
+livre e o parsing continua.
+
+O pipeline mede onde está o gargalo:
+- tempo em que o produtor ficou parado porque a fila estava cheia (o banco é o gargalo);
+- tempo em que as escritoras ficaram paradas porque a fila estava vazia (o parsing é o gargalo);
+- profundidade média e máxima da fila.
+"""
+
+import queue
+import threading
+import time
+
+_STOP = object() # sinaliza às escritoras que não há mais lotes
+
+
+class BatchPipeline:
+    """
+    Fila limitada de lotes com `writers` threads escritoras.
+
+    `worker` é chamado uma vez em cada thread escritora com um iterável dos lotes que
+    essa thread deve gravar; o valor devolvido por cada chamada fica em `results`.
+    """
+
+    def __init__(self, worker, writers=1, queue_depth=4):
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._error = None
+        self.queue_depth = queue_depth
+        self.results = [None] * writers
+        self.producer_stall = 0.0
+        self.writer_idle = [0.0] * writers
+        self.batches = 0
+        self._depth_sum = 0
+        self.max_depth = 0
+        self._threads = [
+            threading.Thread(target=self._run, args=(worker, index), name=f"etl-writer-{index}", daemon=True)
+            for index in range(writers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _batches(self, index):
+        while True:
+            start = time.perf_counter()
+            batch = self._queue.get()
+            self.writer_idle[index] += time.perf_counter() - start
+            if batch is _STOP:
+                return
+            yield batch
+
+    def _run(self, worker, index):
+        try:
+            self.results[index] = worker(self._batches(index))
+        except BaseException as e:
+            self._error = e
+            # continua a esvaziar a fila para o produtor não ficar bloqueado
+            for _ in self._batches(index):
+                pass
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Erro numa thread escritora: {self._error}") from self._error
+
+    def put(self, batch):
+        """
+        Coloca um lote na fila, esperando se ela estiver cheia.
+        Propaga o erro se alguma escritora tiver falhado.
+        """
+        self._check_error()
+        depth = self._queue.qsize()
+        self._depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+        self.batches += 1
+        start = time.perf_counter()
+        while True:
+            try:
+                self._queue.put(batch, timeout=0.5)
+                break
+            except queue.Full:
+                self._check_error()
+        self.producer_stall += time.perf_counter() - start
+
+    def close(self):
+        """
+        Espera que todos os lotes sejam gravados e termina as threads escritoras.
+        Devolve a lista com o resultado de cada escritora.
+        """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._check_error()
+        return self.results
+
+    def status(self):
+        """
+        Linha de estado com a profundidade da fila e os tempos de espera de cada lado.
+        """
+        average_depth = self._depth_sum / self.batches if self.batches else 0.0
+        return (
+            f"fila {self._queue.qsize()}/{self.queue_depth} (média {average_depth:.1f}, máx. {self.max_depth}), "
+            f"parser parado {self.producer_stall:.2f} s, "
+            f"escritoras ociosas {sum(self.writer_idle):.2f} s"
+        )
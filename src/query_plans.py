@@ -0,0 +1,204 @@
+"""
+Planos de execução das consultas do dashboard (tp1_3.3.py --explain) e comparação com uma
+execução anterior.
+
+Com --explain cada consulta é executada também com EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+e o plano é gravado ao lado do resultado, em `<ficheiro do resultado>.plan.json`, com o
+comando SQL e os parâmetros. Guardando uma cópia desses ficheiros (a referência), a
+comparação indica, consulta a consulta:
+- mudanças na forma do plano: tipos dos nós, tabelas e índices usados, pela ordem da árvore;
+- erros de estimativa de linhas novos: nós em que as linhas estimadas e as reais diferem
+  mais de --estimate-factor vezes, e que na referência não diferiam;
+- regressões nos buffers: blocos lidos (da cache do PostgreSQL ou do disco) e blocos
+  temporários que cresceram mais de --threshold.
+
+Uso:
+    python src/tp1_3.3.py ... --explain --output out/plans_base
+    python src/tp1_3.3.py ... --explain --output out
+    python src/query_plans.py --baseline out/plans_base --current out
+"""
+
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+
+PLAN_SUFFIX = '.plan.json'
+EXPLAIN_SQL = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {}"
+DEFAULT_BUFFER_THRESHOLD = 0.20
+DEFAULT_ESTIMATE_FACTOR = 10
+MIN_BUFFER_CHANGE = 100 # blocos (8 KB); diferenças menores são ruído
+
+
+def explain(conn, sql, params):
+    """
+    Executa a consulta com EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) e devolve o plano
+    (com 'Plan', 'Planning Time' e 'Execution Time').
+    """
+    with conn.cursor() as cur:
+        cur.execute(EXPLAIN_SQL.format(sql.strip().rstrip(';')), params)
+        plan = cur.fetchone()[0]
+    return plan[0]
+
+
+def save_plan(conn, sql, params, path):
+    plan = explain(conn, sql, params)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'captured_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'sql': sql.strip(),
+            'params': params,
+            'explain': plan,
+        }, f, indent=2, default=str)
+    return plan
+
+
+def load_plans(directory):
+    """
+    Devolve {nome do resultado: plano gravado} dos ficheiros *.plan.json de `directory`.
+    """
+    plans = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(PLAN_SUFFIX):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                plans[name[:-len(PLAN_SUFFIX)]] = json.load(f)
+    return plans
+
+
+def plan_nodes(node, depth=0):
+    """
+    Percorre a árvore do plano em pré-ordem e devolve a lista de (profundidade, nó).
+    """
+    nodes = [(depth, node)]
+    for child in node.get('Plans', []):
+        nodes += plan_nodes(child, depth + 1)
+    return nodes
+
+
+def node_label(node):
+    # o que define a forma do plano: tipo do nó, estratégia, tabela e índice (sem custos nem tempos)
+    parts = [node['Node Type']]
+    for key in ('Join Type', 'Strategy', 'Subplan Name'):
+        if key in node:
+            parts.append(f"{key.lower()}={node[key]}")
+    if node.get('Parent Relationship') not in (None, 'Outer', 'Inner'):
+        parts.append(f"({node['Parent Relationship']})") # InitPlan, SubPlan, ...
+    if 'Relation Name' in node:
+        parts.append(f"on {node['Relation Name']}")
+    if 'Index Name' in node:
+        parts.append(f"using {node['Index Name']}")
+    return ' '.join(parts)
+
+
+def plan_shape(plan):
+    return ['  ' * depth + node_label(node) for depth, node in plan_nodes(plan['Plan'])]
+
+
+def _below_limit(plan):
+    # nós abaixo de um Limit param antes de devolver todas as linhas estimadas
+    below = set()
+    for _, node in plan_nodes(plan['Plan']):
+        if node['Node Type'] == 'Limit' or id(node) in below:
+            below.update(id(child) for child in node.get('Plans', []))
+    return below
+
+
+def estimate_error(node, below_limit=()):
+    """
+    Quantas vezes as linhas estimadas e as reais (por execução do nó) diferem; None se o nó
+    não chegou a ser executado ou foi interrompido por um Limit.
+    """
+    if not node.get('Actual Loops') or id(node) in below_limit:
+        return None
+    estimated, actual = max(node['Plan Rows'], 1), max(node['Actual Rows'], 1)
+    return max(estimated / actual, actual / estimated)
+
+
+def buffer_totals(plan):
+    # os contadores do nó de topo já incluem os dos nós abaixo
+    root = plan['Plan']
+    return {
+        'shared': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0),
+        'read': root.get('Shared Read Blocks', 0),
+        'temp': root.get('Temp Read Blocks', 0) + root.get('Temp Written Blocks', 0),
+    }
+
+
+def compare_plan(baseline, current, threshold, estimate_factor):
+    """
+    Compara o plano `current` de um resultado com o da referência e devolve a lista de
+    problemas encontrados (cada um uma linha de texto).
+    """
+    issues = []
+    old_shape, new_shape = plan_shape(baseline), plan_shape(current)
+    same_shape = old_shape == new_shape
+    if not same_shape:
+        diff = difflib.unified_diff(old_shape, new_shape, 'referência', 'atual', lineterm='', n=1)
+        issues.append("a forma do plano mudou:\n" + '\n'.join(f"      {line}" for line in list(diff)[2:]))
+
+    old_nodes, old_limited, limited = plan_nodes(baseline['Plan']), _below_limit(baseline), _below_limit(current)
+    for i, (_, node) in enumerate(plan_nodes(current['Plan'])):
+        error = estimate_error(node, limited)
+        if error is None or error < estimate_factor:
+            continue
+        old_error = estimate_error(old_nodes[i][1], old_limited) if same_shape else None
+        if old_error is not None and old_error >= estimate_factor:
+            continue # já estava errada na referência
+        issues.append(f"estimativa de linhas errada {error:.0f}x em '{node_label(node)}': "
+                      f"{node['Plan Rows']} estimadas, {node['Actual Rows']} reais")
+
+    old_buffers, new_buffers = buffer_totals(baseline), buffer_totals(current)
+    for key, label in (('shared', 'blocos lidos'), ('read', 'blocos lidos do disco'), ('temp', 'blocos temporários')):
+        old, new = old_buffers[key], new_buffers[key]
+        if new - old >= MIN_BUFFER_CHANGE and new > old * (1 + threshold):
+            issues.append(f"{label}: {old} -> {new}" + (f" ({new / old - 1:+.0%})" if old else ""))
+    return issues
+
+
+def compare_plans(baseline_dir, current_dir, threshold=DEFAULT_BUFFER_THRESHOLD, estimate_factor=DEFAULT_ESTIMATE_FACTOR):
+    """
+    Compara os planos gravados nos dois diretórios, imprime as diferenças e devolve o número
+    de consultas com problemas.
+    """
+    baseline, current = load_plans(baseline_dir), load_plans(current_dir)
+    if not current:
+        print(f"Nenhum plano ({PLAN_SUFFIX}) encontrado em '{current_dir}'.")
+    flagged = 0
+    for name, saved in current.items():
+        if name not in baseline:
+            print(f"\n{name}: sem plano de referência")
+            continue
+        old, new = baseline[name]['explain'], saved['explain']
+        print(f"\n{name}: {old['Execution Time']:.3f} ms -> {new['Execution Time']:.3f} ms")
+        issues = compare_plan(old, new, threshold, estimate_factor)
+        flagged += bool(issues)
+        for issue in issues:
+            print(f"  - {issue}")
+        if not issues:
+            print("  sem alterações no plano")
+    for name in sorted(baseline.keys() - current.keys()):
+        print(f"\n{name}: só existe na referência")
+    print(f"\n{flagged} de {len(current)} consultas com o plano alterado ou pior do que na referência.")
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara os planos gravados pelo tp1_3.3.py --explain com os de uma execução anterior.")
+    parser.add_argument("--baseline", required=True, help="Diretório com os planos de referência (*.plan.json)")
+    parser.add_argument("--current", required=True, help="Diretório com os planos a comparar (o --output do dashboard)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_BUFFER_THRESHOLD,
+                        help="Aumento relativo dos blocos lidos a partir do qual é indicada uma regressão (0.20 = 20%%)")
+    parser.add_argument("--estimate-factor", type=float, default=DEFAULT_ESTIMATE_FACTOR,
+                        help="Diferença (em vezes) entre as linhas estimadas e as reais a partir da qual a estimativa é indicada")
+    args = parser.parse_args()
+    for directory in (args.baseline, args.current):
+        if not os.path.isdir(directory):
+            parser.error(f"o diretório '{directory}' não existe")
+    flagged = compare_plans(args.baseline, args.current, args.threshold, args.estimate_factor)
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
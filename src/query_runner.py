@@ -0,0 +1,115 @@
+"""
+Execução concorrente das consultas do dashboard (tp1_3.3.py --parallel N).
+
+Cada consulta corre numa thread própria com uma conexão retirada de um pool
+(psycopg_pool). Enquanto uma consulta espera pelo banco o GIL fica livre, por isso o
+tempo total aproxima-se do tempo da consulta mais lenta em vez da soma de todas.
+
+As consultas continuam a imprimir como na execução sequencial, mas o que cada thread
+imprime é guardado e mostrado pela ordem das consultas (e não pela ordem em que
+terminam), assim a saída é sempre a mesma. No fim são mostrados o tempo de cada
+consulta e o caminho crítico (a cadeia de consultas dependentes mais demorada).
+"""
+
+import io
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# uma consulta do dashboard: `func(conn, *args)`, que só pode começar depois de `depends` (nome ou None)
+QueryTask = namedtuple('QueryTask', ['name', 'func', 'args', 'depends'])
+# resultado de uma consulta: tempo gasto e tudo o que ela imprimiu
+QueryResult = namedtuple('QueryResult', ['name', 'seconds', 'output'])
+
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Substitui o sys.stdout durante a execução concorrente: cada thread com um buffer
+    registado escreve no seu buffer, as restantes (a thread principal) no stdout original.
+    """
+
+    def __init__(self, stdout):
+        super().__init__()
+        self._stdout = stdout
+        self._local = threading.local()
+
+    def capture(self, buffer):
+        self._local.buffer = buffer
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (buffer if buffer is not None else self._stdout).write(text)
+
+    def flush(self):
+        self._stdout.flush()
+
+
+def _run_task(pool, capture, task):
+    buffer = io.StringIO()
+    capture.capture(buffer)
+    try:
+        with pool.connection() as conn:
+            start = time.perf_counter()
+            task.func(conn, *task.args)
+            seconds = time.perf_counter() - start
+    finally:
+        capture.capture(None)
+    return QueryResult(task.name, seconds, buffer.getvalue())
+
+
+def run_concurrently(pool, tasks, jobs, done=(), headers=None):
+    """
+    Executa as tarefas com até `jobs` threads e imprime o que cada uma imprimiu, pela ordem
+    de `tasks`, assim que ela e todas as anteriores terminam (`headers`: texto impresso antes
+    da saída de uma tarefa, pelo nome). As dependências (`depends`) são usadas só no cálculo
+    do caminho crítico: as tarefas devem poder correr em paralelo.
+    `done` são resultados já obtidos antes (ex.: a procura do produto), incluídos no relatório.
+    Devolve a lista de QueryResult pela ordem das tarefas.
+    """
+    headers = headers or {}
+    capture = _ThreadOutput(sys.stdout)
+    original_stdout, sys.stdout = sys.stdout, capture
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [executor.submit(_run_task, pool, capture, task) for task in tasks]
+            for future in futures:
+                result = future.result()
+                original_stdout.write(headers.get(result.name, ''))
+                original_stdout.write(result.output)
+                results.append(result)
+    finally:
+        sys.stdout = original_stdout
+    return list(done) + results
+
+
+def critical_path(tasks, results):
+    """
+    Devolve (nomes, segundos) da cadeia de tarefas dependentes com a maior soma de tempos.
+    """
+    seconds = {result.name: result.seconds for result in results}
+    depends = {task.name: task.depends for task in tasks}
+    best_chain, best_time = [], 0.0
+    for name in seconds:
+        chain = [name]
+        while depends.get(chain[-1]) in seconds:
+            chain.append(depends[chain[-1]])
+        total = sum(seconds[step] for step in chain)
+        if total > best_time:
+            best_chain, best_time = chain[::-1], total
+    return best_chain, best_time
+
+
+def print_timings(tasks, results, wall_time):
+    """
+    Imprime o tempo de cada consulta, a soma dos tempos, o tempo total e o caminho crítico.
+    """
+    print(f"\n{'='*10} Tempos das consultas (execução concorrente) {'='*10}")
+    for result in results:
+        print(f"  - {result.name}: {result.seconds:.4f} s")
+    chain, chain_time = critical_path(tasks, results)
+    print(f"Soma dos tempos das consultas: {sum(result.seconds for result in results):.4f} s")
+    print(f"Tempo total das consultas: {wall_time:.4f} s")
+    print(f"Caminho crítico: {' -> '.join(chain)} ({chain_time:.4f} s)")
@@ -0,0 +1,119 @@
+"""
+Tipos de registo compactos produzidos pelo parsing do ficheiro SNAP (utils.py).
+
+Em vez de um dicionário por produto, por avaliação e por categoria, o parser devolve:
+- Product: uma classe com __slots__ (sem __dict__ por instância);
+- CategoryEntry: um namedtuple (ID antigo, nome, ID antigo do pai);
+- ReviewColumns: as avaliações de um produto guardadas em colunas (listas e arrays),
+  em vez de um objeto por avaliação.
+
+Os métodos `row()` e `rows()` devolvem as linhas já na ordem das colunas usadas pelo
+loader (loader.py), sem passar por um dicionário intermediário.
+"""
+
+import hashlib
+from array import array
+from collections import namedtuple
+from itertools import repeat
+
+# uma categoria de uma linha de categorias do produto (e também o valor guardado no
+# dicionário de categorias do ETL: ID antigo -> CategoryEntry)
+CategoryEntry = namedtuple('CategoryEntry', ['old_id', 'name', 'parent_old_id'])
+
+
+class ReviewColumns:
+    """
+    Avaliações de um produto em formato colunar: uma posição por avaliação em cada coluna.
+    As colunas numéricas usam array (2 ou 4 bytes por valor) em vez de objetos int.
+    """
+    __slots__ = ('dates', 'customers', 'ratings', 'votes', 'helpful')
+
+    def __init__(self):
+        self.dates = []
+        self.customers = []
+        self.ratings = array('h') # smallint, como na tabela reviews
+        self.votes = array('i')
+        self.helpful = array('i')
+
+    def append(self, review_date, customer, rating, votes, helpful):
+        self.dates.append(review_date)
+        self.customers.append(customer)
+        self.ratings.append(rating)
+        self.votes.append(votes)
+        self.helpful.append(helpful)
+
+    def rows(self, product_key, customer_keys=None):
+        """
+        Devolve as linhas (produto, cliente, rating, data, votos, úteis) na ordem das
+        colunas do INSERT/COPY da tabela reviews. `customer_keys` substitui os códigos
+        dos clientes (ex.: pelos IDs inteiros da tabela Customers).
+        """
+        customers = self.customers if customer_keys is None else customer_keys
+        return zip(repeat(product_key), customers, self.ratings, self.dates, self.votes, self.helpful)
+
+    def __len__(self):
+        return len(self.customers)
+
+    def __eq__(self, other):
+        if not isinstance(other, ReviewColumns):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+
+class Product:
+    """
+    Um produto do ficheiro SNAP, com os mesmos campos que antes existiam no dicionário
+    devolvido pelo parse_snap, mais a posição (`offset`, em bytes) da sua linha 'Id:'
+    no ficheiro, usada para retomar uma carga interrompida.
+    """
+    __slots__ = (
+        'id', 'offset', 'asin', 'title', 'group', 'salesrank', 'similar', 'categories', 'reviews',
+        'similar_count', 'categories_count', 'total', 'downloaded', 'avg_rating'
+    )
+
+    def __init__(self, source_id, offset=None):
+        self.id = source_id
+        self.offset = offset
+        self.asin = None
+        self.title = None
+        self.group = None
+        self.salesrank = None
+        self.similar = []
+        self.categories = []
+        self.reviews = ReviewColumns()
+        self.similar_count = 0
+        self.categories_count = 0
+        self.total = 0
+        self.downloaded = 0
+        self.avg_rating = None
+
+    def row(self):
+        """
+        Devolve a linha da tabela Products, na ordem das colunas usada pelo loader.
+        """
+        return (
+            self.id, self.asin, self.title, self.group, self.salesrank,
+            self.total, self.avg_rating, self.downloaded,
+            self.similar_count, self.categories_count
+        )
+
+    def content_hash(self):
+        """
+        Hash (16 bytes) de todo o conteúdo do produto que é gravado no banco: campos,
+        categorias, similares e reviews. Usado pela carga incremental para detetar
+        os produtos que mudaram entre dois dumps.
+        """
+        reviews = self.reviews
+        content = (
+            self.row(), [cat.old_id for cat in self.categories], self.similar,
+            reviews.dates, reviews.customers, reviews.ratings, reviews.votes, reviews.helpful
+        )
+        return hashlib.blake2b(repr(content).encode('utf-8'), digest_size=16).digest()
+
+    def __eq__(self, other):
+        if not isinstance(other, Product):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"Product(id={self.id!r}, asin={self.asin!r}, title={self.title!r})"
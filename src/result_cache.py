@@ -0,0 +1,219 @@
+"""
+Cache em disco dos resultados das consultas do dashboard (tp1_3.3.py --cache-dir).
+
+Os dados só mudam quando o ETL corre, por isso o resultado de uma consulta (colunas e
+linhas) é guardado em disco e reutilizado nas execuções seguintes do dashboard. A chave de
+cada resultado é o nome da consulta, o comando SQL, os seus parâmetros (ex.: o produto) e a
+versão dos dados gravada pelo ETL no fim de cada carga (tabela etl_data_version).
+
+- Cada versão dos dados tem o seu subdiretório; ao abrir a cache com uma versão nova os
+  subdiretórios das versões anteriores são apagados (invalidação automática). Só são
+  apagados os subdiretórios com o nome de uma versão e apenas com ficheiros da cache.
+- Cada resultado é um ficheiro binário (pickle comprimido com zlib).
+- O tamanho total é limitado: quando é ultrapassado, são apagados os resultados usados há
+  mais tempo (LRU, pela data de modificação do ficheiro, atualizada a cada uso).
+  Um resultado que sozinho não cabe nesse tamanho, ou com mais de MAX_CACHED_ROWS linhas,
+  não é guardado (as linhas são lidas do banco à medida que são usadas, sem ficarem na memória).
+- Sem versão (uma carga está em curso ou a tabela não existe) a cache não é usada.
+
+Os ficheiros são lidos com pickle, por isso o diretório da cache deve ser usado apenas
+pelo próprio utilizador.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import threading
+import zlib
+
+CACHE_SUFFIX = '.bin'
+# nome do subdiretório de cada versão (os primeiros 16 caracteres do digest)
+VERSION_DIR_RE = re.compile(r'[0-9a-f]{16}')
+# muda quando o conteúdo dos ficheiros muda, para não ler resultados gravados noutro formato
+CACHE_FORMAT = 2
+DEFAULT_CACHE_SIZE_MB = 64
+# resultados com mais linhas não são guardados: as linhas seguintes passam direto do cursor
+# do banco para quem as lê, sem ficarem na memória
+MAX_CACHED_ROWS = 50000
+
+
+def _digest(*parts):
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _is_version_dir(path):
+    # só apaga diretórios criados pela cache: o --cache-dir pode ser um diretório com outros
+    # ficheiros (ex.: o --output do dashboard, com os planos, o grafo ou o snapshot)
+    if not (VERSION_DIR_RE.fullmatch(os.path.basename(path)) and os.path.isdir(path)):
+        return False
+    # resultados e ficheiros temporários de put() que ficaram de uma execução interrompida
+    return all(entry.is_file() and CACHE_SUFFIX in entry.name and entry.name.endswith((CACHE_SUFFIX, '.tmp'))
+               for entry in os.scandir(path))
+
+
+class ResultCache:
+    """
+    Resultados das consultas para uma versão dos dados, num diretório com no máximo `max_bytes`.
+    """
+
+    def __init__(self, directory, version, max_bytes=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dir = os.path.join(directory, _digest(CACHE_FORMAT, version)[:16])
+        os.makedirs(self._dir, exist_ok=True)
+        for name in os.listdir(directory): # resultados de versões anteriores dos dados
+            path = os.path.join(directory, name)
+            if path != self._dir and _is_version_dir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _path(self, query_name, sql, params):
+        return os.path.join(self._dir, _digest(query_name, sql, params) + CACHE_SUFFIX)
+
+    def get(self, query_name, sql, params):
+        """
+        Devolve (colunas, linhas) guardados para a consulta, ou None (colunas: pares (nome, OID do tipo)).
+        """
+        path = self._path(query_name, sql, params)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path) # usado agora: passa para o fim da fila do LRU
+        except (OSError, EOFError, zlib.error, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, query_name, sql, params, columns, rows):
+        """
+        Guarda o resultado; devolve False (sem gravar) se não cabe sozinho na cache, porque
+        ao gravá-lo o _evict apagaria todos os outros resultados e depois o próprio.
+        """
+        path = self._path(query_name, sql, params)
+        data = zlib.compress(pickle.dumps((columns, rows), protocol=pickle.HIGHEST_PROTOCOL))
+        if len(data) > self.max_bytes:
+            return False
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path) # outro processo nunca vê um ficheiro incompleto
+        self._evict()
+        return True
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self._dir):
+                if entry.name.endswith(CACHE_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries): # os mais antigos primeiro
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def connection(self, conn, query_name):
+        """
+        Devolve uma conexão cujos cursores respondem às consultas de `query_name` a partir da cache.
+        """
+        return _CachedConnection(conn, self, query_name)
+
+
+class _CachedConnection:
+    """
+    Envolve uma conexão psycopg: os cursores criados guardam e reutilizam os resultados.
+    """
+
+    def __init__(self, conn, cache, query_name):
+        self._conn = conn
+        self._cache = cache
+        self._query_name = query_name
+
+    def cursor(self, name=None):
+        # com `name` os resultados que não vêm da cache são lidos por um cursor do lado do servidor
+        cur = self._conn.cursor(name=name) if name else self._conn.cursor()
+        return _CachedCursor(cur, self._cache, self._query_name)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _CachedCursor:
+    """
+    Cursor com a parte da interface usada pelo dashboard (execute, fetchall, fetchmany e description).
+
+    Um resultado que não está na cache é lido do cursor do banco à medida que é pedido, e as
+    linhas são juntadas para a cache só até MAX_CACHED_ROWS: a partir daí o resultado deixa
+    de ser guardado e as linhas seguintes não ficam na memória. É guardado quando é lido até ao fim.
+    """
+
+    def __init__(self, cur, cache, query_name):
+        self._cur = cur
+        self._cache = cache
+        self._query_name = query_name
+        self._rows = None # linhas vindas da cache, lidas a partir de self._position
+        self._position = 0
+        self._key = None # resultado a ler do banco e a guardar (None depois de guardado ou se não couber)
+        self._pending = None
+        self.description = None
+
+    def execute(self, sql, params=None):
+        key = (self._query_name, sql, tuple(params) if params is not None else None)
+        cached = self._cache.get(*key)
+        if cached is None:
+            self._cur.execute(sql, params)
+            self.description = [(desc[0], desc[1]) for desc in self._cur.description]
+            self._rows, self._key, self._pending = None, key, []
+        else:
+            self.description, self._rows = cached
+            self._key, self._pending = None, None
+        self._position = 0
+        return self
+
+    def fetchall(self):
+        rows = []
+        while True:
+            block = self.fetchmany(MAX_CACHED_ROWS)
+            if not block:
+                return rows
+            rows.extend(block)
+
+    def fetchmany(self, size):
+        if self._rows is not None:
+            rows = self._rows[self._position:self._position + size]
+            self._position += len(rows)
+            return rows
+        rows = self._cur.fetchmany(size)
+        if self._key is not None:
+            if not rows:
+                self._cache.put(*self._key, self.description, self._pending)
+                self._key, self._pending = None, None
+            elif len(self._pending) + len(rows) > MAX_CACHED_ROWS:
+                self._key, self._pending = None, None # grande demais para a cache
+            else:
+                self._pending.extend(rows)
+        return rows
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
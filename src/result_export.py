@@ -0,0 +1,285 @@
+"""
+Exportação em fluxo dos resultados das consultas do dashboard (tp1_3.3.py).
+
+Os resultados não são lidos todos para a memória: as linhas passam do banco para o
+ficheiro aos poucos, e no terminal é mostrada só uma pré-visualização das primeiras linhas
+(--preview-rows) e o total de registos. A memória usada não depende do número de linhas.
+
+- CSV: o próprio servidor gera o CSV com COPY (consulta) TO STDOUT, escrito no ficheiro à
+  medida que chega; a pré-visualização é lida do início desse fluxo.
+- Parquet (--format parquet, precisa do pacote opcional pyarrow): as linhas são lidas por um
+  cursor do lado do servidor (named cursor), FETCH_SIZE de cada vez, e cada bloco é gravado
+  como um row group do ficheiro. Os tipos das colunas vêm dos tipos do PostgreSQL (numeric é
+  gravado como double).
+- Sem diretório de saída as linhas são lidas pelo cursor do lado do servidor só para a
+  pré-visualização e a contagem.
+
+Com a cache de resultados (--cache-dir) o CSV é escrito a partir das linhas: as guardadas na
+cache ou, se a consulta ainda não está guardada, as lidas pelo cursor do lado do servidor, em
+blocos (a cache só guarda resultados até MAX_CACHED_ROWS linhas, ver src/result_cache.py).
+
+Com --explain o plano de execução de cada consulta é gravado ao lado do resultado
+(src/query_plans.py).
+"""
+
+import codecs
+import csv
+import os
+import sys
+from collections import deque, namedtuple
+
+import pandas as pd
+import psycopg
+
+from metrics import METRICS
+from query_plans import PLAN_SUFFIX, save_plan
+
+EXPORT_FORMATS = ('csv', 'parquet')
+DEFAULT_PREVIEW_ROWS = 20
+FETCH_SIZE = 10000
+EXPORT_CURSOR = 'dashboard_export'
+
+# destino dos resultados das consultas: diretório (None = só no terminal), formato dos
+# ficheiros, número de linhas mostradas no terminal e se os planos de execução são gravados
+ResultOutput = namedtuple('ResultOutput', ['directory', 'format', 'preview_rows', 'explain'])
+ResultOutput.__new__.__defaults__ = (None, 'csv', DEFAULT_PREVIEW_ROWS, False)
+
+COPY_CSV_SQL = "COPY ({}) TO STDOUT WITH (FORMAT CSV, HEADER)"
+
+
+def _is_streaming(conn):
+    # uma conexão psycopg (e não a conexão da cache de resultados, que já tem as linhas)
+    return isinstance(conn, psycopg.Connection)
+
+
+def _open_cursor(conn):
+    # cursor do lado do servidor, também através da cache de resultados: o que não vem da
+    # cache chega do banco em blocos de FETCH_SIZE e nunca é lido todo de uma vez
+    cur = conn.cursor(name=EXPORT_CURSOR)
+    if _is_streaming(conn):
+        cur.itersize = FETCH_SIZE
+    return cur
+
+
+def _fetch_blocks(cur):
+    while True:
+        rows = cur.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+
+def _print_preview(title, columns, preview, total, preview_rows):
+    print(f"\n{'='*10} {title} {'='*10}")
+    if total == 0:
+        print("Nenhum resultado encontrado.")
+        return
+    if preview_rows > 0:
+        print(pd.DataFrame(preview, columns=columns).to_string(index=False))
+        if total > len(preview):
+            print(f"... (mais {total - len(preview)} linhas)")
+    print(f"Total de registros: {total}")
+
+
+def _copy_csv(conn, sql, params, path, preview_rows):
+    """
+    Grava o resultado em CSV com COPY TO e devolve (colunas, primeiras linhas, total).
+    """
+    head = _CsvHead(preview_rows + 1) # o cabeçalho e as linhas da pré-visualização
+    with conn.cursor() as cur, open(path, 'wb') as f:
+        with cur.copy(COPY_CSV_SQL.format(sql.strip().rstrip(';')), params) as copy:
+            for data in copy:
+                f.write(data)
+                if not head.done:
+                    head.feed(data)
+        total = cur.rowcount
+    head.feed(b'', final=True)
+    return head.records[0], head.records[1:], total
+
+
+class _CsvHead:
+    """
+    Primeiros `limit` registos de um CSV recebido em blocos de bytes, lidos por um csv.reader
+    incremental. Um campo entre aspas pode ter quebras de linha, por isso o reader só recebe
+    as linhas de texto de registos completos (terminados fora de aspas).
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.records = []
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = '' # fim do último bloco, sem quebra de linha
+        self._record, self._quotes = [], 0 # linhas do registo em curso e aspas vistas nele
+        self._ready = deque()
+        self._reader = csv.reader(self)
+
+    @property
+    def done(self):
+        return len(self.records) >= self.limit
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._ready:
+            raise StopIteration
+        return self._ready.popleft()
+
+    def feed(self, data, final=False):
+        lines = (self._partial + self._decoder.decode(bytes(data), final)).splitlines(keepends=True)
+        self._partial = lines.pop() if lines and not final and not lines[-1].endswith(('\n', '\r')) else ''
+        for line in lines:
+            self._record.append(line)
+            self._quotes += line.count('"') # as aspas dentro de um campo ("") contam duas vezes
+            if self._quotes % 2 == 0 or final and line is lines[-1]:
+                self._parse()
+        if final and self._record:
+            self._parse()
+
+    def _parse(self):
+        self._ready.extend(self._record)
+        self._record, self._quotes = [], 0
+        if not self.done:
+            self.records.append(next(self._reader))
+        self._ready.clear()
+
+
+def _write_rows(description, blocks, path, file_format, preview_rows):
+    """
+    Grava os blocos de linhas no ficheiro (se houver) e devolve (colunas, primeiras linhas, total).
+    `description` tem o nome e o OID do tipo de cada coluna, como cursor.description.
+    """
+    columns = [desc[0] for desc in description]
+    preview, total = [], 0
+    writer = _open_writer(path, file_format, description) if path else None
+    try:
+        for rows in blocks:
+            if len(preview) < preview_rows:
+                preview.extend(rows[:preview_rows - len(preview)])
+            total += len(rows)
+            if writer:
+                writer.write(rows)
+    finally:
+        if writer:
+            writer.close()
+    return columns, preview, total
+
+
+class _CsvWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    """
+    Grava blocos de linhas como row groups de um ficheiro Parquet, com o esquema tirado dos
+    tipos das colunas no PostgreSQL (OIDs em cursor.description).
+    """
+
+    def __init__(self, path, description):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError(
+                "Para gravar os resultados em Parquet é preciso instalar o pacote 'pyarrow' (pip install pyarrow)."
+            )
+        self._pa = pa
+        types = {
+            16: (pa.bool_(), None),       # boolean
+            20: (pa.int64(), None),       # bigint
+            21: (pa.int16(), None),       # smallint
+            23: (pa.int32(), None),       # integer
+            700: (pa.float32(), float),   # real
+            701: (pa.float64(), float),   # double precision
+            1700: (pa.float64(), float),  # numeric
+            1082: (pa.date32(), None),    # date
+            25: (pa.string(), None),      # text
+            1042: (pa.string(), None),    # char(n)
+            1043: (pa.string(), None),    # varchar
+        }
+        columns = [(desc[0], *types.get(desc[1], (pa.string(), str))) for desc in description]
+        self._converters = [convert for _, _, convert in columns]
+        self._schema = pa.schema([(name, arrow_type) for name, arrow_type, _ in columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows):
+        arrays = []
+        for i, field in enumerate(self._schema):
+            convert = self._converters[i]
+            values = [row[i] if convert is None or row[i] is None else convert(row[i]) for row in rows]
+            arrays.append(self._pa.array(values, type=field.type))
+        self._writer.write_batch(self._pa.RecordBatch.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _open_writer(path, file_format, description):
+    if file_format == 'parquet':
+        return _ParquetWriter(path, description)
+    return _CsvWriter(path, [desc[0] for desc in description])
+
+
+def _result_path(output, filename):
+    if not (output.directory and filename):
+        return None
+    os.makedirs(output.directory, exist_ok=True)
+    return os.path.join(output.directory, f"{filename}.{output.format}")
+
+
+def _show_result(title, columns, preview, total, output, path):
+    METRICS.add_rows(total, os.path.getsize(path) if path else 0)
+    _print_preview(title, columns, preview, total, output.preview_rows)
+    if path and total > 0:
+        print(f"--> Resultado salvo em: {path}")
+    elif path:
+        os.remove(path) # como antes: sem resultados não há ficheiro
+
+
+def export_results(conn, sql, params, title, output, filename):
+    """
+    Executa a consulta e grava o resultado em `output.directory`/`filename`.<formato>
+    (se houver diretório), mostrando no terminal só as primeiras `output.preview_rows` linhas.
+    Com `output.explain` grava também o plano de execução em `filename`.plan.json.
+    """
+    output = output or ResultOutput()
+    path = _result_path(output, filename)
+
+    try:
+        if path and output.explain and _is_streaming(conn):
+            plan = save_plan(conn, sql, params, os.path.join(output.directory, filename + PLAN_SUFFIX))
+            print(f"--> Plano de execução salvo ({plan['Execution Time']:.3f} ms): {filename}{PLAN_SUFFIX}")
+        if path and output.format == 'csv' and _is_streaming(conn):
+            columns, preview, total = _copy_csv(conn, sql, params, path, output.preview_rows)
+        else:
+            with _open_cursor(conn) as cur:
+                cur.execute(sql, params)
+                columns, preview, total = _write_rows(cur.description, _fetch_blocks(cur), path, output.format, output.preview_rows)
+    except OSError as e:
+        print(f"Erro ao salvar o arquivo '{path}': {e}", file=sys.stderr)
+        return
+    _show_result(title, columns, preview, total, output, path)
+
+
+def export_rows(description, rows, title, output, filename):
+    """
+    Como export_results, para linhas já calculadas fora do banco (ex.: pelo grafo dos
+    produtos similares); `description` tem pares (nome, OID do tipo) das colunas.
+    """
+    output = output or ResultOutput()
+    path = _result_path(output, filename)
+    try:
+        columns, preview, total = _write_rows(description, [rows] if rows else [], path, output.format, output.preview_rows)
+    except OSError as e:
+        print(f"Erro ao salvar o arquivo '{path}': {e}", file=sys.stderr)
+        return
+    _show_result(title, columns, preview, total, output, path)
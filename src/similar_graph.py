@@ -0,0 +1,264 @@
+"""
+Grafo dos produtos similares (Related_products) em formato CSR, exportado no fim do ETL
+(tp1_3.2.py --graph-dir) e lido pelo dashboard (tp1_3.3.py --graph-dir) sem consultar o banco.
+
+Cada produto é um nó, numerado pela ordem do source_id. O grafo fica num diretório com
+ficheiros .npy, abertos com mmap (só as páginas usadas são lidas do disco):
+- source_ids.npy: source_id de cada nó (ordenado, procurado por pesquisa binária);
+- salesrank.npy: salesrank de cada nó (0 quando não tem);
+- asins.npy: ASIN de cada nó (bytes de largura fixa);
+- offsets.npy e neighbors.npy: os vizinhos do nó i são neighbors[offsets[i]:offsets[i + 1]]
+  (cada par de Related_products aparece nos dois sentidos);
+- graph.json: número de nós e de arestas e a versão dos dados (etl_data_version) exportada.
+
+Os produtos a até `hops` saltos de um produto são encontrados por uma pesquisa em largura
+sobre estes vetores, em microssegundos, e ordenados pelo salesrank: relatórios do tipo
+"quem viu este produto também viu", que em SQL precisariam de consultas recursivas.
+
+Uso (exportar de um banco já carregado e consultar):
+    python src/similar_graph.py export --db-host localhost --db-name ecommerce --db-user postgres --db-pass postgres --graph-dir out/graph
+    python src/similar_graph.py query --graph-dir out/graph --asin 0385492081 --hops 3 --limit 20
+"""
+
+import argparse
+import json
+import os
+import shutil
+import struct
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from checkpoint import read_data_version
+
+GRAPH_META = 'graph.json'
+GRAPH_ARRAYS = ('source_ids', 'salesrank', 'asins', 'offsets', 'neighbors')
+ASIN_WIDTH = 20 # como Products.asin VARCHAR(20)
+DEFAULT_HOPS = 2
+DEFAULT_LIMIT = 20
+
+# cada coluna é lida como um único vetor no formato binário do PostgreSQL (array_send):
+# um cabeçalho de ARRAY_HEADER bytes (1 dimensão, sem NULLs) e, para cada elemento, o tamanho
+# (int32) e o valor; com elementos de largura fixa o vetor é lido diretamente pelo numpy
+ARRAY_HEADER = 20
+PRODUCTS_SQL = f"""
+    SELECT
+        array_send(array_agg(source_id ORDER BY source_id)),
+        array_send(array_agg(COALESCE(salesrank, 0) ORDER BY source_id)),
+        array_send(array_agg(CAST(asin AS CHAR({ASIN_WIDTH})) ORDER BY source_id))
+    FROM Products
+"""
+RELATED_SQL = "SELECT array_send(array_agg(product1_id)), array_send(array_agg(product2_id)) FROM Related_products"
+
+
+def binary_array(data, value_dtype):
+    """
+    Converte o resultado de array_send (None para uma tabela vazia) num vetor do numpy.
+    """
+    if data is None:
+        return np.empty(0, dtype=value_dtype)
+    ndim, has_nulls = struct.unpack('>ii', data[:8])
+    if ndim != 1 or has_nulls:
+        raise RuntimeError("vetor binário inesperado (mais de uma dimensão ou com NULLs)")
+    dtype = np.dtype([('length', '>i4'), ('value', value_dtype)])
+    values = np.frombuffer(data, dtype=dtype, offset=ARRAY_HEADER)
+    if (values['length'] != np.dtype(value_dtype).itemsize).any():
+        raise RuntimeError("o vetor binário tem elementos de tamanho variável")
+    return values['value']
+
+
+def build_csr(source_ids, edges1, edges2):
+    """
+    Devolve (offsets, neighbors) do grafo não orientado com as arestas (edges1[i], edges2[i])
+    entre os source_ids de `source_ids` (ordenado); os vizinhos são índices de nós.
+    """
+    nodes1, nodes2 = np.searchsorted(source_ids, edges1), np.searchsorted(source_ids, edges2)
+    sources = np.concatenate([nodes1, nodes2])
+    targets = np.concatenate([nodes2, nodes1])
+    order = np.argsort(sources, kind='stable')
+    offsets = np.zeros(len(source_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(source_ids)), out=offsets[1:])
+    return offsets, targets[order].astype(np.int32)
+
+
+def export_graph(conn, directory, version=None):
+    """
+    Lê os produtos e Related_products e grava o grafo em `directory` (substituindo o anterior).
+    Devolve (número de nós, número de arestas).
+    """
+    with conn.cursor() as cur:
+        cur.execute(PRODUCTS_SQL)
+        source_ids, salesrank, asins = cur.fetchone()
+        cur.execute(RELATED_SQL)
+        edges1, edges2 = cur.fetchone()
+    conn.commit()
+
+    source_ids = binary_array(source_ids, '>i4').astype(np.int32)
+    edges1, edges2 = binary_array(edges1, '>i4'), binary_array(edges2, '>i4')
+    offsets, neighbors = build_csr(source_ids, edges1, edges2)
+    arrays = {
+        'source_ids': source_ids,
+        'salesrank': binary_array(salesrank, '>i4').astype(np.int32),
+        'asins': binary_array(asins, f'S{ASIN_WIDTH}'),
+        'offsets': offsets,
+        'neighbors': neighbors,
+    }
+
+    # grava num diretório temporário e troca no fim, para nunca deixar um grafo incompleto
+    temp_dir = f"{directory.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_dir, f"{name}.npy"), array)
+    with open(os.path.join(temp_dir, GRAPH_META), 'w', encoding='utf-8') as f:
+        json.dump({'nodes': len(source_ids), 'edges': len(edges1), 'data_version': version,
+                   'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')}, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(temp_dir, directory)
+    return len(source_ids), len(edges1)
+
+
+class SimilarGraph:
+    """
+    Grafo exportado por export_graph, aberto com mmap.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, GRAPH_META), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        for name in GRAPH_ARRAYS:
+            # ndarray sobre o mmap: o acesso a um elemento de um np.memmap é bem mais lento
+            array = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+            setattr(self, name, np.asarray(array))
+
+    @property
+    def data_version(self):
+        return self.meta.get('data_version')
+
+    def node(self, source_id):
+        # índice do nó com este source_id, ou None
+        i = int(np.searchsorted(self.source_ids, source_id))
+        if i < len(self.source_ids) and self.source_ids[i] == source_id:
+            return i
+        return None
+
+    def node_by_asin(self, asin):
+        # sem índice pelo ASIN: percorre o vetor (só para a linha de comando)
+        matches = np.flatnonzero(self.asins == asin.encode('ascii').ljust(ASIN_WIDTH))
+        return int(matches[0]) if len(matches) else None
+
+    def neighbors_within(self, node, hops):
+        """
+        Pesquisa em largura: devolve {nó: número de saltos} dos nós a até `hops` saltos de `node`.
+        """
+        distance = {node: 0}
+        frontier = [node]
+        for hop in range(1, hops + 1):
+            next_frontier = []
+            for current in frontier:
+                for neighbor in self.neighbors[self.offsets[current]:self.offsets[current + 1]].tolist():
+                    if neighbor not in distance:
+                        distance[neighbor] = hop
+                        next_frontier.append(neighbor)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        del distance[node]
+        return distance
+
+    def recommend(self, source_id, hops=DEFAULT_HOPS, limit=DEFAULT_LIMIT, better_only=False):
+        """
+        Produtos a até `hops` saltos do produto `source_id`, com salesrank, ordenados pelo
+        salesrank (melhor primeiro) e depois pela distância; com `better_only` só os que têm
+        melhor salesrank do que o próprio produto (como a consulta 2). Devolve até `limit`
+        tuplos (source_id, asin, salesrank, saltos); None se o produto não está no grafo.
+        """
+        node = self.node(source_id)
+        if node is None:
+            return None
+        distance = self.neighbors_within(node, hops)
+        nodes = np.fromiter(distance.keys(), dtype=np.int64, count=len(distance))
+        distances = np.fromiter(distance.values(), dtype=np.int64, count=len(distance))
+        ranks = self.salesrank[nodes]
+        keep = ranks > 0
+        if better_only:
+            keep &= ranks < self.salesrank[node]
+        nodes, distances, ranks = nodes[keep], distances[keep], ranks[keep]
+        best = np.lexsort((distances, ranks))[:limit or None]
+        chosen = nodes[best]
+        return list(zip(self.source_ids[chosen].tolist(), [asin.decode('ascii').rstrip() for asin in self.asins[chosen].tolist()],
+                        ranks[best].tolist(), distances[best].tolist()))
+
+
+def open_graph(conn, directory):
+    """
+    Abre o grafo de `directory` se foi exportado da versão atual dos dados; caso contrário
+    (ou se não existir) mostra um aviso e devolve None.
+    """
+    try:
+        graph = SimilarGraph(directory)
+    except (OSError, ValueError) as e:
+        print(f"AVISO: grafo dos produtos similares indisponível em '{directory}' ({e}).", file=sys.stderr)
+        return None
+    with conn.cursor() as cur:
+        version = read_data_version(cur)
+    conn.commit()
+    if version is None or graph.data_version != version:
+        print(f"AVISO: o grafo em '{directory}' não corresponde à versão atual dos dados; volte a exportá-lo "
+              f"(tp1_3.2.py --graph-dir ou python src/similar_graph.py export).", file=sys.stderr)
+        return None
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta e consulta o grafo CSR dos produtos similares.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="Exporta o grafo a partir do banco de dados")
+    export.add_argument("--db-host", required=True)
+    export.add_argument("--db-port", type=int, default=5432)
+    export.add_argument("--db-name", required=True)
+    export.add_argument("--db-user", required=True)
+    export.add_argument("--db-pass", required=True)
+    export.add_argument("--graph-dir", required=True, help="Diretório onde gravar o grafo")
+    query = commands.add_parser('query', help="Produtos a até N saltos de um produto, pelo salesrank")
+    query.add_argument("--graph-dir", required=True, help="Diretório do grafo exportado")
+    product = query.add_mutually_exclusive_group(required=True)
+    product.add_argument("--asin", help="ASIN do produto")
+    product.add_argument("--product-id", type=int, help="source_id do produto")
+    query.add_argument("--hops", type=int, default=DEFAULT_HOPS, help="Número máximo de saltos")
+    query.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="Número de produtos mostrados")
+    query.add_argument("--better-only", action="store_true", help="Só produtos com melhor salesrank do que o indicado")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        from db import get_conn
+        conn = get_conn(args.db_host, args.db_port, args.db_name, args.db_user, args.db_pass)
+        try:
+            start = time.perf_counter()
+            with conn.cursor() as cur:
+                version = read_data_version(cur)
+            nodes, edges = export_graph(conn, args.graph_dir, version)
+            print(f"Grafo com {nodes} produtos e {edges} relações gravado em '{args.graph_dir}' "
+                  f"em {time.perf_counter() - start:.2f} segundos.")
+        finally:
+            conn.close()
+        return
+
+    if args.hops < 1:
+        parser.error("--hops deve ser pelo menos 1")
+    graph = SimilarGraph(args.graph_dir)
+    node = graph.node_by_asin(args.asin) if args.asin else graph.node(args.product_id)
+    if node is None:
+        parser.error("produto não encontrado no grafo")
+    start = time.perf_counter()
+    results = graph.recommend(int(graph.source_ids[node]), args.hops, args.limit, args.better_only)
+    elapsed = time.perf_counter() - start
+    for source_id, asin, rank, hop in results:
+        print(f"{asin}\tsalesrank {rank}\t{hop} salto(s)\t(source_id {source_id})")
+    print(f"{len(results)} produtos em {elapsed * 1e6:.0f} µs.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+"""
+Snapshot colunar dos dados, para o dashboard sem PostgreSQL (tp1_3.3.py --snapshot).
+
+No fim do ETL (tp1_3.2.py --snapshot-dir) as tabelas usadas pelas consultas são gravadas
+num diretório com um ficheiro .npy por coluna, abertos com mmap (só as páginas usadas são
+lidas do disco):
+- products: source_id (ordenado), salesrank (0 quando não tem), asin, titulo e group_name;
+- reviews: product_id, customer (linha de customers), rating, helpful, votes e review_date
+  (dias desde 1970-01-01), ordenadas pelo produto e depois pelo review_id;
+- customers: customer_id (ordenado) e customer_code;
+- product_category, category_hierarchy e categories (category_id ordenado, category_name);
+- related: os produtos similares em formato CSR (offsets/neighbors, como em similar_graph.py),
+  com os nós pela ordem de products.
+
+As colunas de texto são codificadas com um dicionário: `<coluna>.codes.npy` tem, para cada
+linha, o índice do valor no dicionário, e os valores (ordenados pela collation do banco) estão
+concatenados em `<coluna>.dict.npy` (bytes UTF-8), com as posições em `<coluna>.offsets.npy`.
+As colunas são lidas do banco num único valor por coluna (array_send de um array_agg),
+convertido diretamente pelo numpy; as reviews em blocos de review_id.
+
+As consultas 1 a 7 são respondidas sobre estes vetores (agrupamentos com bincount/unique e
+top-k com lexsort), com os mesmos ficheiros de resultado do dashboard. Com `compare` os
+resultados das duas versões (dois diretórios --output) são comparados ficheiro a ficheiro.
+
+Uso:
+    python src/snapshot.py export --db-host localhost --db-name ecommerce --db-user postgres --db-pass postgres --snapshot-dir out/snapshot
+    python src/tp1_3.3.py --snapshot out/snapshot --product-asin 0385492081 --output out/offline
+    python src/snapshot.py compare --expected out --actual out/offline
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import shutil
+import sys
+import time
+from decimal import Decimal
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from checkpoint import read_data_version
+from result_export import export_rows
+from similar_graph import binary_array, build_csr
+
+SNAPSHOT_META = 'snapshot.json'
+REVIEWS_CHUNK = 1000000 # review_ids lidos de cada vez
+EPOCH = datetime.date(1970, 1, 1)
+
+# colunas numéricas de cada tabela: (nome, expressão SQL, tipo no array_send), pela ordem de `key`
+NUMERIC_COLUMNS = {
+    'products': ('source_id', [('source_id', 'source_id', '>i4'), ('salesrank', 'COALESCE(salesrank, 0)', '>i4')]),
+    'customers': ('customer_id', [('customer_id', 'customer_id', '>i4')]),
+    'categories': ('category_id', [('category_id', 'category_id', '>i4')]),
+    'product_category': ('product_id, category_id', [('product_id', 'product_id', '>i4'), ('category_id', 'category_id', '>i4')]),
+    'category_hierarchy': ('child_category_id, parent_category_id',
+                           [('parent_category_id', 'parent_category_id', '>i4'), ('child_category_id', 'child_category_id', '>i4')]),
+}
+# colunas de texto (tabela, coluna, ordem das linhas)
+STRING_COLUMNS = (
+    ('products', 'asin', 'source_id'),
+    ('products', 'titulo', 'source_id'),
+    ('products', 'group_name', 'source_id'),
+    ('customers', 'customer_code', 'customer_id'),
+    ('categories', 'category_name', 'category_id'),
+)
+REVIEW_COLUMNS = [
+    ('review_id', 'review_id', '>i4'),
+    ('product_id', 'product_id', '>i4'),
+    ('customer_id', 'customer_id', '>i4'),
+    ('rating', 'rating', '>i2'),
+    ('helpful', 'helpful', '>i4'),
+    ('votes', 'votes', '>i4'),
+    ('review_date', "review_date - DATE '1970-01-01'", '>i4'),
+]
+
+NUMERIC_SQL = "SELECT {columns} FROM {table}"
+STRING_SQL = """
+    WITH dictionary AS (
+        SELECT value, (ROW_NUMBER() OVER (ORDER BY value) - 1)::int4 AS code
+        FROM (SELECT DISTINCT {column} AS value FROM {table}) d
+    )
+    SELECT
+        (SELECT array_send(array_agg(d.code ORDER BY {key})) FROM {table} t JOIN dictionary d ON d.value = t.{column}),
+        (SELECT string_agg(convert_to(value, 'UTF8'), ''::bytea ORDER BY code) FROM dictionary),
+        (SELECT array_send(array_agg(octet_length(convert_to(value, 'UTF8')) ORDER BY code)) FROM dictionary)
+"""
+REVIEWS_SQL = "SELECT {columns} FROM reviews WHERE review_id > %s AND review_id <= %s"
+RELATED_SQL = "SELECT array_send(array_agg(product1_id)), array_send(array_agg(product2_id)) FROM Related_products"
+
+# tipos (OIDs do PostgreSQL) das colunas de cada resultado, como em cursor.description
+Q1_COLUMNS = [('rating', 21), ('helpful', 23), ('votes', 23), ('customer_id', 1043), ('review_date', 1082)]
+Q2_COLUMNS = [('asin', 1043), ('titulo', 25), ('salesrank', 23)]
+Q3_COLUMNS = [('review_date', 1082), ('num_avaliacoes', 20), ('media_avaliacoes', 1700)]
+Q4_COLUMNS = [('group_name', 25), ('rank_in_group', 20), ('titulo', 25), ('salesrank', 23)]
+Q5_COLUMNS = [('asin', 1043), ('titulo', 25), ('media_avaliacoes_uteis', 1700), ('total_avaliacoes_positivas', 20)]
+Q6_COLUMNS = [('category_name', 25), ('media_avaliacoes_uteis', 1700), ('total_reviews_agregado', 1700)]
+Q7_COLUMNS = [('group_name', 25), ('rank_in_group', 20), ('customer_id', 1043), ('total_comentarios', 20)]
+
+# colunas da ordenação de cada resultado: linhas com os mesmos valores nestas colunas (empates)
+# podem vir por outra ordem, ou ser outras no limite do LIMIT, sem que o resultado esteja errado
+RESULT_SORT_KEYS = {
+    'q1_top5_reviews_pos': ['helpful', 'rating'],
+    'q1_top5_reviews_neg': ['helpful', 'rating'],
+    'q2_similar_products_sales_melhor': ['salesrank'],
+    'q3_evolucao_media_avaliacoes': None, # ordenado por uma chave única: tem de ser igual
+    'q4_top10_produtos_lideres_venda_por_grupo': ['group_name', 'salesrank'],
+    'q5_top10_produtos_maior_media_avaliacoes_uteis': ['media_avaliacoes_uteis'],
+    'q6_top5_categorias_maior_media_avaliacoes_uteis': ['media_avaliacoes_uteis'],
+    'q7_top10_clientes_mais_comentarios_por_grupo': ['group_name', 'total_comentarios'],
+}
+
+
+def _fetch_arrays(cur, sql, params, dtypes):
+    cur.execute(sql, params)
+    return [binary_array(value, dtype) for value, dtype in zip(cur.fetchone(), dtypes)]
+
+
+def _aggregate(columns, key):
+    return ', '.join(f"array_send(array_agg({expression} ORDER BY {key}))" for _, expression, _ in columns)
+
+
+def _read_string_column(cur, table, column, key):
+    """
+    Devolve (códigos, dicionário em bytes, posições) da coluna de texto, com as linhas pela ordem de `key`.
+    """
+    cur.execute(STRING_SQL.format(table=table, column=column, key=', '.join(f"t.{part.strip()}" for part in key.split(','))))
+    codes, data, lengths = cur.fetchone()
+    lengths = binary_array(lengths, '>i4')
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return binary_array(codes, '>i4').astype(np.int32), np.frombuffer(data or b'', dtype=np.uint8), offsets
+
+
+def _read_reviews(cur):
+    """
+    Lê as reviews em blocos de REVIEWS_CHUNK review_ids e devolve as colunas ordenadas pelo
+    produto e depois pelo review_id.
+    """
+    cur.execute("SELECT COALESCE(MAX(review_id), 0) FROM reviews")
+    max_id = cur.fetchone()[0]
+    sql = REVIEWS_SQL.format(columns=_aggregate(REVIEW_COLUMNS, 'review_id'))
+    chunks = []
+    for start in range(0, max_id, REVIEWS_CHUNK):
+        chunks.append(_fetch_arrays(cur, sql, (start, start + REVIEWS_CHUNK), [dtype for _, _, dtype in REVIEW_COLUMNS]))
+    columns = {}
+    for i, (name, _, dtype) in enumerate(REVIEW_COLUMNS):
+        parts = [chunk[i] for chunk in chunks]
+        columns[name] = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+    order = np.argsort(columns['product_id'], kind='stable') # os blocos já vêm pelo review_id
+    return {name: values[order] for name, values in columns.items()}
+
+
+def export_snapshot(conn, directory, version=None):
+    """
+    Grava o snapshot das tabelas em `directory` (substituindo o anterior) e devolve o número
+    de linhas de cada tabela.
+    """
+    arrays = {}
+    with conn.cursor() as cur:
+        for table, (key, columns) in NUMERIC_COLUMNS.items():
+            values = _fetch_arrays(cur, NUMERIC_SQL.format(columns=_aggregate(columns, key), table=table), None,
+                                   [dtype for _, _, dtype in columns])
+            for (name, _, _), array in zip(columns, values):
+                arrays[f"{table}.{name}"] = array.astype(np.int32)
+        for table, column, key in STRING_COLUMNS:
+            codes, data, offsets = _read_string_column(cur, table, column, key)
+            arrays.update({f"{table}.{column}.codes": codes, f"{table}.{column}.dict": data,
+                           f"{table}.{column}.offsets": offsets})
+        reviews = _read_reviews(cur)
+        cur.execute(RELATED_SQL)
+        edges1, edges2 = (binary_array(value, '>i4') for value in cur.fetchone())
+    conn.commit()
+
+    # as reviews referenciam a linha do cliente em customers (o dicionário dos códigos)
+    arrays['reviews.customer'] = np.searchsorted(arrays['customers.customer_id'], reviews.pop('customer_id')).astype(np.int32)
+    del reviews['review_id']
+    for name, values in reviews.items():
+        arrays[f"reviews.{name}"] = values.astype(np.int16 if name == 'rating' else np.int32)
+    arrays['related.offsets'], arrays['related.neighbors'] = build_csr(arrays['products.source_id'], edges1, edges2)
+
+    rows = {table: len(arrays[f"{table}.{key.split(',')[0]}"]) for table, (key, _) in NUMERIC_COLUMNS.items()}
+    rows['reviews'] = len(arrays['reviews.product_id'])
+    rows['related_products'] = len(edges1)
+
+    # grava num diretório temporário e troca no fim, para nunca deixar um snapshot incompleto
+    temp_dir = f"{directory.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_dir, f"{name}.npy"), array)
+    with open(os.path.join(temp_dir, SNAPSHOT_META), 'w', encoding='utf-8') as f:
+        json.dump({'data_version': version, 'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'rows': rows}, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(temp_dir, directory)
+    return rows
+
+
+class StringColumn:
+    """
+    Coluna de texto codificada com um dicionário (códigos por linha, valores concatenados).
+    """
+
+    def __init__(self, codes, data, offsets):
+        self.codes = codes
+        self._data = data
+        self._offsets = offsets
+
+    def value(self, code):
+        return self._data[self._offsets[code]:self._offsets[code + 1]].tobytes().decode('utf-8')
+
+    def take(self, rows):
+        return [self.value(code) for code in self.codes[rows].tolist()]
+
+    def dictionary(self):
+        blob = self._data.tobytes()
+        offsets = self._offsets.tolist()
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def find(self, value):
+        """
+        Código do valor no dicionário, ou None: procura os bytes no dicionário concatenado
+        e confirma que a posição encontrada é o início de um valor com o mesmo tamanho.
+        """
+        needle, blob = value.encode('utf-8'), self._data.tobytes()
+        position = blob.find(needle)
+        while position >= 0:
+            code = int(np.searchsorted(self._offsets, position))
+            if code < len(self._offsets) - 1 and self._offsets[code] == position and self._offsets[code + 1] - position == len(needle):
+                return code
+            position = blob.find(needle, position + 1)
+        return None
+
+
+class Snapshot:
+    """
+    Snapshot gravado por export_snapshot, com as colunas abertas com mmap quando usadas.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, SNAPSHOT_META), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self._arrays = {}
+        self._derived = {}
+
+    @property
+    def data_version(self):
+        return self.meta.get('data_version')
+
+    def column(self, name):
+        if name not in self._arrays:
+            # ndarray sobre o mmap: o acesso a um elemento de um np.memmap é bem mais lento
+            self._arrays[name] = np.asarray(np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode='r'))
+        return self._arrays[name]
+
+    def strings(self, name):
+        return StringColumn(self.column(f"{name}.codes"), self.column(f"{name}.dict"), self.column(f"{name}.offsets"))
+
+    def _cached(self, name, compute):
+        if name not in self._derived:
+            self._derived[name] = compute()
+        return self._derived[name]
+
+    def product_rows(self, source_ids):
+        return np.searchsorted(self.column('products.source_id'), source_ids)
+
+    def review_range(self, product_id):
+        # as reviews estão ordenadas pelo produto
+        product_ids = self.column('reviews.product_id')
+        return slice(int(np.searchsorted(product_ids, product_id, 'left')), int(np.searchsorted(product_ids, product_id, 'right')))
+
+    def review_products(self):
+        # linha em products do produto de cada review
+        return self._cached('review_products', lambda: self.product_rows(self.column('reviews.product_id')))
+
+    def positive_totals(self):
+        """
+        (soma dos helpful, número) das reviews com rating >= 3 de cada produto (linha de products),
+        como na tabela de resumo ProductReviewSummary.
+        """
+        def compute():
+            positive = self.column('reviews.rating') >= 3
+            rows = self.review_products()[positive]
+            size = len(self.column('products.source_id'))
+            helpful = np.bincount(rows, weights=self.column('reviews.helpful')[positive], minlength=size)
+            return helpful.astype(np.int64), np.bincount(rows, minlength=size)
+        return self._cached('positive_totals', compute)
+
+
+def _date(days):
+    return EPOCH + datetime.timedelta(days=days)
+
+
+def _rounded(total, count):
+    """
+    total / count arredondado a 2 casas como o numeric do PostgreSQL (metade para longe do zero),
+    em inteiros: devolve os centésimos (total >= 0).
+    """
+    return (200 * total + count) // (2 * count)
+
+
+def _cents(value):
+    return Decimal(int(value)).scaleb(-2)
+
+
+def _top_per_group(groups, sort_keys, limit):
+    """
+    Índices das primeiras `limit` linhas de cada grupo pela ordem de `sort_keys` (a primeira
+    chave é a principal, como em ORDER BY) e a posição de cada uma no grupo (1, 2, ...).
+    """
+    order = np.lexsort(tuple(reversed(sort_keys)) + (groups,))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    ranks = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    keep = ranks < limit
+    return order[keep], ranks[keep] + 1
+
+
+def find_product(snapshot, identifier, identifier_type, candidates=5):
+    """
+    Como get_product do dashboard: devolve (source_id, asin) do produto, procurado pelo
+    source_id, pelo ASIN ou pelo título (prefixo e, se nada for encontrado, qualquer parte do
+    título, sem distinguir maiúsculas), ou None.
+    """
+    source_ids = snapshot.column('products.source_id')
+    asins = snapshot.strings('products.asin')
+    if identifier_type == 'source_id':
+        row = int(np.searchsorted(source_ids, identifier))
+        rows = [row] if row < len(source_ids) and source_ids[row] == identifier else []
+    elif identifier_type == 'asin':
+        code = asins.find(identifier)
+        rows = np.flatnonzero(asins.codes == code).tolist() if code is not None else []
+    else:
+        titles = snapshot.strings('products.titulo')
+        dictionary = snapshot._cached('titles', titles.dictionary)
+        text = identifier.strip().lower()
+        if not text:
+            print(f"ERRO: Nenhum produto encontrado com {identifier_type} '{identifier}'.", file=sys.stderr)
+            return None
+        matches = sorted((title.lower(), code) for code, title in enumerate(dictionary) if title.lower().startswith(text))
+        method = 'prefixo'
+        if not matches:
+            matches = sorted((len(title), title, code) for code, title in enumerate(dictionary) if text in title.lower())
+            method = 'parte do título'
+        codes = [match[-1] for match in matches[:candidates]]
+        rows = []
+        for code in codes:
+            rows += np.flatnonzero(titles.codes == code).tolist()
+        rows = rows[:candidates]
+        if len(rows) > 1:
+            print(f"Produtos encontrados com o título '{identifier}' (procura por {method}, melhores primeiro):")
+            for row in rows:
+                print(f"  - ASIN: {asins.take([row])[0]}, Título: {dictionary[titles.codes[row]]}")
+            print(f"A usar o primeiro: {asins.take([rows[0]])[0]}. Seja mais específico ou use o ASIN/source_id para escolher outro.")
+    if not rows:
+        print(f"ERRO: Nenhum produto encontrado com {identifier_type} '{identifier}'.", file=sys.stderr)
+        return None
+    return int(source_ids[rows[0]]), asins.take([rows[0]])[0]
+
+
+#  Consultas sobre o snapshot, com os mesmos resultados (e ficheiros) das consultas do dashboard
+
+def query1(snapshot, product_id, product_asin, output):
+    reviews = snapshot.review_range(product_id)
+    rating = snapshot.column('reviews.rating')[reviews]
+    helpful = snapshot.column('reviews.helpful')[reviews]
+    votes = snapshot.column('reviews.votes')[reviews]
+    dates = snapshot.column('reviews.review_date')[reviews]
+    customers = snapshot.strings('customers.customer_code')
+    customer_rows = snapshot.column('reviews.customer')[reviews]
+
+    def rows(order):
+        chosen = order[:5]
+        codes = customers.take(customer_rows[chosen])
+        return [(int(rating[i]), int(helpful[i]), int(votes[i]), code, _date(int(dates[i])))
+                for i, code in zip(chosen.tolist(), codes)]
+
+    export_rows(Q1_COLUMNS, rows(np.lexsort((-rating, -helpful))),
+                f"Query 1: Top 5 comentários úteis e com maior avaliação (ASIN: {product_asin})", output, f"q1_top5_reviews_pos_{product_asin}")
+    export_rows(Q1_COLUMNS, rows(np.lexsort((rating, -helpful))),
+                f"Query 1: Top 5 comentários úteis e com menor avaliação (ASIN: {product_asin})", output, f"q1_top5_reviews_neg_{product_asin}")
+
+
+def query2(snapshot, product_id, product_asin, output):
+    node = int(snapshot.product_rows(product_id))
+    offsets = snapshot.column('related.offsets')
+    neighbors = snapshot.column('related.neighbors')[offsets[node]:offsets[node + 1]]
+    salesrank = snapshot.column('products.salesrank')
+    ranks = salesrank[neighbors]
+    neighbors = neighbors[(ranks > 0) & (ranks < salesrank[node])]
+    neighbors = neighbors[np.argsort(salesrank[neighbors], kind='stable')]
+    rows = list(zip(snapshot.strings('products.asin').take(neighbors), snapshot.strings('products.titulo').take(neighbors),
+                    salesrank[neighbors].tolist()))
+    export_rows(Q2_COLUMNS, rows, f"Query 2: produtos similares a {product_asin} com melhor ranking de vendas",
+                output, f"q2_similar_products_sales_melhor_{product_asin}")
+
+
+def query3(snapshot, product_id, product_asin, output):
+    reviews = snapshot.review_range(product_id)
+    dates, day_rows, counts = np.unique(snapshot.column('reviews.review_date')[reviews], return_inverse=True, return_counts=True)
+    totals = np.bincount(day_rows, weights=snapshot.column('reviews.rating')[reviews], minlength=len(dates)).astype(np.int64)
+    rows = [(_date(day), count, _cents(cents))
+            for day, count, cents in zip(dates.tolist(), counts.tolist(), _rounded(totals, counts).tolist())]
+    export_rows(Q3_COLUMNS, rows, f"Query 3: Evolução diária das médias de avaliação para o produto {product_asin}",
+                output, f"q3_evolucao_media_avaliacoes_{product_asin}")
+
+
+def query4(snapshot, output):
+    salesrank = snapshot.column('products.salesrank')
+    groups = snapshot.strings('products.group_name')
+    ranked = np.flatnonzero(salesrank > 0)
+    chosen, ranks = _top_per_group(groups.codes[ranked], [salesrank[ranked]], 10)
+    products = ranked[chosen]
+    rows = list(zip(groups.take(products), ranks.tolist(), snapshot.strings('products.titulo').take(products),
+                    salesrank[products].tolist()))
+    export_rows(Q4_COLUMNS, rows, "Query 4: Top 10 produtos líderes de venda por grupo de produtos",
+                output, "q4_top10_produtos_lideres_venda_por_grupo")
+
+
+def query5(snapshot, output):
+    helpful, counts = snapshot.positive_totals()
+    products = np.flatnonzero(counts)
+    average = helpful[products] / counts[products]
+    products = products[np.argsort(-average, kind='stable')[:10]]
+    rows = list(zip(snapshot.strings('products.asin').take(products), snapshot.strings('products.titulo').take(products),
+                    [_cents(cents) for cents in _rounded(helpful[products], counts[products]).tolist()],
+                    counts[products].tolist()))
+    export_rows(Q5_COLUMNS, rows, "Query 5: Top 10 produtos com maior média de avaliações úteis (rating >= 3)",
+                output, "q5_top10_produtos_maior_media_avaliacoes_uteis")
+
+
+def subtree_products(snapshot):
+    """
+    Pares (categoria, produto), em linhas de categories e products, de cada categoria com os
+    produtos de toda a sua subárvore (o fecho transitivo de category_hierarchy), sem repetições.
+    """
+    parents = snapshot.column('category_hierarchy.parent_category_id')
+    children = snapshot.column('category_hierarchy.child_category_id')
+    order = np.argsort(children, kind='stable')
+    children, parents = children[order], parents[order]
+
+    product_ids = snapshot.column('product_category.product_id')
+    category_ids = snapshot.column('product_category.category_id')
+    found_products, found_categories = [product_ids], [category_ids]
+    for _ in range(len(snapshot.column('categories.category_id'))): # a profundidade nunca passa do número de categorias
+        starts = np.searchsorted(children, category_ids, 'left')
+        counts = np.searchsorted(children, category_ids, 'right') - starts
+        if not counts.sum():
+            break
+        # cada par (produto, categoria) passa a (produto, pai da categoria), para cada pai
+        positions = np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)
+        # sem repetições a cada nível: um produto chega ao mesmo ancestral por vários caminhos
+        pairs = np.unique(np.repeat(product_ids, counts).astype(np.int64) << 32 | parents[positions].astype(np.int64))
+        product_ids, category_ids = (pairs >> 32).astype(np.int32), (pairs & 0xFFFFFFFF).astype(np.int32)
+        found_products.append(product_ids)
+        found_categories.append(category_ids)
+
+    products = snapshot.product_rows(np.concatenate(found_products)).astype(np.int64)
+    categories = np.searchsorted(snapshot.column('categories.category_id'), np.concatenate(found_categories)).astype(np.int64)
+    size = len(snapshot.column('products.source_id'))
+    pairs = np.unique(categories * size + products)
+    return pairs // size, pairs % size
+
+
+def query6(snapshot, output):
+    helpful, counts = snapshot.positive_totals()
+    categories, products = subtree_products(snapshot)
+    size = len(snapshot.column('categories.category_id'))
+    category_helpful = np.bincount(categories, weights=helpful[products], minlength=size).astype(np.int64)
+    category_counts = np.bincount(categories, weights=counts[products], minlength=size).astype(np.int64)
+    chosen = np.flatnonzero(category_counts)
+    cents = _rounded(category_helpful[chosen], category_counts[chosen])
+    best = np.argsort(-cents, kind='stable')[:5]
+    chosen = chosen[best]
+    names = snapshot.strings('categories.category_name').take(chosen)
+    rows = [(name, _cents(value), Decimal(total))
+            for name, value, total in zip(names, cents[best].tolist(), category_counts[chosen].tolist())]
+    export_rows(Q6_COLUMNS, rows, "Query 6: Top 5 categorias com maior média de avaliações úteis (rating >= 3)",
+                output, "q6_top5_categorias_maior_media_avaliacoes_uteis")
+
+
+def query7(snapshot, output):
+    groups = snapshot.strings('products.group_name')
+    customers = snapshot.column('reviews.customer').astype(np.int64)
+    size = len(snapshot.column('customers.customer_id'))
+    keys, totals = np.unique(groups.codes[snapshot.review_products()].astype(np.int64) * size + customers, return_counts=True)
+    chosen, ranks = _top_per_group(keys // size, [-totals], 10)
+    group_codes, customer_rows = (keys // size)[chosen], keys[chosen] % size
+    rows = list(zip([groups.value(code) for code in group_codes.tolist()], ranks.tolist(),
+                    snapshot.strings('customers.customer_code').take(customer_rows), totals[chosen].tolist()))
+    export_rows(Q7_COLUMNS, rows, "Query 7: Top 10 clientes que mais fizeram comentários por grupo de produto",
+                output, "q7_top10_clientes_mais_comentarios_por_grupo")
+
+
+PRODUCT_QUERIES = (query1, query2, query3)
+GENERAL_QUERIES = (query4, query5, query6, query7)
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    return rows[0], rows[1:]
+
+
+def compare_results(expected_dir, actual_dir):
+    """
+    Compara os CSV com o mesmo nome nos dois diretórios (ex.: o --output do dashboard com o
+    banco e com --snapshot) e devolve o número de resultados diferentes. Resultados que só
+    diferem entre linhas empatadas na ordenação da consulta (RESULT_SORT_KEYS) são aceites.
+    """
+    names = sorted(name for name in os.listdir(expected_dir)
+                   if name.endswith('.csv') and os.path.exists(os.path.join(actual_dir, name)))
+    if not names:
+        print(f"Nenhum CSV em comum entre '{expected_dir}' e '{actual_dir}'.")
+    different = 0
+    for name in names:
+        expected_columns, expected = _read_csv(os.path.join(expected_dir, name))
+        actual_columns, actual = _read_csv(os.path.join(actual_dir, name))
+        keys = next((columns for prefix, columns in RESULT_SORT_KEYS.items() if name.startswith(prefix)), None)
+        if expected_columns == actual_columns and expected == actual:
+            print(f"  - {name}: igual ({len(expected)} linhas)")
+            continue
+        if expected_columns == actual_columns and keys and len(expected) == len(actual):
+            positions = [expected_columns.index(key) for key in keys]
+            if [[row[i] for i in positions] for row in expected] == [[row[i] for i in positions] for row in actual]:
+                print(f"  - {name}: igual, a menos da ordem ou da escolha entre empates ({len(expected)} linhas)")
+                continue
+        different += 1
+        line = next((i for i, (a, b) in enumerate(zip(expected, actual)) if a != b), min(len(expected), len(actual)))
+        print(f"  - {name}: DIFERENTE ({len(expected)} linhas esperadas, {len(actual)} obtidas; primeira diferença na linha {line + 1})")
+    print(f"{different} de {len(names)} resultados diferentes.")
+    return different
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta o snapshot colunar dos dados e compara os resultados do dashboard.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="Exporta o snapshot a partir do banco de dados")
+    export.add_argument("--db-host", required=True)
+    export.add_argument("--db-port", type=int, default=5432)
+    export.add_argument("--db-name", required=True)
+    export.add_argument("--db-user", required=True)
+    export.add_argument("--db-pass", required=True)
+    export.add_argument("--snapshot-dir", required=True, help="Diretório onde gravar o snapshot")
+    compare = commands.add_parser('compare', help="Compara os CSV de dois diretórios de resultados do dashboard")
+    compare.add_argument("--expected", required=True, help="Resultados de referência (ex.: do dashboard com o banco)")
+    compare.add_argument("--actual", required=True, help="Resultados a verificar (ex.: do dashboard com --snapshot)")
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        for directory in (args.expected, args.actual):
+            if not os.path.isdir(directory):
+                parser.error(f"o diretório '{directory}' não existe")
+        sys.exit(1 if compare_results(args.expected, args.actual) else 0)
+
+    from db import get_conn
+    conn = get_conn(args.db_host, args.db_port, args.db_name, args.db_user, args.db_pass)
+    try:
+        start = time.perf_counter()
+        with conn.cursor() as cur:
+            version = read_data_version(cur)
+        rows = export_snapshot(conn, args.snapshot_dir, version)
+        print(f"Snapshot gravado em '{args.snapshot_dir}' em {time.perf_counter() - start:.2f} segundos: "
+              + ', '.join(f"{table} {count}" for table, count in rows.items()))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
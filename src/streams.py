@@ -0,0 +1,147 @@
+"""
+Leitura do ficheiro de dados diretamente a partir da versão comprimida (.gz ou .zst).
+
+A descompressão corre numa thread separada, que vai colocando blocos já descomprimidos
+numa fila limitada. O parser consome esses blocos através de um objeto do tipo ficheiro,
+por isso a descompressão acontece em paralelo com o parsing e com a carga no banco
+(o zlib e o zstandard libertam o GIL enquanto descomprimem).
+"""
+
+import gzip
+import io
+import queue
+import threading
+
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+# tamanho de cada bloco descomprimido e número máximo de blocos à espera na fila
+DECOMPRESS_BLOCK_SIZE = 1024 * 1024
+DECOMPRESS_QUEUE_BLOCKS = 16
+
+_END = object() # marca o fim dos dados na fila
+
+
+def is_compressed(path):
+    return str(path).endswith(COMPRESSED_SUFFIXES)
+
+
+def _open_compressed_source(path):
+    """
+    Abre o ficheiro comprimido e devolve um objeto com read(n) que devolve dados já descomprimidos.
+    """
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rb')
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(
+            "Para ler ficheiros .zst é preciso instalar o pacote 'zstandard' (pip install zstandard)."
+        )
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+
+class _DecompressedReader(io.RawIOBase):
+    """
+    Stream binário (só leitura) alimentado pela thread de descompressão através de uma fila limitada.
+    """
+
+    def __init__(self, path, block_size, queue_blocks):
+        super().__init__()
+        self._queue = queue.Queue(maxsize=queue_blocks)
+        self._stop = threading.Event()
+        self._block = b''
+        self._block_pos = 0
+        self._eof = False
+        self._thread = threading.Thread(
+            target=self._decompress, args=(path, block_size), name="snap-decompress", daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item):
+        # não bloqueia para sempre se o leitor já tiver sido fechado
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decompress(self, path, block_size):
+        try:
+            with _open_compressed_source(path) as source:
+                while not self._stop.is_set():
+                    data = source.read(block_size)
+                    if not data:
+                        break
+                    if not self._put(data):
+                        return
+            self._put(_END)
+        except Exception as e: # o erro é repassado para quem está a ler
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._block_pos >= len(self._block):
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if item is _END:
+                self._eof = True
+                return 0
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            self._block, self._block_pos = item, 0
+        size = min(len(buffer), len(self._block) - self._block_pos)
+        buffer[:size] = self._block[self._block_pos:self._block_pos + size]
+        self._block_pos += size
+        return size
+
+    def close(self):
+        self._stop.set()
+        super().close()
+
+
+def open_decompressed(path, block_size=DECOMPRESS_BLOCK_SIZE, queue_blocks=DECOMPRESS_QUEUE_BLOCKS):
+    """
+    Abre um ficheiro .gz ou .zst e devolve um stream binário com buffer (io.BufferedReader)
+    com o conteúdo descomprimido, produzido em segundo plano.
+    """
+    return io.BufferedReader(_DecompressedReader(path, block_size, queue_blocks), buffer_size=block_size)
+
+
+def skip_bytes(stream, count, block_size=DECOMPRESS_BLOCK_SIZE):
+    """
+    Descarta os primeiros `count` bytes de um stream que não permite seek (ex.: conteúdo
+    descomprimido), usado para retomar a leitura a partir de uma posição conhecida.
+    """
+    while count > 0:
+        data = stream.read(min(count, block_size))
+        if not data:
+            return
+        count -= len(data)
+
+
+def iter_record_blocks(stream, block_size=DECOMPRESS_BLOCK_SIZE):
+    """
+    Lê um stream binário em blocos de aproximadamente `block_size` bytes, cortados sempre
+    imediatamente antes de uma linha 'Id:', de forma que cada bloco contenha apenas
+    produtos completos e possa ser analisado de forma independente.
+    """
+    carry = b''
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            if carry:
+                yield carry
+            return
+        data = carry + data
+        cut = data.rfind(b'\nId:') + 1 # início do último produto (possivelmente incompleto) do bloco
+        if cut <= 0:
+            carry = data
+            continue
+        yield data[:cut]
+        carry = data[cut:]
@@ -0,0 +1,53 @@
+"""
+Tabelas de resumo do dashboard (sql/summaries.sql).
+
+As consultas gerais do dashboard (4 a 7) agregam as tabelas Products e reviews inteiras,
+mas os dados só mudam quando o ETL corre. Por isso os resultados agregados ficam guardados
+em materialized views, atualizadas no fim de cada execução do ETL, e o dashboard lê só
+essas tabelas de resumo (poucas linhas, com índices na ordem usada pelas consultas).
+
+As views que dependem umas das outras são atualizadas em sequência na mesma conexão; as
+restantes em paralelo, cada uma numa conexão própria. Uma view já preenchida é atualizada
+com REFRESH ... CONCURRENTLY, que não bloqueia as leituras do dashboard durante a atualização.
+"""
+
+from constraints import run_phase
+
+# grupos de views atualizados em paralelo; dentro de cada grupo, pela ordem das dependências
+SUMMARY_GROUPS = (
+    ('ProductReviewSummary', 'CategoryReviewSummary'),
+    ('GroupSalesRanking',),
+    ('GroupCustomerRanking',),
+)
+# parâmetros de cada conexão de atualização: memória das agregações e ordenações e, com a
+# tabela reviews particionada, agregação partição a partição (sem partições não muda nada)
+SUMMARY_SETTINGS = {
+    'work_mem': '256MB',
+    'enable_partitionwise_aggregate': 'on',
+    'enable_partitionwise_join': 'on',
+}
+
+
+def refresh_summaries(conn, connect, path, jobs=1):
+    """
+    Cria as tabelas de resumo que ainda não existem e atualiza todas, com até `jobs`
+    grupos de views em paralelo (conexões criadas por `connect()`).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        sql = f.read()
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        cur.execute(
+            "SELECT matviewname FROM pg_matviews WHERE ispopulated AND matviewname = ANY(%s)",
+            ([name.lower() for group in SUMMARY_GROUPS for name in group],)
+        )
+        populated = {row[0] for row in cur.fetchall()}
+    conn.commit()
+
+    steps = []
+    for group in SUMMARY_GROUPS:
+        for name in group:
+            # a primeira atualização (view ainda vazia) não pode ser CONCURRENTLY
+            concurrently = " CONCURRENTLY" if name.lower() in populated else ""
+            steps.append((group[0], f"REFRESH{concurrently} {name}", f"REFRESH MATERIALIZED VIEW{concurrently} {name}"))
+    run_phase(connect, "tabelas de resumo do dashboard", steps, jobs, settings=SUMMARY_SETTINGS)
@@ -0,0 +1,105 @@
+"""
+Procura de produtos pelo título (tp1_3.3.py --product-title), sempre através de índices.
+
+A procura antiga (titulo ILIKE '%...%') lia a tabela Products inteira a cada chamada.
+Agora a procura é feita em passos, e o primeiro que encontrar produtos dá a resposta:
+1. prefixo exato: títulos que começam pelo texto (sem distinguir maiúsculas), pelo índice
+   B-tree idx_products_titulo_prefix (lower(titulo) text_pattern_ops), na ordem do índice,
+   por isso a leitura pára nos primeiros candidatos mesmo com um prefixo muito comum (o
+   título igual ao texto, se existir, é sempre o primeiro);
+2. texto completo: títulos que contêm todas as palavras do texto (a última pode estar
+   incompleta), pelo índice GIN idx_products_titulo_fts (tsvector), ordenados por relevância
+   (ts_rank) e, em caso de empate, pelos títulos mais curtos;
+3. só se nenhum dos anteriores encontrar nada, qualquer parte do título (ex.: um pedaço do
+   meio de uma palavra): com o índice de trigramas idx_products_titulo_trgm (criado pelo ETL
+   quando o servidor tem a extensão pg_trgm), ordenados pela semelhança; sem ele, um ILIKE
+   que lê no máximo SUBSTRING_SCAN_ROWS produtos, com um aviso, para não percorrer a tabela
+   inteira precisamente quando nada é encontrado.
+
+Cada passo devolve no máximo `limit` candidatos (source_id, asin, titulo), do melhor para o pior.
+Os índices são criados pelo sql/constraints.sql (o de trigramas pelo src/constraints.py) com a mesma configuração de texto ('simple',
+sem stemming, porque os títulos estão em várias línguas) usada nas consultas abaixo.
+"""
+
+import re
+import sys
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+PREFIX_SQL = """
+    SELECT source_id, asin, titulo FROM Products
+    WHERE lower(titulo) LIKE %s
+    ORDER BY lower(titulo) USING ~<~
+    LIMIT %s
+"""
+FULL_TEXT_SQL = """
+    SELECT source_id, asin, titulo FROM Products
+    WHERE to_tsvector('simple', titulo) @@ to_tsquery('simple', %s)
+    ORDER BY ts_rank(to_tsvector('simple', titulo), to_tsquery('simple', %s)) DESC, length(titulo), source_id
+    LIMIT %s
+"""
+# o ILIKE é servido pelo índice GIN de trigramas (gin_trgm_ops)
+SUBSTRING_SQL = """
+    SELECT source_id, asin, titulo FROM Products
+    WHERE titulo ILIKE %s
+    ORDER BY similarity(titulo, %s) DESC, length(titulo), source_id
+    LIMIT %s
+"""
+# sem o índice de trigramas: a mesma procura, mas só nos primeiros SUBSTRING_SCAN_ROWS produtos lidos
+SUBSTRING_SCAN_SQL = """
+    SELECT source_id, asin, titulo FROM (SELECT source_id, asin, titulo FROM Products LIMIT %s) p
+    WHERE titulo ILIKE %s
+    ORDER BY length(titulo), source_id
+    LIMIT %s
+"""
+SUBSTRING_SCAN_ROWS = 200000
+TRIGRAM_INDEX = 'idx_products_titulo_trgm'
+
+
+def _like_prefix(text):
+    escaped = text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+def _full_text_query(text):
+    """
+    Converte o texto num tsquery: todas as palavras obrigatórias, a última como prefixo.
+    Devolve None se o texto não tiver palavras.
+    """
+    words = [word.lower() for word in _WORD_RE.findall(text)]
+    if not words:
+        return None
+    return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+
+def has_trigram_index(cur):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (TRIGRAM_INDEX,))
+    return cur.fetchone()[0]
+
+
+def search_titles(cur, text, limit=5):
+    """
+    Devolve (candidatos, método): até `limit` produtos (source_id, asin, titulo) cujo título
+    corresponde ao texto, do melhor para o pior, e o passo da procura que os encontrou.
+    """
+    text = text.strip()
+    if not text:
+        return [], None
+    cur.execute(PREFIX_SQL, (_like_prefix(text), limit))
+    rows = cur.fetchall()
+    if rows:
+        return rows, 'prefixo'
+    query = _full_text_query(text)
+    if query is not None:
+        cur.execute(FULL_TEXT_SQL, (query, query, limit))
+        rows = cur.fetchall()
+        if rows:
+            return rows, 'texto completo'
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if has_trigram_index(cur):
+        cur.execute(SUBSTRING_SQL, (f'%{escaped}%', text, limit))
+        return cur.fetchall(), 'parte do título'
+    print(f"AVISO: sem o índice {TRIGRAM_INDEX} (extensão pg_trgm); a procura por parte do título "
+          f"só lê os primeiros {SUBSTRING_SCAN_ROWS} produtos.", file=sys.stderr)
+    cur.execute(SUBSTRING_SCAN_SQL, (SUBSTRING_SCAN_ROWS, f'%{escaped}%', limit))
+    return cur.fetchall(), 'parte do título, limitada'
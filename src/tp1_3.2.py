@@ -1,14 +1,34 @@
 import argparse
+from collections import namedtuple
+from functools import partial
 import os
+from itertools import islice
 import sys
 import time
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
-from utils import extract_all_categories, parse_snap
+from utils import PARSER_BACKENDS, iter_snap, read_total_items
+from streams import is_compressed
+from metrics import METRICS, METRICS_FORMATS, Progress, peak_rss_mb
 from db import get_conn
+from loader import (
+    LOADER_MODES, new_load_stats, merge_load_stats, flush_executemany, flush_customers, prepare_copy, flush_copy,
+    print_load_stats
+)
+from pipeline import BatchPipeline
+from constraints import apply_constraints, set_unlogged
+from partitions import create_partitioned_reviews, read_review_router
+from summaries import refresh_summaries
+from similar_graph import export_graph
+from snapshot import export_snapshot
+from checkpoint import (
+    CheckpointTracker, input_identity, read_checkpoint, reset_checkpoint, save_checkpoint, complete_checkpoint,
+    clear_data_version, stamp_data_version
+)
 
 BATCH_SIZE = 2000
-CATEGORY_BATCH = 500
+QUEUE_DEPTH = 4 # lotes prontos à espera das escritoras no modo pipeline
+RELATED_WORK_MEM = '256MB' # work_mem da filtragem final dos produtos relacionados
 
 def log_time(func):
  
@@ -16,7 +36,8 @@ def log_time(func):
         # usando 'func.__name__' para obter o nome da função original
         print(f"-> Iniciando etapa: '{func.__name__}'...")
         start_time = time.perf_counter()
-        result = func(*args, **kwargs) 
+        with METRICS.stage(func.__name__): # linhas, memória e idas ao banco da etapa (src/metrics.py)
+            result = func(*args, **kwargs)
         end_time = time.perf_counter()
         total_time = end_time - start_time
         print(f"<- Etapa '{func.__name__}' concluída em {total_time:.4f} segundos.")
@@ -39,22 +60,21 @@ def create_schema(conn, schema_filepath):
         conn.rollback()
         raise
 
-@log_time
-def insert_categories(conn, categories_by_old_id):
+def insert_new_categories(cur, new_categories):
     """
-    Insere categorias usando o ID original e o nome, e retorna um mapa
-    do ID original para o novo ID sequencial do banco de dados
+    Insere as categorias ainda sem ID do banco, usando o ID original e o nome, e devolve
+    o mapa (ID original -> novo ID sequencial do banco de dados) dessas categorias.
+    As categorias são descobertas durante a própria leitura dos produtos (parse_snap),
+    por isso não é preciso uma leitura prévia do ficheiro inteiro.
     """
-    print(f"A inserir {len(categories_by_old_id)} categorias na base de dados...")
-    cur = conn.cursor()
-    
-    # prepara os dados para inserção em lote
     # cada item será uma tupla (category_source_id, category_name)
     category_data = [
-        (old_id, info['name'])
-        for old_id, info in categories_by_old_id.items()
-        if info.get('name') # garante que o nome da categoria não é nulo
+        (old_id, info.name)
+        for old_id, info in new_categories
+        if info.name # garante que o nome da categoria não é nulo
     ]
+    if not category_data:
+        return {}
 
     # usando ON CONFLICT no source_id, que deve ser o identificador único da fonte
     sql = """
@@ -62,145 +82,452 @@ def insert_categories(conn, categories_by_old_id):
         VALUES (%s, %s) 
         ON CONFLICT (category_source_id) DO NOTHING
     """
-    
-    # executa a inserção em lotes
     cur.executemany(sql, category_data)
-    conn.commit()
-    print("Inserção de categorias concluída.")
 
-    # cria o mapa consultando a tabela para obter os IDs gerados
-    print("A mapear IDs de categorias antigos para novos...")
-    cur.execute("SELECT category_source_id, category_id FROM Categories")
-    
-    # cria um dicionario mapeando o ID antigo (da fonte) para o novo ID (do BD)
-    old_to_new_id_map = {
-        source_id: new_id for source_id, new_id in cur.fetchall()
-    }
-    
-    cur.close()
-    print("Mapeamento concluído.")
-    return old_to_new_id_map
+    # consulta os IDs gerados apenas para as categorias novas
+    cur.execute(
+        "SELECT category_source_id, category_id FROM Categories WHERE category_source_id = ANY(%s)",
+        ([old_id for old_id, _ in category_data],)
+    )
+    return dict(cur.fetchall())
 
-@log_time
-def insert_category_hierarchy(conn, categories_by_old_id, old_to_new_map):
-    #insere relações hierárquicas entre as categorias no banco de dados, usando o mapeamento de IDs
+def insert_category_hierarchy(cur, categories_by_old_id, old_to_new_map, batch_ids):
+    """
+    Insere as relações hierárquicas (pai -> filho) das categorias que acabaram de receber
+    ID no lote, na mesma transação, para que uma carga retomada não perca a hierarquia.
+    """
     hierarchy_pairs = []
-    for old_id, info in categories_by_old_id.items():
-        parent_old_id = info.get('parent_old_id')
+    for old_id, child_new_id in batch_ids.items():
+        parent_old_id = categories_by_old_id[old_id].parent_old_id
         if parent_old_id:
-            child_new_id = old_to_new_map.get(old_id)
-            parent_new_id = old_to_new_map.get(parent_old_id)
+            parent_new_id = old_to_new_map.get(parent_old_id) or batch_ids.get(parent_old_id)
             if child_new_id and parent_new_id and parent_new_id != child_new_id:
                 hierarchy_pairs.append((parent_new_id, child_new_id))
     if hierarchy_pairs:
-        cur = conn.cursor()
         sql = "INSERT INTO Category_Hierarchy (parent_category_id, child_category_id) VALUES (%s, %s) ON CONFLICT DO NOTHING"
-        cur.executemany(sql, hierarchy_pairs)
+        cur.executemany(sql, sorted(hierarchy_pairs))
+
+def category_parents(categories_by_old_id, old_to_new_map):
+    """
+    Devolve o dicionário (ID do banco -> ID do banco do pai, ou None) das categorias do dicionário.
+    """
+    return {
+        new_id: old_to_new_map.get(categories_by_old_id[old_id].parent_old_id)
+        for old_id, new_id in old_to_new_map.items() if old_id in categories_by_old_id
+    }
+
+def category_closure(parents):
+    """
+    Fecho transitivo da hierarquia (ID -> ID do pai): gera (ancestral, descendente, distância)
+    subindo pela cadeia de pais de cada categoria. Cada categoria é também ancestral de si
+    própria, com distância 0.
+    """
+    for category_id in parents:
+        yield category_id, category_id, 0
+        seen = {category_id}
+        parent_id, depth = parents[category_id], 1
+        while parent_id is not None and parent_id not in seen:
+            yield parent_id, category_id, depth
+            seen.add(parent_id)
+            parent_id, depth = parents.get(parent_id), depth + 1
+
+def load_customer_map(conn):
+    """
+    Devolve o dicionário (código do cliente -> ID inteiro) dos clientes já gravados,
+    usado pela carga incremental para continuar a numeração.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT customer_code, customer_id FROM Customers")
+        return dict(cur.fetchall())
+
+def load_category_map(conn):
+    """
+    Devolve o mapa (ID original -> ID do banco) das categorias já gravadas, usado pela
+    carga incremental para não voltar a inserir categorias conhecidas.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT category_source_id, category_id FROM Categories")
+        return dict(cur.fetchall())
+
+# um lote pronto para ser gravado. `hashes` tem um (asin, hash do conteúdo, load_id) por ASIN e
+# `position` é o (offset, source_id) do último produto lido, usado no checkpoint
+Batch = namedtuple('Batch', ['seq', 'new_categories', 'products', 'product_categories', 'reviews', 'related', 'hashes', 'position'])
+
+class BatchWriter:
+    """
+    Grava lotes completos (categorias novas e a sua hierarquia, produtos, categorias dos
+    produtos, reviews, pares de similares e hashes) numa conexão, um lote por transação.
+    O dicionário de categorias, o mapa de IDs e o CheckpointTracker são partilhados
+    por todas as escritoras.
+
+    Com `incremental=True` os produtos cujo hash não mudou são ignorados, e os produtos
+    alterados numa carga anterior têm as suas reviews, categorias e pares de similares apagados
+    antes de serem gravados de novo (um ASIN repetido dentro da mesma carga acumula, como na carga completa).
+
+    Com `review_router` (tabela reviews particionada) o modo 'copy' grava as reviews de cada
+    partição com um COPY próprio; o modo 'executemany' continua a inserir na tabela mãe.
+    """
+
+    def __init__(self, conn, loader_mode, categories_by_old_id, old_to_new_map, load_id,
+                 incremental=False, checkpoint_name=None, tracker=None, use_pipeline=False, review_router=None):
+        self.conn = conn
+        self.cur = conn.cursor()
+        if loader_mode == 'copy':
+            prepare_copy(self.cur)
+            self.flush = partial(flush_copy, review_router=review_router)
+        else:
+            self.flush = flush_executemany
+        self.categories_by_old_id = categories_by_old_id
+        self.old_to_new_map = old_to_new_map
+        self.load_id = load_id
+        self.incremental = incremental
+        self.checkpoint_name = checkpoint_name
+        self.tracker = tracker
+        self.use_pipeline = use_pipeline
+        self.load_stats = new_load_stats()
+        self.unchanged = 0
+
+    def _insert_categories(self, batch):
+        # primeiro as categorias que ainda não têm ID do banco: as descobertas desde o último lote e,
+        # com várias escritoras, as de lotes anteriores que outra thread ainda não gravou (e os seus
+        # ancestrais, para que a hierarquia seja gravada no mesmo lote).
+        # A ordem fixa (por ID) evita deadlocks entre escritoras que inserem as mesmas categorias
+        categories_by_old_id, old_to_new_map = self.categories_by_old_id, self.old_to_new_map
+        pending = {old_id for old_id in batch.new_categories if old_id not in old_to_new_map}
+        pending.update(old_id for _, old_id in batch.product_categories if old_id not in old_to_new_map)
+        for old_id in list(pending):
+            parent_old_id = categories_by_old_id[old_id].parent_old_id
+            while parent_old_id and parent_old_id not in old_to_new_map and parent_old_id not in pending:
+                pending.add(parent_old_id)
+                parent_old_id = categories_by_old_id[parent_old_id].parent_old_id
+        batch_ids = insert_new_categories(self.cur, [(old_id, categories_by_old_id[old_id]) for old_id in sorted(pending)])
+        insert_category_hierarchy(self.cur, categories_by_old_id, old_to_new_map, batch_ids)
+        return batch_ids
+
+    def _drop_unchanged(self, batch):
+        # compara os hashes do lote com os guardados e mantém só os produtos novos ou alterados
+        self.cur.execute(
+            "SELECT asin, content_hash, load_id FROM etl_product_hash WHERE asin = ANY(%s)",
+            ([asin for asin, _, _ in batch.hashes],)
+        )
+        stored = {asin: (content_hash, load_id) for asin, content_hash, load_id in self.cur.fetchall()}
+        unchanged = {asin for asin, content_hash, _ in batch.hashes if stored.get(asin, (None,))[0] == content_hash}
+        changed = [
+            asin for asin, _, _ in batch.hashes
+            if asin in stored and asin not in unchanged and stored[asin][1] != self.load_id
+        ]
+        if changed: # as reviews, as categorias e os similares de um produto alterado são substituídos, não acumulados
+            changed_ids = "SELECT source_id FROM Products WHERE asin = ANY(%s)"
+            self.cur.execute(f"DELETE FROM reviews WHERE product_id IN ({changed_ids})", (changed,))
+            self.cur.execute(f"DELETE FROM Product_category WHERE product_id IN ({changed_ids})", (changed,))
+            self.cur.execute(
+                f"DELETE FROM Related_products WHERE product1_id IN ({changed_ids}) OR product2_id IN ({changed_ids})",
+                (changed, changed)
+            )
+        self.unchanged += len(unchanged)
+        if not unchanged:
+            return batch
+        # as linhas filhas referenciam o produto pelo source_id, as restantes pelo ASIN.
+        # Os similares dos produtos sem alterações continuam a ir para a staging: um par com um
+        # produto alterado é apagado acima e só volta a Related_products (no fim da carga) se um
+        # dos dois produtos ainda o listar, mesmo que seja o que não mudou
+        unchanged_ids = {row[0] for row in batch.products if row[1] in unchanged}
+        return batch._replace(
+            products=[row for row in batch.products if row[1] not in unchanged],
+            product_categories=[row for row in batch.product_categories if row[0] not in unchanged_ids],
+            reviews=[row for row in batch.reviews if row[0] not in unchanged_ids],
+            hashes=[row for row in batch.hashes if row[0] not in unchanged],
+        )
+
+    def _resolve_product_keys(self, batch):
+        # o upsert por ASIN mantém o source_id da primeira ocorrência do produto; se o mesmo ASIN
+        # aparecer de novo no ficheiro com outro Id, as suas reviews e categorias usam essa chave
+        keys = {}
+        for row in batch.products:
+            keys.setdefault(row[1], row[0])
+        self.cur.execute("SELECT asin, source_id FROM Products WHERE asin = ANY(%s)", (list(keys),))
+        keys.update(self.cur.fetchall())
+        remap = {row[0]: keys[row[1]] for row in batch.products if row[0] != keys[row[1]]}
+        if not remap:
+            return batch
+        return batch._replace(
+            product_categories=[(remap.get(product_id, product_id), old_id) for product_id, old_id in batch.product_categories],
+            reviews=[(remap[row[0]],) + row[1:] if row[0] in remap else row for row in batch.reviews],
+        )
+
+    def write(self, batch):
+        conn, cur = self.conn, self.cur
+        batch_ids = self._insert_categories(batch)
+        if self.incremental and batch.hashes:
+            batch = self._drop_unchanged(batch)
+        if batch.products:
+            batch = self._resolve_product_keys(batch)
+        prodcat_rows = []
+        for product_id, old_id in batch.product_categories:
+            new_id = self.old_to_new_map.get(old_id) or batch_ids.get(old_id)
+            if new_id:
+                prodcat_rows.append((product_id, new_id))
+        # cada par é guardado uma só vez por lote, já ordenado como em Related_products
+        # (o produto A lista B como similar e B costuma listar A)
+        related_rows = {(asin, sim) if asin < sim else (sim, asin) for asin, sim in batch.related}
+        rows = (batch.products, prodcat_rows, batch.reviews, related_rows, batch.hashes, self.load_stats)
+        if self.use_pipeline: # o COPY não pode ser usado dentro do pipeline mode, só os INSERTs
+            with conn.pipeline():
+                self.flush(cur, *rows)
+        else:
+            self.flush(cur, *rows)
         conn.commit()
-        cur.close()
+        # o mapa partilhado só recebe os IDs depois do commit, para que outra escritora nunca
+        # use um ID de categoria que ainda não é visível na transação dela
+        self.old_to_new_map.update(batch_ids)
+        if self.tracker is not None:
+            position = self.tracker.commit(batch.seq, batch.position)
+            if position is not None:
+                save_checkpoint(cur, self.checkpoint_name, position)
+                conn.commit()
+
+def _batch_writer(connect, loader_mode, categories_by_old_id, old_to_new_map, load_id, **options):
+    """
+    Cria a função executada por cada thread escritora do pipeline: abre uma conexão
+    própria e grava os lotes que recebe, devolvendo a BatchWriter dessa thread
+    (com as suas estatísticas de carga).
+    """
+    def worker(batches):
+        conn = connect()
+        try:
+            writer = BatchWriter(
+                conn, loader_mode, categories_by_old_id, old_to_new_map, load_id,
+                use_pipeline=(loader_mode == 'executemany'), **options
+            )
+            for batch in batches:
+                writer.write(batch)
+            return writer
+        finally:
+            conn.close()
+    return worker
 
 @log_time
-def process_products_and_reviews(conn, input_file, old_to_new_map): #processa produtos e suas avaliações
-    cur = conn.cursor()
-    prod_sql = """
-            INSERT INTO Products (
-                source_id, asin, titulo, group_name, salesrank, 
-                total_reviews, average_rating, qntd_downloads,
-                similar_products_count, categories_count
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) 
-            ON CONFLICT (asin) DO UPDATE SET 
-                titulo = EXCLUDED.titulo, 
-                group_name = EXCLUDED.group_name, 
-                salesrank = EXCLUDED.salesrank, 
-                total_reviews = EXCLUDED.total_reviews, 
-                average_rating = EXCLUDED.average_rating,
-                qntd_downloads = EXCLUDED.qntd_downloads,
-                similar_products_count = EXCLUDED.similar_products_count,
-                categories_count = EXCLUDED.categories_count
-        """   
-    prodcat_sql = "INSERT INTO Product_category (product_asin, category_id) VALUES (%s, %s) ON CONFLICT DO NOTHING"
-    reviews_sql = "INSERT INTO reviews (product_asin, customer_id, rating, review_date, votes, helpful) VALUES (%s,%s,%s,%s,%s,%s)"
-    
-    all_valid_asins = set()
-    all_potential_related_pairs = []
+def process_products_and_reviews(conn, input_file, categories_by_old_id, old_to_new_map, loader_mode='executemany', workers=1, ordered=True, parser_backend='text', writers=0, connect=None, queue_depth=QUEUE_DEPTH,
+                                 customer_ids=None, load_id=1, start_offset=0, skip_source_id=None, incremental=False, checkpoint_name=None,
+                                 review_router=None): #processa produtos e suas avaliações
+    """
+    Lê os produtos e grava-os em lotes de BATCH_SIZE. Com writers=0 cada lote é gravado
+    na própria thread do parsing (o parsing pára durante a escrita). Com writers >= 1 os
+    lotes vão para uma fila limitada e são gravados por `writers` threads escritoras,
+    cada uma com uma conexão criada por `connect()`, em paralelo com o parsing.
+
+    A leitura começa em `start_offset`; o produto `skip_source_id` nessa posição (o último
+    de uma carga interrompida) é ignorado. Com `checkpoint_name` a posição do último lote
+    confirmado é guardada em etl_checkpoint (só na ordem do ficheiro, ou seja, com ordered=True).
+
+    Os clientes recebem um ID inteiro no próprio parsing (`customer_ids`: código -> ID). Os
+    clientes novos de cada lote são gravados e confirmados nesta thread antes de o lote seguir
+    para a escrita, para que qualquer escritora já os encontre no banco.
+    """
+    if customer_ids is None:
+        customer_ids = {}
+    next_customer_id = max(customer_ids.values(), default=0) + 1
+    customer_cur = conn.cursor()
+    customer_stats = new_load_stats()
+    options = {'incremental': incremental, 'review_router': review_router}
+    if checkpoint_name is not None and ordered:
+        options.update(checkpoint_name=checkpoint_name, tracker=CheckpointTracker())
+    pipeline = None
+    if writers > 0:
+        pipeline = BatchPipeline(
+            _batch_writer(connect, loader_mode, categories_by_old_id, old_to_new_map, load_id, **options),
+            writers=writers, queue_depth=queue_depth
+        )
+    else:
+        writer = BatchWriter(conn, loader_mode, categories_by_old_id, old_to_new_map, load_id, **options)
+
     valid_product_count = 0
-    prod_batch, review_batch, prodcat_batch = [], [], []
+    batch_seq = 0
+    position = None # (offset, source_id) do último produto lido
+    registered_categories = 0 # quantas categorias do dicionário (em ordem de descoberta) já foram enviadas
+    # progresso pelos bytes do ficheiro; num ficheiro comprimido as posições são do conteúdo
+    # descomprimido, de tamanho desconhecido, por isso usa o ID do produto e o 'Total items' do cabeçalho
+    compressed = is_compressed(input_file)
+    if compressed:
+        progress = Progress(read_total_items(input_file), skip_source_id or 0)
+    else:
+        progress = Progress(os.path.getsize(input_file), start_offset)
+    prod_batch, review_batch, prodcat_batch, related_batch, hash_batch, customer_batch = [], [], [], [], {}, []
 
     def flush_batches(): #realiza a inserção em lote no banco de dados para evitar múltiplas inserções pequenas
-        nonlocal prod_batch, review_batch, prodcat_batch
-        if prod_batch: cur.executemany(prod_sql, prod_batch)
-        if prodcat_batch: cur.executemany(prodcat_sql, prodcat_batch)
-        if review_batch: cur.executemany(reviews_sql, review_batch)
+        nonlocal prod_batch, review_batch, prodcat_batch, related_batch, hash_batch, customer_batch, registered_categories, batch_seq
+        flush_customers(customer_cur, customer_batch, loader_mode, customer_stats)
         conn.commit()
-        prod_batch, review_batch, prodcat_batch = [], [], []
+        # categorias descobertas desde o último lote, para que sejam gravadas antes das linhas de Product_category
+        new_categories = list(islice(categories_by_old_id, registered_categories, None))
+        registered_categories += len(new_categories)
+        batch = Batch(
+            batch_seq, new_categories, prod_batch, prodcat_batch, review_batch,
+            related_batch, [(asin, content_hash, load_id) for asin, content_hash in hash_batch.items()], position
+        )
+        batch_seq += 1
+        if pipeline is not None:
+            pipeline.put(batch)
+        else:
+            writer.write(batch)
+        prod_batch, review_batch, prodcat_batch, related_batch, hash_batch, customer_batch = [], [], [], [], {}, []
 
-    for product in parse_snap(input_file):
-        asin = product.get('asin')
-        titulo = product.get('title')
-        if not asin or not titulo:
+    for product in iter_snap(input_file, categories_by_old_id, workers, ordered, parser_backend, start_offset):
+        if skip_source_id is not None and product.offset == start_offset and product.id == skip_source_id:
+            continue # já gravado antes da interrupção
+        position = (product.offset, product.id)
+        asin = product.asin
+        if not asin or not product.title:
             continue
         
-        all_valid_asins.add(asin)
-        
-        total_reviews = product.get('total', 0)
-        downloaded_reviews = product.get('downloaded', 0)
-        avg_rating = product.get('avg_rating', None)
-        similar_count = product.get('similar_count', 0)
-        categories_count = product.get('categories_count', 0)
-
-        prod_batch.append((
-            product['id'], 
-            asin, 
-            titulo, 
-            product['group'], 
-            product['salesrank'],
-            total_reviews,
-            avg_rating,
-            downloaded_reviews,
-            similar_count,
-            categories_count
-        ))
-
+        prod_batch.append(product.row()) # o registo já está na ordem das colunas do loader
+        hash_batch[asin] = product.content_hash()
         valid_product_count += 1
         
-        for cat in product['categories']:
-            new_cat_id = old_to_new_map.get(cat['old_id'])
-            if new_cat_id:
-                prodcat_batch.append((asin, new_cat_id))
+        for cat in product.categories:
+            prodcat_batch.append((product.id, cat.old_id)) # o ID do banco é resolvido na escrita do lote
         
-        for sim in product['similar']:
+        for sim in product.similar:
             if sim and sim != asin:
-                all_potential_related_pairs.append(tuple(sorted((asin, sim))))
+                related_batch.append((asin, sim)) # filtrados no banco, no fim da carga (etl_related_staging)
         
-        for r in product['reviews']:
-            review_batch.append((asin, r['customer'], r['rating'], r['date'], r['votes'], r['helpful']))
+        customer_keys = []
+        for code in product.reviews.customers:
+            customer_id = customer_ids.get(code)
+            if customer_id is None: # cliente novo: recebe o próximo ID e entra no lote de clientes
+                customer_id = customer_ids[code] = next_customer_id
+                next_customer_id += 1
+                customer_batch.append((customer_id, code))
+            customer_keys.append(customer_id)
+        review_batch.extend(product.reviews.rows(product.id, customer_keys))
         
         if valid_product_count > 0 and valid_product_count % BATCH_SIZE == 0:
             flush_batches()
-            print(f"{valid_product_count} produtos válidos processados...")
+            status = progress.status(position[1] if compressed else position[0], valid_product_count)
+            if pipeline is not None:
+                print(f"{valid_product_count} produtos válidos processados... ({status}; {pipeline.status()})")
+            else:
+                print(f"{valid_product_count} produtos válidos processados... ({status})")
     
     flush_batches() 
-    cur.close()
+    if pipeline is not None:
+        batch_writers = pipeline.close()
+        print(f"Pipeline: {pipeline.batches} lotes, {pipeline.status()}")
+    else:
+        batch_writers = [writer]
+        writer.cur.close()
+    customer_cur.close()
+    load_stats = merge_load_stats([customer_stats] + [w.load_stats for w in batch_writers])
     print(f"Processamento de produtos finalizado. Total de produtos válidos: {valid_product_count}")
-    return all_valid_asins, all_potential_related_pairs
+    if incremental:
+        print(f"Produtos sem alterações (ignorados): {sum(w.unchanged for w in batch_writers)}")
+    print_load_stats(load_stats, loader_mode)
+    input_bytes = os.path.getsize(input_file) - (0 if compressed else start_offset)
+    METRICS.add_rows(sum(rows for rows, _ in load_stats.values()), input_bytes, products=valid_product_count,
+                     **{table: rows for table, (rows, _) in load_stats.items()})
 
 @log_time
-def insert_filtered_related_products(conn, valid_asins, potential_pairs):
+def insert_filtered_related_products(conn):
+    """
+    Copia para Related_products, num único INSERT ... SELECT, os pares acumulados em
+    etl_related_staging cujos dois produtos existem na tabela Products (junção feita no
+    próprio banco, sem nenhum conjunto de ASINs em memória no python), já convertidos
+    para o source_id dos produtos, e esvazia a tabela de staging.
+    """
     print("A filtrar e inserir produtos relacionados...")
-    valid_pairs = set()
-    for p1, p2 in potential_pairs:
-        if p1 in valid_asins and p2 in valid_asins:
-            valid_pairs.add((p1, p2))
-    if not valid_pairs: # se não houver pares válidos para inserção, exibe uma mensagem informando que nenhum par válido foi encontrado
-        print("Nenhuma relação válida entre produtos encontrada.")
-        return
-    print(f"Encontradas {len(valid_pairs)} relações válidas. A inserir na base de dados...")
     cur = conn.cursor()
-    related_sql = "INSERT INTO Related_products (product1_asin, product2_asin) VALUES (%s, %s) ON CONFLICT DO NOTHING"
-    cur.executemany(related_sql, list(valid_pairs))
+    # memória suficiente para o DISTINCT e as junções usarem tabelas hash em vez de ordenações em disco
+    cur.execute(f"SET LOCAL work_mem = '{RELATED_WORK_MEM}'")
+    cur.execute("""
+        INSERT INTO Related_products (product1_id, product2_id)
+        SELECT DISTINCT LEAST(p1.source_id, p2.source_id), GREATEST(p1.source_id, p2.source_id)
+        FROM etl_related_staging s
+        JOIN Products p1 ON p1.asin = s.product1_asin
+        JOIN Products p2 ON p2.asin = s.product2_asin
+        ON CONFLICT DO NOTHING
+    """)
+    inserted = cur.rowcount
+    METRICS.add_rows(max(inserted, 0))
+    cur.execute("TRUNCATE etl_related_staging")
     conn.commit()
     cur.close()
-    print("Inserção de produtos relacionados concluída.")
+    if inserted <= 0: # se não houver pares válidos para inserção, exibe uma mensagem informando que nenhum par válido foi encontrado
+        print("Nenhuma relação nova entre produtos encontrada.")
+        return
+    print(f"Inserção de produtos relacionados concluída ({inserted} relações novas).")
+
+@log_time
+def insert_category_closure(conn, categories_by_old_id, old_to_new_map, incremental=False):
+    """
+    Grava o fecho transitivo da hierarquia (Category_Closure), calculado a partir do dicionário
+    de categorias lidas, com um COPY binário para uma tabela temporária e um único INSERT ... SELECT.
+    Na carga incremental a hierarquia já gravada completa a do dicionário (que só tem as
+    categorias lidas nesta execução) e as linhas que já existem são ignoradas.
+    """
+    parents = category_parents(categories_by_old_id, old_to_new_map)
+    cur = conn.cursor()
+    if incremental:
+        cur.execute("""
+            SELECT c.category_id, h.parent_category_id
+            FROM Categories c LEFT JOIN Category_Hierarchy h ON h.child_category_id = c.category_id
+        """)
+        for category_id, parent_id in cur.fetchall():
+            if parents.get(category_id) is None:
+                parents[category_id] = parent_id
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS stage_category_closure (
+            ancestor_id INT4, descendant_id INT4, depth INT2
+        ) ON COMMIT DELETE ROWS
+    """)
+    with cur.copy("COPY stage_category_closure FROM STDIN (FORMAT BINARY)") as copy:
+        copy.set_types(["int4", "int4", "int2"])
+        for row in category_closure(parents):
+            copy.write_row(row)
+    cur.execute("""
+        INSERT INTO Category_Closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, depth FROM stage_category_closure
+        ON CONFLICT DO NOTHING
+    """)
+    inserted = cur.rowcount
+    METRICS.add_rows(inserted)
+    conn.commit()
+    print(f"Inseridas {inserted} relações no fecho transitivo das categorias.")
+
+
+@log_time
+def build_constraints(conn, connect, constraints_filepath, jobs):
+    """
+    Fim da carga em massa: tabelas de volta a LOGGED, índices, chaves estrangeiras e estatísticas.
+    """
+    apply_constraints(conn, connect, constraints_filepath, jobs=jobs, analyze=True)
+
+
+@log_time
+def export_similar_graph(conn, graph_dir, version):
+    """
+    Exporta o grafo dos produtos similares em formato CSR, lido pelo dashboard (src/similar_graph.py).
+    """
+    nodes, edges = export_graph(conn, graph_dir, version)
+    METRICS.add_rows(edges, sum(entry.stat().st_size for entry in os.scandir(graph_dir)), nodes=nodes)
+    print(f"Grafo dos produtos similares ({nodes} produtos, {edges} relações) gravado em '{graph_dir}'.")
+
+
+@log_time
+def export_columnar_snapshot(conn, snapshot_dir, version):
+    """
+    Exporta o snapshot colunar das tabelas, usado pelo dashboard sem o banco (src/snapshot.py).
+    """
+    rows = export_snapshot(conn, snapshot_dir, version)
+    METRICS.add_rows(sum(rows.values()), sum(entry.stat().st_size for entry in os.scandir(snapshot_dir)), **rows)
+    print(f"Snapshot colunar ({rows['products']} produtos, {rows['reviews']} reviews) gravado em '{snapshot_dir}'.")
+
+
+@log_time
+def build_summaries(conn, connect, summaries_filepath, jobs):
+    """
+    Atualiza as tabelas de resumo lidas pelas consultas gerais do dashboard.
+    """
+    refresh_summaries(conn, connect, summaries_filepath, jobs=jobs)
 
 
 def main():
@@ -210,8 +537,55 @@ def main():
     parser.add_argument("--db-name", required=True)
     parser.add_argument("--db-user", required=True)
     parser.add_argument("--db-pass", required=True)
-    parser.add_argument("--input", required=True)
+    parser.add_argument("--input", required=True,
+                        help="Ficheiro de dados SNAP (texto, ou comprimido em .gz / .zst, lido sem descompressão prévia)")
+    parser.add_argument("--loader", choices=LOADER_MODES, default='executemany',
+                        help="Modo de escrita dos produtos, reviews e categorias dos produtos: 'executemany' (INSERT linha a linha) ou 'copy' (COPY binário)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Número de processos usados no parsing do ficheiro (1 = leitura sequencial)")
+    parser.add_argument("--parser", choices=PARSER_BACKENDS, default='text',
+                        help="Backend de parsing: 'text' (linhas str) ou 'bytes' (mmap do ficheiro, sem descodificar cada linha)")
+    parser.add_argument("--writers", type=int, default=0,
+                        help="Número de threads escritoras (cada uma com a sua conexão) que gravam os lotes em paralelo com o parsing (0 = escrita na mesma thread do parsing). "
+                             "Com mais de uma, se o mesmo ASIN aparecer em lotes diferentes a ordem dos upserts deixa de ser garantida")
+    parser.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH,
+                        help="Número máximo de lotes prontos à espera das threads escritoras")
+    parser.add_argument("--unordered", action="store_true",
+                        help="Com --workers > 1, processa os blocos do ficheiro pela ordem em que ficam prontos e não pela ordem do ficheiro")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Mantém as tabelas existentes: retoma uma carga interrompida do mesmo ficheiro a partir do último checkpoint "
+                             "ou, com um novo dump, grava apenas os produtos novos ou alterados")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Carga inicial em massa: as chaves estrangeiras e os índices secundários só são criados (em paralelo) depois de todos os dados carregados")
+    parser.add_argument("--unlogged", action="store_true",
+                        help="Com --bulk, carrega as tabelas como UNLOGGED (sem WAL) e volta a torná-las LOGGED no fim")
+    parser.add_argument("--review-partitions", type=int, default=0,
+                        help="Cria a tabela reviews particionada por hash do produto, com este número de partições (0 = sem partições hash). "
+                             "No modo 'copy' cada lote é gravado diretamente nas partições")
+    parser.add_argument("--reviews-by-year", action="store_true",
+                        help="Cria a tabela reviews particionada por ano da review (combinável com --review-partitions)")
+    parser.add_argument("--index-jobs", type=int, default=4,
+                        help="Número de tabelas processadas em paralelo na criação de índices e validação de chaves do modo --bulk "
+                             "e na atualização das tabelas de resumo do dashboard")
+    parser.add_argument("--graph-dir",
+                        help="Diretório onde exportar, no fim da carga, o grafo dos produtos similares (formato CSR, lido pelo dashboard com --graph-dir)")
+    parser.add_argument("--snapshot-dir",
+                        help="Diretório onde exportar, no fim da carga, o snapshot colunar das tabelas (lido pelo dashboard com --snapshot, sem o banco)")
+    parser.add_argument("--metrics-file",
+                        help="Ficheiro onde gravar, no fim, o relatório de métricas de cada etapa (linhas/s, bytes/s, memória, idas ao banco)")
+    parser.add_argument("--metrics-format", choices=METRICS_FORMATS, default='json',
+                        help="Formato do relatório de métricas: json ou prometheus (formato de texto)")
     args = parser.parse_args()
+    if args.incremental and args.unordered:
+        parser.error("--incremental precisa da ordem do ficheiro para o checkpoint e não pode ser usado com --unordered")
+    if args.bulk and args.incremental:
+        parser.error("--bulk é uma carga completa (recria as tabelas) e não pode ser usado com --incremental")
+    if args.unlogged and not args.bulk:
+        parser.error("--unlogged só pode ser usado com --bulk")
+    if args.review_partitions < 0:
+        parser.error("--review-partitions não pode ser negativo")
+    if args.incremental and (args.review_partitions or args.reviews_by_year):
+        parser.error("o particionamento das reviews só é escolhido numa carga completa; --incremental usa o das tabelas existentes")
 
     main_start_time = time.perf_counter()
     print("="*50)
@@ -219,22 +593,65 @@ def main():
     print("="*50)
     try:
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        schema_filepath = os.path.join(project_root, 'sql', 'schema.sql')
+        sql_dir = os.path.join(project_root, 'sql')
     except NameError:
-        schema_filepath = 'sql/schema.sql'
-    conn = get_conn(args.db_host, args.db_port, args.db_name, args.db_user, args.db_pass)
+        sql_dir = 'sql'
+    connect = lambda: get_conn(args.db_host, args.db_port, args.db_name, args.db_user, args.db_pass)
+    constraints_filepath = os.path.join(sql_dir, 'constraints.sql')
+    conn = connect()
     try:
-        create_schema(conn, schema_filepath)
-        start_cat_extract = time.perf_counter()
-        print("-> Iniciando etapa: 'extract_all_categories' (leitura do ficheiro)...")
-        categories = extract_all_categories(args.input)
-        end_cat_extract = time.perf_counter()
-        print(f"<- Etapa 'extract_all_categories' concluída em {end_cat_extract - start_cat_extract:.4f} segundos.")
+        input_name, input_size = input_identity(args.input)
+        review_router = None
+        if not args.incremental: # carga completa: as tabelas são recriadas
+            create_schema(conn, os.path.join(sql_dir, 'drop.sql'))
+            if args.review_partitions or args.reviews_by_year: # o schema.sql já não recria a tabela reviews
+                review_router = create_partitioned_reviews(conn, args.review_partitions, args.reviews_by_year)
+        create_schema(conn, os.path.join(sql_dir, 'schema.sql'))
+        if args.incremental:
+            review_router = read_review_router(conn)
+        if not args.bulk: # carga normal: chaves e índices ativos durante toda a carga
+            apply_constraints(conn, connect, constraints_filepath)
+        elif args.unlogged:
+            set_unlogged(conn)
+        start_offset, skip_source_id = 0, None
+        with conn.cursor() as cur:
+            resume = read_checkpoint(cur, input_name, input_size) if args.incremental else None
+            if resume is not None:
+                load_id, start_offset, skip_source_id = resume
+                print(f"A retomar a carga de '{input_name}' a partir do byte {start_offset} (produto {skip_source_id}).")
+            else:
+                load_id = reset_checkpoint(cur, input_name, input_size)
+                cur.execute("TRUNCATE etl_related_staging") # restos de uma carga de outro ficheiro
+            clear_data_version(cur) # os dados vão mudar: a cache do dashboard deixa de valer
+        conn.commit()
+        # as categorias são descobertas e inseridas (com a sua hierarquia) durante a mesma
+        # leitura dos produtos; no modo incremental as já existentes vêm do banco
+        categories = {}
+        id_map = load_category_map(conn) if args.incremental else {}
+        customer_ids = load_customer_map(conn) if args.incremental else {}
+        process_products_and_reviews(
+            conn, args.input, categories, id_map, args.loader,
+            workers=args.workers, ordered=not args.unordered, parser_backend=args.parser,
+            writers=args.writers, queue_depth=args.queue_depth,
+            connect=connect, customer_ids=customer_ids,
+            load_id=load_id, start_offset=start_offset, skip_source_id=skip_source_id,
+            incremental=args.incremental, checkpoint_name=input_name, review_router=review_router
+        )
         print(f"Encontradas {len(categories)} categorias únicas.")
-        id_map = insert_categories(conn, categories)
-        insert_category_hierarchy(conn, categories, id_map)
-        valid_asins, potential_pairs = process_products_and_reviews(conn, args.input, id_map)
-        insert_filtered_related_products(conn, valid_asins, potential_pairs)
+        insert_filtered_related_products(conn)
+        insert_category_closure(conn, categories, id_map, incremental=args.incremental)
+        if args.bulk:
+            build_constraints(conn, connect, constraints_filepath, args.index_jobs)
+        build_summaries(conn, connect, os.path.join(sql_dir, 'summaries.sql'), args.index_jobs)
+        with conn.cursor() as cur:
+            complete_checkpoint(cur, input_name)
+            version = stamp_data_version(cur)
+        conn.commit()
+        print(f"Versão dos dados: {version}")
+        if args.graph_dir:
+            export_similar_graph(conn, args.graph_dir, version)
+        if args.snapshot_dir:
+            export_columnar_snapshot(conn, args.snapshot_dir, version)
         print("\nProcesso de ETL concluído com sucesso!")
         sys.exit(0)
     except Exception as e:
@@ -245,8 +662,12 @@ def main():
             print("Conexão com a base de dados fechada.")
         main_end_time = time.perf_counter()
         total_etl_time = main_end_time - main_start_time
+        # pico de memória do processo, que não cresce com o tamanho do ficheiro
+        peak_rss = peak_rss_mb()
+        if args.metrics_file:
+            METRICS.write_report(args.metrics_file, 'tp1_3.2.py', args.metrics_format)
         print("="*50)
-        print(f"FIM DO PROCESSO DE ETL. Tempo total de execução: {total_etl_time:.4f} segundos.")
+        print(f"FIM DO PROCESSO DE ETL. Tempo total de execução: {total_etl_time:.4f} segundos. Pico de memória: {peak_rss:.0f} MB.")
         print("="*50)
 
 if __name__ == "__main__":
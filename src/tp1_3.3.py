@@ -1,291 +1,391 @@
 import argparse
+import functools
 import sys
-import os
 import time
-import pandas as pd
-from db import get_conn
+from db import get_conn, get_pool
+from query_runner import QueryTask, QueryResult, run_concurrently, print_timings
+from result_cache import ResultCache, DEFAULT_CACHE_SIZE_MB
+from checkpoint import read_data_version
+from title_search import search_titles
+from batch_dashboard import run_batch, PRODUCT_KEYS, DEFAULT_BATCH_SIZE
+from result_export import export_results, export_rows, ResultOutput, EXPORT_FORMATS, DEFAULT_PREVIEW_ROWS
+from similar_graph import open_graph, DEFAULT_HOPS, DEFAULT_LIMIT
+from snapshot import Snapshot, find_product, PRODUCT_QUERIES, GENERAL_QUERIES
+from metrics import METRICS, METRICS_FORMATS
 
 #mesma coisa do que tá no 3.2.py
 def log_time(func):
     """Decorator que regista e imprime o tempo de execução de uma consulta."""
+    @functools.wraps(func) # mantém o nome da consulta (usado também nos tempos do --parallel)
     def wrapper(*args, **kwargs):
         # usando 'func.__name__' para obter o nome da função original
         print(f"\n-> Executando consulta: '{func.__name__}'...")
         start_time = time.perf_counter()
-        result = func(*args, **kwargs)
+        with METRICS.stage(func.__name__): # linhas, memória e idas ao banco da consulta (src/metrics.py)
+            result = func(*args, **kwargs)
         end_time = time.perf_counter()
         total_time = end_time - start_time
         print(f"<- Consulta '{func.__name__}' concluída em {total_time:.4f} segundos.") #unica mudança
         return result
     return wrapper
 
-def print_results(cursor, title,  output=None, csv_filename=None):
-
-    print(f"\n{'='*10} {title} {'='*10}")
-    results = cursor.fetchall()
-    if not results:
-        print("Nenhum resultado encontrado.")
-        return
-    headers = [desc[0] for desc in cursor.description]
-    df = pd.DataFrame(results, columns=headers)
-    print(df.to_string(index=False))
-    print(f"Total de registros: {len(results)}")
-    if output and csv_filename:
-        try:
-            os.makedirs(output, exist_ok=True)
-            filepath = os.path.join(output, csv_filename)
-            df.to_csv(filepath, index=False)
-            print(f"--> Resultado salvo em: {filepath}")
-        except IOError as e:
-            print(f"Erro ao salvar o arquivo CSV '{filepath}': {e}", file=sys.stderr)
-        except Exception as e:
-            print(f"Ocorreu um erro inesperado ao salvar o CSV: {e}", file=sys.stderr)
-
-def get_product_asin(conn, identifier, identifier_type):
+def get_product(conn, identifier, identifier_type, candidates=5):
     """
-    Busca o ASIN de um produto usando seu source_id, título ou ASIN.
+    Busca um produto usando seu source_id, título ou ASIN e devolve (source_id, asin).
+    O source_id é a chave usada pelas tabelas reviews, Product_category e Related_products.
+    Pelo título são mostrados até `candidates` produtos, do mais para o menos parecido,
+    e é usado o primeiro.
     """
     with conn.cursor() as cur:
         if identifier_type == 'source_id':
-            sql = "SELECT asin FROM Products WHERE source_id = %s;" 
+            sql = "SELECT source_id, asin FROM Products WHERE source_id = %s;" 
 
             cur.execute(sql, (identifier,))
         elif identifier_type == 'titulo':
-            sql = "SELECT asin, titulo FROM Products WHERE titulo ILIKE %s;"
-            cur.execute(sql, (f'%{identifier}%',))
+            results, method = search_titles(cur, identifier, limit=candidates)
+            if not results:
+                print(f"ERRO: Nenhum produto encontrado com {identifier_type} '{identifier}'.", file=sys.stderr)
+                return None
+            if len(results) > 1:
+                print(f"Produtos encontrados com o título '{identifier}' (procura por {method}, melhores primeiro):")
+                for row in results:
+                    print(f"  - ASIN: {row[1]}, Título: {row[2]}")
+                print(f"A usar o primeiro: {results[0][1]}. Seja mais específico ou use o ASIN/source_id para escolher outro.")
+            return results[0][:2]
 
         else: # é um asin
-            sql = "SELECT asin FROM Products WHERE asin = %s;"
-            cur.execute(sql, (identifier,)) #checando se tem mais de um (não deveria ter, mas vai que acontece)
+            sql = "SELECT source_id, asin FROM Products WHERE asin = %s;"
+            cur.execute(sql, (identifier,))
 
         results = cur.fetchall()
 
         if len(results) == 0:
             print(f"ERRO: Nenhum produto encontrado com {identifier_type} '{identifier}'.", file=sys.stderr)
             return None
-        elif len(results) > 1:
-            print(f"ERRO: Múltiplos produtos encontrados com o título '{identifier}'. Seja mais específico ou use o ASIN/source_id.", file=sys.stderr)
-            print("Produtos encontrados:")
-            for row in results:
-                print(f"  - ASIN: {row[0]}, Título: {row[1]}")
-            return None
-        else:
-            return results[0][0]
+        return results[0][:2] # source_id é a chave primária e asin é UNIQUE: no máximo uma linha
 
 #  Funções de Consultas
 @log_time
-def query1(conn, product_asin, output):
+def query1(conn, product_id, product_asin, output):
 
     # dado um produto, lista os 5 comentários mais úteis e com maior avaliação
     # e os 5 comentários mais úteis e com menor avaliação.
-    with conn.cursor() as cur:
-        sql_top = """
-        SELECT rating, helpful, votes, customer_id, review_date
-        FROM reviews 
-        WHERE product_asin = %s 
-        ORDER BY helpful DESC, rating DESC LIMIT 5;
-        """
-        cur.execute(sql_top, (product_asin,))
-        print_results(cur, f"Query 1: Top 5 comentários úteis e com maior avaliação (ASIN: {product_asin})",output, f"q1_top5_reviews_pos_{product_asin}.csv")
-        
-        sql_bottom = """SELECT rating, helpful, votes, customer_id, review_date 
-        FROM reviews 
-        WHERE product_asin = %s 
-        ORDER BY helpful DESC, rating ASC LIMIT 5;"""
-        cur.execute(sql_bottom, (product_asin,))
-        print_results(cur, f"Query 1: Top 5 comentários úteis e com menor avaliação (ASIN: {product_asin})",output, f"q1_top5_reviews_neg_{product_asin}.csv")
+    sql_top = """
+    SELECT r.rating, r.helpful, r.votes, c.customer_code AS customer_id, r.review_date
+    FROM reviews r
+    JOIN Customers c ON c.customer_id = r.customer_id
+    WHERE r.product_id = %s 
+    ORDER BY r.helpful DESC, r.rating DESC LIMIT 5;
+    """
+    export_results(conn, sql_top, (product_id,), f"Query 1: Top 5 comentários úteis e com maior avaliação (ASIN: {product_asin})", output, f"q1_top5_reviews_pos_{product_asin}")
+    
+    sql_bottom = """SELECT r.rating, r.helpful, r.votes, c.customer_code AS customer_id, r.review_date 
+    FROM reviews r
+    JOIN Customers c ON c.customer_id = r.customer_id
+    WHERE r.product_id = %s 
+    ORDER BY r.helpful DESC, r.rating ASC LIMIT 5;"""
+    export_results(conn, sql_bottom, (product_id,), f"Query 1: Top 5 comentários úteis e com menor avaliação (ASIN: {product_asin})", output, f"q1_top5_reviews_neg_{product_asin}")
 
 @log_time
-def query2(conn, product_asin, output):
+def query2(conn, product_id, product_asin, output):
     # dado um produto, lista os produtos similares com maiores vendas (melhor salesrank)
     
+    sql = """
+        WITH TargetProduct AS (
+            SELECT salesrank FROM Products WHERE source_id = %s
+        )
+        SELECT p.asin, p.titulo, p.salesrank
+        FROM Related_products rp
+        JOIN Products p ON p.source_id = CASE
+                                WHEN rp.product1_id = %s THEN rp.product2_id
+                                ELSE rp.product1_id
+                            END
+        WHERE (rp.product1_id = %s OR rp.product2_id = %s)
+          AND p.salesrank IS NOT NULL
+          AND p.salesrank > 0
+          AND p.salesrank < (SELECT salesrank FROM TargetProduct)
+        ORDER BY p.salesrank ASC;
+    """
+    export_results(conn, sql, (product_id, product_id, product_id, product_id), f"Query 2: produtos similares a {product_asin} com melhor ranking de vendas", output, f"q2_similar_products_sales_melhor_{product_asin}")
+
+# colunas do resultado pelo grafo: nome e OID do tipo no PostgreSQL (usado no Parquet)
+GRAPH_COLUMNS = [('asin', 1043), ('titulo', 25), ('salesrank', 23), ('saltos', 23)]
+
+@log_time
+def query2_graph(conn, product_id, product_asin, graph, hops, limit, output):
+    # como a consulta 2, mas pelo grafo dos similares exportado pelo ETL (src/similar_graph.py):
+    # os produtos a até `hops` saltos, ordenados pelo salesrank; do banco vêm só os títulos
+    start_time = time.perf_counter()
+    similar = graph.recommend(product_id, hops, limit)
+    graph_time = time.perf_counter() - start_time
+    if similar is None:
+        print(f"AVISO: o produto {product_asin} não está no grafo dos produtos similares.", file=sys.stderr)
+        return
+    print(f"Grafo dos similares: {len(similar)} produtos a até {hops} saltos em {graph_time * 1e6:.0f} µs.")
     with conn.cursor() as cur:
-        sql = """
-            WITH TargetProduct AS (
-                SELECT salesrank FROM Products WHERE asin = %s
-            )
-            SELECT p.asin, p.titulo, p.salesrank
-            FROM Related_products rp
-            JOIN Products p ON p.asin = CASE
-                                    WHEN rp.product1_asin = %s THEN rp.product2_asin
-                                    ELSE rp.product1_asin
-                                END
-            WHERE (rp.product1_asin = %s OR rp.product2_asin = %s)
-              AND p.salesrank IS NOT NULL
-              AND p.salesrank > 0
-              AND p.salesrank < (SELECT salesrank FROM TargetProduct)
-            ORDER BY p.salesrank ASC;
-        """
-        cur.execute(sql, (product_asin, product_asin, product_asin, product_asin))
-        print_results(cur, f"Query 2: produtos similares a {product_asin} com melhor ranking de vendas", output, f"q2_similar_products_sales_melhor_{product_asin}.csv")
+        cur.execute("SELECT source_id, titulo FROM Products WHERE source_id = ANY(%s)", ([row[0] for row in similar],))
+        titles = dict(cur.fetchall())
+    rows = [(asin, titles.get(source_id), salesrank, hop) for source_id, asin, salesrank, hop in similar]
+    export_rows(GRAPH_COLUMNS, rows, f"Query 2 (grafo): produtos a até {hops} saltos de {product_asin}, pelo ranking de vendas",
+                output, f"q2_similar_products_{hops}hops_{product_asin}")
 
 @log_time
-def query3(conn, product_asin, output):
+def query3(conn, product_id, product_asin, output):
     #dado um produto, mostra a evolução diária das médias de avaliação
 
-    with conn.cursor() as cur:
-        sql = """
-            SELECT
-                review_date,
-                COUNT(rating) AS num_avaliacoes,
-                CAST(AVG(rating) AS DECIMAL(3, 2)) AS media_avaliacoes
-            FROM reviews
-            WHERE product_asin = %s
-            GROUP BY review_date
-            ORDER BY review_date ASC;
-        """
-        cur.execute(sql, (product_asin,))
-        print_results(cur, f"Query 3: Evolução diária das médias de avaliação para o produto {product_asin}", output, f"q3_evolucao_media_avaliacoes_{product_asin}.csv")
+    sql = """
+        SELECT
+            review_date,
+            COUNT(rating) AS num_avaliacoes,
+            CAST(AVG(rating) AS DECIMAL(3, 2)) AS media_avaliacoes
+        FROM reviews
+        WHERE product_id = %s
+        GROUP BY review_date
+        ORDER BY review_date ASC;
+    """
+    export_results(conn, sql, (product_id,), f"Query 3: Evolução diária das médias de avaliação para o produto {product_asin}", output, f"q3_evolucao_media_avaliacoes_{product_asin}")
 
 @log_time
 def query4(conn, output):
     #lista os 10 produtos líderes de venda em cada grupo de produtos.
-    
-    with conn.cursor() as cur:
-        sql = """
-            WITH RankedProducts AS (
-                SELECT
-                    p.titulo,
-                    p.group_name,
-                    p.salesrank,
-                    ROW_NUMBER() OVER(PARTITION BY p.group_name ORDER BY p.salesrank ASC) as rank_in_group
-                FROM Products p
-                WHERE p.salesrank > 0 AND p.group_name IS NOT NULL
-            )
-            SELECT
-                group_name,
-                rank_in_group,
-                titulo,
-                salesrank
-            FROM RankedProducts
-            WHERE rank_in_group <= 10;
-        """
-        cur.execute(sql)
-        print_results(cur, "Query 4: Top 10 produtos líderes de venda por grupo de produtos", output, "q4_top10_produtos_lideres_venda_por_grupo.csv")
+    # lê a tabela de resumo GroupSalesRanking, atualizada pelo ETL (sql/summaries.sql)
+    sql = """
+        SELECT
+            group_name,
+            rank_in_group,
+            titulo,
+            salesrank
+        FROM GroupSalesRanking
+        ORDER BY group_name, rank_in_group;
+    """
+    export_results(conn, sql, None, "Query 4: Top 10 produtos líderes de venda por grupo de produtos", output, "q4_top10_produtos_lideres_venda_por_grupo")
 
 @log_time
 def query5(conn, output):
     # lista os 10 produtos com a maior média de avaliações úteis positivas,
     # considerando avaliações com rating >= 3.
-    with conn.cursor() as cur:
-        sql = """
-            SELECT
-                p.asin,
-                p.titulo,
-                ROUND(AVG(r.helpful), 2) AS media_avaliacoes_uteis,
-                COUNT(r.review_id) AS total_avaliacoes_positivas
-            FROM Products p
-            JOIN reviews r ON p.asin = r.product_asin
-            WHERE r.rating >= 3  -- apenas avaliações com nota 3 ou superior
-            GROUP BY p.asin, p.titulo
-            HAVING COUNT(r.review_id) > 0
+    # as médias por produto vêm da tabela de resumo ProductReviewSummary (atualizada pelo ETL),
+    # lida pelo índice da média; só os 10 produtos finais são buscados em Products
+    sql = """
+        WITH TopProducts AS (
+            SELECT product_id, media_avaliacoes_uteis, total_avaliacoes_positivas
+            FROM ProductReviewSummary
             ORDER BY media_avaliacoes_uteis DESC
-            LIMIT 10;
-        """
-        cur.execute(sql)
-        print_results(cur, "Query 5: Top 10 produtos com maior média de avaliações úteis (rating >= 3)", output, "q5_top10_produtos_maior_media_avaliacoes_uteis.csv")
+            LIMIT 10
+        )
+        SELECT
+            p.asin,
+            p.titulo,
+            ROUND(tp.media_avaliacoes_uteis, 2) AS media_avaliacoes_uteis,
+            tp.total_avaliacoes_positivas
+        FROM TopProducts tp
+        JOIN Products p ON p.source_id = tp.product_id
+        ORDER BY tp.media_avaliacoes_uteis DESC;
+    """
+    export_results(conn, sql, None, "Query 5: Top 10 produtos com maior média de avaliações úteis (rating >= 3)", output, "q5_top10_produtos_maior_media_avaliacoes_uteis")
 
 @log_time
 def query6(conn, output):
     # lista as 5 categorias com a maior média de avaliações úteis positivas, considerando avaliações com rating >= 3
-
-    with conn.cursor() as cur:
-        select_sql = """
-            WITH
-            DirectCategoryTotals AS (
-                SELECT
-                    pc.category_id,
-                    SUM(r.helpful) AS total_helpful,
-                    COUNT(r.review_id) AS total_reviews
-                FROM
-                    Product_category pc
-                JOIN
-                    reviews r ON pc.product_asin = r.product_asin
-                WHERE
-                    r.rating >= 3  -- ADICIONADO: Filtra apenas avaliações com nota 3 ou superior
-                GROUP BY
-                    pc.category_id
-            ),
-            -- para cada categoria pai, calcula a soma dos totais de seus filhos diretos
-            ChildTotals AS (
-                SELECT
-                    h.parent_category_id AS category_id,
-                    SUM(dct.total_helpful) AS total_helpful,
-                    SUM(dct.total_reviews) AS total_reviews
-                FROM
-                    Category_Hierarchy h
-                JOIN
-                    DirectCategoryTotals dct ON h.child_category_id = dct.category_id
-                GROUP BY
-                    h.parent_category_id
-            )
-            -- Combina os totais diretos com os totais dos filhos e calcula a media final
-            SELECT
-                cat.category_name,
-                ROUND(
-                    (COALESCE(dct.total_helpful, 0) + COALESCE(ct.total_helpful, 0))::DECIMAL
-                    / NULLIF(COALESCE(dct.total_reviews, 0) + COALESCE(ct.total_reviews, 0), 0), 2
-                ) AS media_avaliacoes_uteis,
-                (COALESCE(dct.total_reviews, 0) + COALESCE(ct.total_reviews, 0)) AS total_reviews_agregado
-            FROM
-                Categories cat
-            LEFT JOIN
-                DirectCategoryTotals dct ON cat.category_id = dct.category_id
-            LEFT JOIN
-                ChildTotals ct ON cat.category_id = ct.category_id
-            WHERE
-                (COALESCE(dct.total_reviews, 0) + COALESCE(ct.total_reviews, 0)) > 0
-            ORDER BY
-                media_avaliacoes_uteis DESC
-            LIMIT 5;
-        """
-        cur.execute(select_sql)
-        print_results(cur, "Query 6: Top 5 categorias com maior média de avaliações úteis (rating >= 3)", output, "q6_top5_categorias_maior_media_avaliacoes_uteis.csv")
+    # os totais de cada categoria (sobre toda a subárvore, pelo fecho transitivo Category_Closure) vêm da tabela de resumo CategoryReviewSummary
+    select_sql = """
+        SELECT
+            category_name,
+            media_avaliacoes_uteis,
+            total_reviews_agregado
+        FROM CategoryReviewSummary
+        ORDER BY media_avaliacoes_uteis DESC
+        LIMIT 5;
+    """
+    export_results(conn, select_sql, None, "Query 6: Top 5 categorias com maior média de avaliações úteis (rating >= 3)", output, "q6_top5_categorias_maior_media_avaliacoes_uteis")
 
 @log_time
 def query7(conn, output):
     # lista os 10 clientes que mais fizeram comentários por grupo de produto.
-    
+    # o ranking é calculado pelo ETL na tabela de resumo GroupCustomerRanking
+    sql = """
+        SELECT
+            group_name,
+            rank_in_group,
+            customer_code AS customer_id,
+            total_comentarios
+        FROM GroupCustomerRanking
+        ORDER BY group_name, rank_in_group;
+    """
+    export_results(conn, sql, None, "Query 7: Top 10 clientes que mais fizeram comentários por grupo de produto", output, "q7_top10_clientes_mais_comentarios_por_grupo")
+
+
+def find_target(conn, args, lookup=get_product):
+    # procura o produto indicado nos argumentos (None se não foi indicado ou não existe);
+    # `lookup` é get_product ou, com --snapshot, a procura no snapshot
+    with METRICS.stage('get_product'):
+        return _find_target(conn, args, lookup)
+
+def _find_target(conn, args, lookup):
+    if args.product_asin:
+        return lookup(conn, args.product_asin, 'asin')
+    elif args.product_id:
+        return lookup(conn, args.product_id, 'source_id')
+    elif args.product_title:
+        return lookup(conn, args.product_title, 'titulo', candidates=args.title_candidates)
+    return None
+
+def dashboard_tasks(target, output, graph=None, hops=DEFAULT_HOPS, graph_limit=DEFAULT_LIMIT):
+    """
+    Lista das consultas a executar, pela ordem em que são mostradas. As consultas 1, 2 e 3
+    (e a 2 pelo grafo, se houver `graph`) dependem da procura do produto; as restantes não
+    dependem de nada.
+    """
+    tasks = []
+    if target:
+        target_id, target_asin = target
+        tasks += [
+            QueryTask(query.__name__, query, (target_id, target_asin, output), 'get_product')
+            for query in (query1, query2, query3)
+        ]
+        if graph is not None:
+            tasks.insert(2, QueryTask('query2_graph', query2_graph,
+                                      (target_id, target_asin, graph, hops, graph_limit, output), 'get_product'))
+    tasks += [QueryTask(query.__name__, query, (output,), None) for query in (query4, query5, query6, query7)]
+    return tasks
+
+def product_header(target):
+    if target:
+        return f"\n--- Executando consultas para o produto com ASIN: {target[1]} ---"
+    return "\nAVISO: As consultas 1, 2 e 3 não foram executadas pois nenhum identificador de produto foi fornecido ou o produto não foi encontrado."
+
+GENERAL_HEADER = "\n--- Executando consultas gerais ---"
+
+def similar_graph(conn, args, target):
+    # o grafo dos similares só é usado com --graph-dir e um produto
+    if not (args.graph_dir and target):
+        return None
+    return open_graph(conn, args.graph_dir)
+
+def result_output(args):
+    return ResultOutput(args.output, args.format, args.preview_rows, args.explain)
+
+def open_cache(conn, args):
+    """
+    Abre a cache de resultados para a versão atual dos dados (None se a cache não foi pedida
+    ou se não há versão, ou seja, se uma carga do ETL está em curso ou nunca terminou).
+    """
+    if not args.cache_dir:
+        return None
+    if args.explain:
+        print("AVISO: com --explain as consultas são executadas no banco; a cache de resultados não será usada.")
+        return None
     with conn.cursor() as cur:
-        sql = """
-            WITH CustomerRankByGroup AS (
-                SELECT
-                    r.customer_id,
-                    p.group_name,
-                    COUNT(r.review_id) as total_comentarios,
-                    ROW_NUMBER() OVER(PARTITION BY p.group_name ORDER BY COUNT(r.review_id) DESC) as rank_in_group
-                FROM reviews r
-                JOIN Products p ON r.product_asin = p.asin
-                WHERE p.group_name IS NOT NULL
-                GROUP BY r.customer_id, p.group_name
-            )
-            SELECT
-                group_name,
-                rank_in_group,
-                customer_id,
-                total_comentarios
-            FROM CustomerRankByGroup
-            WHERE rank_in_group <= 10;
-        """
-        cur.execute(sql)
-        print_results(cur, "Query 7: Top 10 clientes que mais fizeram comentários por grupo de produto", output, "q7_top10_clientes_mais_comentarios_por_grupo.csv")
+        version = read_data_version(cur)
+    conn.commit()
+    if version is None:
+        print("AVISO: sem versão dos dados (carga do ETL em curso ou incompleta); a cache de resultados não será usada.")
+        return None
+    return ResultCache(args.cache_dir, version, max_bytes=args.cache_size * 1024 * 1024)
 
+def with_cache(tasks, cache):
+    # cada consulta passa a receber uma conexão que responde a partir da cache
+    if cache is None:
+        return tasks
+    def cached(task):
+        def run(conn, *args):
+            return task.func(cache.connection(conn, task.name), *args)
+        return task._replace(func=run)
+    return [cached(task) for task in tasks]
+
+def print_cache_stats(cache):
+    if cache is not None:
+        print(f"\nCache de resultados (versão dos dados {cache.version}): "
+              f"{cache.hits} reutilizados, {cache.misses} calculados.")
+
+def run_parallel(args):
+    """
+    Executa as consultas em paralelo, com `args.parallel` conexões de um pool, e mostra
+    os resultados pela ordem habitual, seguidos dos tempos e do caminho crítico.
+    """
+    with get_pool(args.db_host, args.db_port, args.db_name, args.db_user, args.db_pass, args.parallel) as pool:
+        print(f"Pool com {args.parallel} conexões ao banco de dados aberto com sucesso.")
+        start_time = time.perf_counter()
+        with pool.connection() as conn:
+            cache = open_cache(conn, args)
+            target = find_target(conn, args)
+            graph = similar_graph(conn, args, target)
+        lookup = QueryResult('get_product', time.perf_counter() - start_time, '')
+        print(product_header(target))
+        tasks = dashboard_tasks(target, result_output(args), graph, args.hops, args.graph_limit)
+        results = run_concurrently(
+            pool, with_cache(tasks, cache), args.parallel, done=[lookup], headers={'query4': GENERAL_HEADER + "\n"}
+        )
+        print_timings(tasks, results, time.perf_counter() - start_time)
+        print_cache_stats(cache)
+
+def run_snapshot(args):
+    """
+    Modo --snapshot: as consultas são respondidas a partir do snapshot colunar exportado pelo
+    ETL (src/snapshot.py), sem ligação ao banco, e gravadas nos mesmos ficheiros.
+    """
+    snapshot = Snapshot(args.snapshot)
+    print(f"Snapshot '{args.snapshot}' aberto (versão dos dados {snapshot.data_version}).")
+    target = find_target(snapshot, args, find_product)
+    print(product_header(target))
+    output = result_output(args)
+    if target:
+        for query in PRODUCT_QUERIES:
+            log_time(query)(snapshot, *target, output)
+    print(GENERAL_HEADER)
+    for query in GENERAL_QUERIES:
+        log_time(query)(snapshot, output)
 
 def main():
     #declarando os argumentos aceitos
     parser = argparse.ArgumentParser(description="Executa consultas do dashboard no banco de dados de e-commerce.")
-    parser.add_argument("--db-host", required=True, help="Host do banco de dados")
+    # obrigatórios, exceto com --snapshot (verificado depois de ler os argumentos)
+    parser.add_argument("--db-host", help="Host do banco de dados")
     parser.add_argument("--db-port", type=int, default=5432, help="Porta do banco de dados")
-    parser.add_argument("--db-name", required=True, help="Nome do banco de dados")
-    parser.add_argument("--db-user", required=True, help="Usuário do banco de dados")
-    parser.add_argument("--db-pass", required=True, help="Senha do banco de dados")
+    parser.add_argument("--db-name", help="Nome do banco de dados")
+    parser.add_argument("--db-user", help="Usuário do banco de dados")
+    parser.add_argument("--db-pass", help="Senha do banco de dados")
+    parser.add_argument("--snapshot",
+                        help="Diretório do snapshot colunar exportado pelo ETL (--snapshot-dir): executa as consultas 1 a 7 sem o banco de dados")
     parser.add_argument("--output", help="Diretório para salvar os resultados das consultas em arquivos CSV")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default='csv',
+                        help="Formato dos ficheiros gravados em --output: csv ou parquet (precisa do pacote pyarrow)")
+    parser.add_argument("--preview-rows", type=int, default=DEFAULT_PREVIEW_ROWS,
+                        help="Número de linhas de cada resultado mostradas no terminal (o ficheiro tem sempre todas)")
+    parser.add_argument("--parallel", type=int, default=1,
+                        help="Número de consultas executadas ao mesmo tempo, cada uma com uma conexão de um pool (1 = uma consulta de cada vez, numa única conexão)")
+    parser.add_argument("--cache-dir",
+                        help="Diretório da cache em disco dos resultados das consultas, reutilizados enquanto o ETL não voltar a carregar os dados")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE_MB,
+                        help="Tamanho máximo da cache de resultados, em MB (os resultados usados há mais tempo são apagados primeiro)")
 
     #criando um grupo de argumentos mutuamente exclusivos para identificar o produto
     product_identifier_group = parser.add_mutually_exclusive_group()
     product_identifier_group.add_argument("--product-asin", help="ASIN do produto para as consultas 1, 2 e 3")
     product_identifier_group.add_argument("--product-id", type=int, help="ID do produto (usa a coluna source_id) para as consultas 1, 2 e 3")
     product_identifier_group.add_argument("--product-title", help="Título (ou parte do título) do produto para as consultas 1, 2 e 3")
+    product_identifier_group.add_argument("--products-file",
+                                          help="Ficheiro com um identificador de produto por linha: executa só as consultas 1, 2 e 3, para todos os produtos")
+    parser.add_argument("--explain", action="store_true",
+                        help="Grava em --output o plano de execução de cada consulta (EXPLAIN ANALYZE, BUFFERS), para comparar com src/query_plans.py")
+    parser.add_argument("--graph-dir",
+                        help="Diretório do grafo dos produtos similares exportado pelo ETL (--graph-dir): junta a consulta 2 a até --hops saltos")
+    parser.add_argument("--hops", type=int, default=DEFAULT_HOPS,
+                        help="Número máximo de saltos no grafo dos produtos similares")
+    parser.add_argument("--graph-limit", type=int, default=DEFAULT_LIMIT,
+                        help="Número de produtos do resultado pelo grafo (os de melhor salesrank)")
+    parser.add_argument("--metrics-file",
+                        help="Ficheiro onde gravar, no fim, o relatório de métricas de cada consulta (linhas/s, memória, idas ao banco)")
+    parser.add_argument("--metrics-format", choices=METRICS_FORMATS, default='json',
+                        help="Formato do relatório de métricas: json ou prometheus (formato de texto)")
+    parser.add_argument("--title-candidates", type=int, default=5,
+                        help="Número de produtos candidatos mostrados na procura pelo título (é usado o mais parecido)")
+    parser.add_argument("--products-key", choices=PRODUCT_KEYS, default='asin',
+                        help="Tipo dos identificadores do --products-file: asin, id (source_id) ou title (título)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Número de produtos do --products-file consultados de cada vez")
+    parser.add_argument("--combined", action="store_true",
+                        help="Com --products-file, grava um único CSV por consulta (com a coluna asin) em vez de um CSV por produto")
 
     main_start_time = time.perf_counter()
     print("="*50)
@@ -293,34 +393,56 @@ def main():
     print("="*50)
 
     args = parser.parse_args()
+    if not args.snapshot and not (args.db_host and args.db_name and args.db_user and args.db_pass):
+        parser.error("são obrigatórios os argumentos --db-host, --db-name, --db-user e --db-pass (ou --snapshot)")
+    if args.snapshot and (args.parallel > 1 or args.products_file or args.explain or args.cache_dir or args.graph_dir):
+        parser.error("--snapshot não se combina com --parallel, --products-file, --explain, --cache-dir nem --graph-dir (usam o banco)")
+    if args.parallel < 1:
+        parser.error("--parallel deve ser pelo menos 1")
+    if args.cache_size < 1:
+        parser.error("--cache-size deve ser pelo menos 1 (MB)")
+    if args.preview_rows < 0:
+        parser.error("--preview-rows não pode ser negativo")
+    if args.batch_size < 1:
+        parser.error("--batch-size deve ser pelo menos 1")
+    if args.hops < 1:
+        parser.error("--hops deve ser pelo menos 1")
+    if args.graph_limit < 1:
+        parser.error("--graph-limit deve ser pelo menos 1")
+    if args.explain and not args.output:
+        parser.error("--explain precisa de --output (os planos são gravados ao lado dos resultados)")
+    if args.explain and args.products_file:
+        parser.error("--explain não se aplica a --products-file")
 
     conn = None
     try:
+        if args.snapshot:
+            run_snapshot(args)
+            sys.exit(0)
+
+        if args.products_file:
+            conn = get_conn(args.db_host, args.db_port, args.db_name, args.db_user, args.db_pass)
+            print("Conexão com o banco de dados estabelecida com sucesso.")
+            run_batch(conn, args)
+            sys.exit(0)
+
+        if args.parallel > 1:
+            run_parallel(args)
+            sys.exit(0)
+
         conn = get_conn(args.db_host, args.db_port, args.db_name, args.db_user, args.db_pass)
         print("Conexão com o banco de dados estabelecida com sucesso.")
 
-        target_asin = None
-        
-        if args.product_asin:
-            target_asin = get_product_asin(conn, args.product_asin, 'asin')
-        elif args.product_id:
-            target_asin = get_product_asin(conn, args.product_id, 'source_id')
-        elif args.product_title:
-            target_asin = get_product_asin(conn, args.product_title, 'titulo')
-
-        if target_asin:
-            print(f"\n--- Executando consultas para o produto com ASIN: {target_asin} ---")
-            query1(conn, target_asin, args.output)
-            query2(conn, target_asin, args.output)
-            query3(conn, target_asin, args.output)
-        else:
-            print("\nAVISO: As consultas 1, 2 e 3 não foram executadas pois nenhum identificador de produto foi fornecido ou o produto não foi encontrado.")
-
-        print("\n--- Executando consultas gerais ---")
-        query4(conn, args.output)
-        query5(conn, args.output)
-        query6(conn, args.output)
-        query7(conn, args.output)
+        cache = open_cache(conn, args)
+        target = find_target(conn, args)
+        graph = similar_graph(conn, args, target)
+        print(product_header(target))
+        tasks = dashboard_tasks(target, result_output(args), graph, args.hops, args.graph_limit)
+        for task in with_cache(tasks, cache):
+            if task.name == 'query4':
+                print(GENERAL_HEADER)
+            task.func(conn, *task.args)
+        print_cache_stats(cache)
 
         sys.exit(0)
     except Exception as e:
@@ -331,6 +453,8 @@ def main():
             conn.close()
             print("\nConexão com o banco de dados fechada.")
         
+        if args.metrics_file:
+            METRICS.write_report(args.metrics_file, 'tp1_3.3.py', args.metrics_format)
         main_end_time = time.perf_counter()
         total_script_time = main_end_time - main_start_time
         print("="*50)
@@ -339,4 +463,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
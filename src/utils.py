@@ -4,8 +4,16 @@ Este módulo contém as funções para analisar (fazer o "parsing") do ficheiro
 As funções foram desenhadas para serem eficientes em memória e robustas a pequenas inconsistências no formato do ficheiro.
 """
 
+import io
+import mmap
+import multiprocessing
+import os
 import re
-from datetime import datetime
+from collections import deque
+from datetime import date, datetime
+
+from records import CategoryEntry, Product
+from streams import is_compressed, iter_record_blocks, open_decompressed, skip_bytes
 
 REVIEW_RE = re.compile(r"""
     ^\s* # possível espaço no começo da linha
@@ -43,34 +51,19 @@ REVIEW_SUMMARY_RE = re.compile(r"""
     avg\srating:\s+(?P<avg_rating>[0-9.]+)
 """, re.IGNORECASE | re.VERBOSE)
 
+# Versões em bytes das mesmas expressões, usadas pelo backend 'bytes' (mmap), que trabalha
+# diretamente sobre o conteúdo do ficheiro sem descodificar cada linha para str
+REVIEW_RE_BYTES = re.compile(REVIEW_RE.pattern.encode('utf-8'), re.IGNORECASE | re.VERBOSE)
+CAT_PART_RE_BYTES = re.compile(CAT_PART_RE.pattern.encode('utf-8'), re.VERBOSE)
+REVIEW_SUMMARY_RE_BYTES = re.compile(REVIEW_SUMMARY_RE.pattern.encode('utf-8'), re.IGNORECASE | re.VERBOSE)
+
+# backends de parsing disponíveis: 'text' (linhas str, o original) e 'bytes' (mmap)
+PARSER_BACKENDS = ('text', 'bytes')
 
-def extract_all_categories(path):
-    """
-    Faz uma primeira leitura rápida do ficheiro, focada apenas em extrair todas as
-    categorias, os seus IDs antigos e a relação de hierarquia (pai/filho).
-    """
-    categories = {}  # Dicionário para guardar as categorias encontradas
-    with open(path, 'r', encoding='utf-8', errors='replace') as f:
-        for raw_line in f:
-            line = raw_line.strip()
-            # Só processamos linhas que parecem ser de categorias
-            if '|' in line and '[' in line:
-                parts = CAT_PART_RE.findall(line)
-                parent_old_id = None
-                for name, id_str in parts:
-                    try:
-                        old_id = int(id_str)
-                    except ValueError:
-                        continue  # Ignora se o ID não for um número
-                    
-                    name = name.strip()
-                    # Adiciona a categoria ao nosso dicionário apenas se for a primeira vez que a vemos
-                    if old_id not in categories:
-                        categories[old_id] = {"name": name, "parent_old_id": parent_old_id}
-                    
-                    # O ID atual será o pai da próxima categoria na mesma linha
-                    parent_old_id = old_id
-    return categories
+# Tamanho (em bytes) de cada bloco do ficheiro entregue a um processo no parsing paralelo.
+# Blocos pequenos equilibram melhor a carga entre os processos e limitam a memória usada
+# por cada resultado que volta para o processo principal
+PARALLEL_CHUNK_SIZE = 8 * 1024 * 1024
 
 
 def _parse_category_line_to_list(line):
@@ -87,86 +80,397 @@ def _parse_category_line_to_list(line):
             continue
         
         name = name.strip()
-        structured_cats.append({"old_id": old_id, "name": name, "parent_old_id": parent_id})
+        structured_cats.append(CategoryEntry(old_id, name, parent_id))
         parent_id = old_id
     return structured_cats
 
 
-def parse_snap(path):
+def _register_categories(structured_cats, categories):
+    """
+    Acrescenta ao dicionário de categorias (ID antigo -> CategoryEntry) as categorias
+    que ainda não foram vistas. A primeira ocorrência de cada ID é a que fica.
+    """
+    for cat in structured_cats:
+        if cat.old_id not in categories:
+            categories[cat.old_id] = cat
+
+
+def parse_snap(path, categories=None, start_offset=0):
     """
     Função principal de parsing. Lê o ficheiro de dados produto a produto.
     Esta função é um "gerador" (usa 'yield'), o que significa que não carrega
     o ficheiro todo para a memória, tornando o processo muito eficiente.
+
+    Se for passado um dicionário em `categories`, ele é preenchido durante a mesma
+    leitura com todas as categorias encontradas (ID antigo -> CategoryEntry),
+    o que evita uma segunda passagem pelo ficheiro só para extrair as categorias.
+
+    Ficheiros .gz e .zst são lidos diretamente, com a descompressão em segundo plano.
+    Cada produto guarda em `offset` a posição (em bytes, no conteúdo descomprimido) da
+    sua linha 'Id:'; `start_offset` permite retomar a leitura a partir de uma dessas posições.
+    """
+    if is_compressed(path):
+        with open_decompressed(path) as f:
+            skip_bytes(f, start_offset)
+            yield from _parse_lines(f, categories, start_offset)
+        return
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        yield from _parse_lines(f, categories, start_offset)
+
+
+def _parse_lines(lines, categories=None, base_offset=0):
+    """
+    Faz o parsing de uma sequência de linhas (em bytes, tal como lidas de um ficheiro
+    binário) do ficheiro SNAP e devolve os produtos completos, um a um. Cada linha é
+    descodificada para str antes de ser analisada. É o núcleo comum à leitura sequencial
+    (parse_snap) e à leitura paralela por blocos (parse_snap_parallel).
+    `base_offset` é a posição da primeira linha no ficheiro.
     """
     current_product = None
+    offset = base_offset
 
-    with open(path, 'r', encoding='utf-8', errors='replace') as f:
-        for raw_line in f:
-            line = raw_line.strip()
-            line_lower = line.lower() # Normalizamos para minúsculas para evitar problemas com 'Title' vs 'title'
+    for raw_line in lines:
+        line_offset = offset
+        offset += len(raw_line)
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        line_lower = line.lower() # Normalizamos para minúsculas para evitar problemas com 'Title' vs 'title'
 
-            # Se a linha começa com 'Id:', sabemos que um novo produto começou
-            if line_lower.startswith('id:'):
-                if current_product:
-                    yield current_product # Devolve o produto anterior completo
-                
-                # Inicia um novo dicionário para o produto atual
-                current_product = {
-                    'id': int(line.split(':', 1)[1].strip()), 'asin': None, 'title': None,
-                    'group': None, 'salesrank': None, 'similar': [],
-                    'categories': [], 'reviews': [],
-                    'similar_count': 0, 'categories_count': 0,
-                    'total': 0, 'downloaded': 0, 'avg_rating': None
-                }
-            elif current_product is None:
-                continue # Ignora linhas antes do primeiro produto
-            
-            # Extrai os campos do produto, usando a linha em minúsculas para a verificação
-            elif line_lower.startswith('asin:'):
-                current_product['asin'] = line.split(':', 1)[1].strip()
-            elif line_lower.startswith('title:'):
-                current_product['title'] = line.split(':', 1)[1].strip()
-            elif line_lower.startswith('group:'):
-                current_product['group'] = line.split(':', 1)[1].strip()
-            elif line_lower.startswith('salesrank:'):
-                value_str = line.split(':', 1)[1].strip()
-                current_product['salesrank'] = int(value_str) if value_str.isdigit() else None
-            elif line_lower.startswith('similar:'):
-                parts = line.split()
-                if len(parts) > 1 and parts[1].isdigit():
-                    current_product['similar_count'] = int(parts[1])
-                if len(parts) > 2:
-                    current_product['similar'] = parts[2:]
+        # Se a linha começa com 'Id:', sabemos que um novo produto começou
+        if line_lower.startswith('id:'):
+            if current_product:
+                yield current_product # Devolve o produto anterior completo
             
-            # Extrai as categorias
-            elif '|' in line:
-                cats = _parse_category_line_to_list(line)
-                current_product['categories_count'] += len(cats)
-                current_product['categories'].extend(cats)
-            
-            elif line_lower.startswith('reviews: total:'):
-                match = REVIEW_SUMMARY_RE.search(line)
-                if match:
-                    summary = match.groupdict()
-                    current_product['total'] = int(summary['total'])
-                    current_product['downloaded'] = int(summary['downloaded'])
-                    current_product['avg_rating'] = float(summary['avg_rating'])
-
-            # Se não for nenhum dos campos acima, tenta ver se é uma linha de avaliação
-            else:
-                match = REVIEW_RE.match(line)
-                if match:
-                    date_str, customer_id, rating, votes, helpful = match.groups()
-                    try:
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                    except ValueError:
-                        date_obj = None
-                    
-                    current_product['reviews'].append({
-                        'date': date_obj, 'customer': customer_id, 'rating': int(rating),
-                        'votes': int(votes), 'helpful': int(helpful)
-                    })
+            # Inicia um novo registo para o produto atual
+            current_product = Product(int(line.split(':', 1)[1].strip()), line_offset)
+        elif current_product is None:
+            continue # Ignora linhas antes do primeiro produto
+        
+        # Extrai os campos do produto, usando a linha em minúsculas para a verificação
+        elif line_lower.startswith('asin:'):
+            current_product.asin = line.split(':', 1)[1].strip()
+        elif line_lower.startswith('title:'):
+            current_product.title = line.split(':', 1)[1].strip()
+        elif line_lower.startswith('group:'):
+            current_product.group = line.split(':', 1)[1].strip()
+        elif line_lower.startswith('salesrank:'):
+            value_str = line.split(':', 1)[1].strip()
+            current_product.salesrank = int(value_str) if value_str.isdigit() else None
+        elif line_lower.startswith('similar:'):
+            parts = line.split()
+            if len(parts) > 1 and parts[1].isdigit():
+                current_product.similar_count = int(parts[1])
+            if len(parts) > 2:
+                current_product.similar = parts[2:]
         
-        # Devolve o último produto do ficheiro
-        if current_product:
-            yield current_product
\ No newline at end of file
+        # Extrai as categorias
+        elif '|' in line:
+            cats = _parse_category_line_to_list(line)
+            if categories is not None:
+                _register_categories(cats, categories)
+            current_product.categories_count += len(cats)
+            current_product.categories.extend(cats)
+        
+        elif line_lower.startswith('reviews: total:'):
+            match = REVIEW_SUMMARY_RE.search(line)
+            if match:
+                summary = match.groupdict()
+                current_product.total = int(summary['total'])
+                current_product.downloaded = int(summary['downloaded'])
+                current_product.avg_rating = float(summary['avg_rating'])
+
+        # Se não for nenhum dos campos acima, tenta ver se é uma linha de avaliação
+        else:
+            match = REVIEW_RE.match(line)
+            if match:
+                date_str, customer_id, rating, votes, helpful = match.groups()
+                try:
+                    date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+                except ValueError:
+                    date_obj = None
+                
+                current_product.reviews.append(date_obj, customer_id, int(rating), int(votes), int(helpful))
+    
+    # Devolve o último produto do ficheiro
+    if current_product:
+        yield current_product
+
+
+def _decode(value):
+    return value.decode('utf-8', errors='replace')
+
+
+def _parse_review_date(date_bytes):
+    # equivalente ao strptime('%Y-%m-%d'), mas sem passar por str
+    try:
+        year, month, day = date_bytes.split(b'-')
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def _parse_bytes(buf, start, end, categories=None, base_offset=0):
+    """
+    Backend 'bytes' do parsing: percorre o intervalo [start, end) de um buffer (normalmente
+    um mmap do ficheiro) linha a linha, sem converter as linhas para str. Só os campos que
+    vão para a base de dados (ASIN, título, grupo, cliente, nomes de categorias e ASINs
+    similares) são descodificados. Devolve os mesmos produtos que o _parse_lines.
+    `base_offset` é a posição do início do buffer no ficheiro.
+    """
+    current_product = None
+    find = buf.find
+    pos = start
+
+    while pos < end:
+        newline = find(b'\n', pos, end)
+        if newline == -1:
+            newline = end
+        line_start = pos
+        line = buf[pos:newline].strip()
+        pos = newline + 1
+        if not line:
+            continue
+
+        # caminho rápido: as linhas de avaliação (a grande maioria) começam por um dígito (a data)
+        if line[0] in b'0123456789':
+            if current_product is None:
+                continue
+            match = REVIEW_RE_BYTES.match(line)
+            if match:
+                date_bytes, customer_id, rating, votes, helpful = match.groups()
+                current_product.reviews.append(
+                    _parse_review_date(date_bytes), _decode(customer_id), int(rating), int(votes), int(helpful)
+                )
+            continue
+
+        head = line[:15].lower() # só o início da linha é copiado para comparar os prefixos
+
+        if head.startswith(b'id:'):
+            if current_product:
+                yield current_product
+            current_product = Product(int(line.partition(b':')[2]), base_offset + line_start)
+        elif current_product is None:
+            continue
+        elif head.startswith(b'asin:'):
+            current_product.asin = _decode(line.partition(b':')[2].strip())
+        elif head.startswith(b'title:'):
+            current_product.title = _decode(line.partition(b':')[2].strip())
+        elif head.startswith(b'group:'):
+            current_product.group = _decode(line.partition(b':')[2].strip())
+        elif head.startswith(b'salesrank:'):
+            value = line.partition(b':')[2].strip()
+            current_product.salesrank = int(value) if value.isdigit() else None
+        elif head.startswith(b'similar:'):
+            parts = line.split()
+            if len(parts) > 1 and parts[1].isdigit():
+                current_product.similar_count = int(parts[1])
+            if len(parts) > 2:
+                current_product.similar = [_decode(part) for part in parts[2:]]
+        elif b'|' in line:
+            cats = []
+            parent_id = None
+            for name, id_bytes in CAT_PART_RE_BYTES.findall(line):
+                old_id = int(id_bytes)
+                cats.append(CategoryEntry(old_id, _decode(name).strip(), parent_id))
+                parent_id = old_id
+            if categories is not None:
+                _register_categories(cats, categories)
+            current_product.categories_count += len(cats)
+            current_product.categories.extend(cats)
+        elif head.startswith(b'reviews: total:'):
+            match = REVIEW_SUMMARY_RE_BYTES.search(line)
+            if match:
+                total, downloaded, avg_rating = match.groups()
+                current_product.total = int(total)
+                current_product.downloaded = int(downloaded)
+                current_product.avg_rating = float(avg_rating)
+        else:
+            match = REVIEW_RE_BYTES.match(line)
+            if match:
+                date_bytes, customer_id, rating, votes, helpful = match.groups()
+                current_product.reviews.append(
+                    _parse_review_date(date_bytes), _decode(customer_id), int(rating), int(votes), int(helpful)
+                )
+
+    if current_product:
+        yield current_product
+
+
+def parse_snap_mmap(path, categories=None, start_offset=0):
+    """
+    Mesma interface do parse_snap, mas usando o backend 'bytes': o ficheiro é mapeado em
+    memória (mmap) e analisado diretamente em bytes.
+
+    Um ficheiro comprimido não pode ser mapeado em memória: nesse caso o conteúdo
+    descomprimido é analisado em blocos que terminam sempre no fim de um produto.
+    """
+    if is_compressed(path):
+        with open_decompressed(path) as stream:
+            skip_bytes(stream, start_offset)
+            block_offset = start_offset
+            for block in iter_record_blocks(stream):
+                yield from _parse_bytes(block, 0, len(block), categories, block_offset)
+                block_offset += len(block)
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from _parse_bytes(mm, start_offset, len(mm), categories)
+
+
+def _find_record_start(f, offset):
+    """
+    A partir de um offset qualquer do ficheiro (aberto em modo binário), avança até ao
+    início da próxima linha 'Id:', ou seja, até ao início do próximo produto.
+    Devolve o tamanho do ficheiro se não houver mais nenhum produto.
+    """
+    if offset == 0:
+        return 0
+    f.seek(offset - 1)
+    f.readline() # descarta o resto da linha onde o offset caiu
+    while True:
+        position = f.tell()
+        line = f.readline()
+        if not line:
+            return position
+        if line.strip().lower().startswith(b'id:'):
+            return position
+
+
+def split_snap_chunks(path, chunk_size=PARALLEL_CHUNK_SIZE, start_offset=0):
+    """
+    Divide o ficheiro em intervalos de bytes [início, fim) alinhados no início de
+    produtos (linhas 'Id:'), de forma que cada intervalo possa ser analisado de forma
+    independente e sem cortar nenhum produto ao meio.
+    """
+    file_size = os.path.getsize(path)
+    boundaries = [start_offset]
+    with open(path, 'rb') as f:
+        for offset in range(start_offset + chunk_size, file_size, chunk_size):
+            start = _find_record_start(f, offset)
+            if start > boundaries[-1]:
+                boundaries.append(start)
+    if boundaries[-1] < file_size:
+        boundaries.append(file_size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _parse_data(data, backend, base_offset):
+    if backend == 'bytes':
+        return list(_parse_bytes(data, 0, len(data), base_offset=base_offset))
+    return list(_parse_lines(io.BytesIO(data), base_offset=base_offset))
+
+
+def _parse_chunk(task):
+    """
+    Função executada em cada processo do pool: lê um intervalo de bytes do ficheiro e
+    devolve a lista dos produtos contidos nele.
+    """
+    path, start, end, backend = task
+    if backend == 'bytes':
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return list(_parse_bytes(mm, start, end))
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _parse_data(data, backend, start)
+
+
+def _parse_block(task):
+    """
+    Função executada em cada processo do pool quando a entrada é comprimida: o bloco
+    (já descomprimido pelo processo principal) chega junto com a tarefa.
+    """
+    data, backend, base_offset = task
+    return _parse_data(data, backend, base_offset)
+
+
+def _next_result(pending, ordered):
+    # sem ordem, devolve o primeiro bloco já pronto; se nenhum estiver, espera pelo mais antigo
+    if not ordered:
+        for result in pending:
+            if result.ready():
+                pending.remove(result)
+                return result.get()
+    return pending.popleft().get()
+
+
+def parse_snap_parallel(path, workers, categories=None, ordered=True, chunk_size=PARALLEL_CHUNK_SIZE, backend='text', start_offset=0):
+    """
+    Versão paralela do parse_snap: o ficheiro é dividido em blocos alinhados em produtos
+    e cada bloco é analisado por um processo de um pool do multiprocessing.
+
+    Com `ordered=True` os produtos são devolvidos exatamente na mesma ordem (e com o
+    mesmo conteúdo) que o parse_snap devolveria. Com `ordered=False` cada bloco é
+    devolvido assim que fica pronto, o que evita esperar por blocos mais lentos.
+
+    No máximo 2 blocos por processo ficam em andamento ao mesmo tempo, para que a
+    memória não cresça quando quem consome os produtos (a carga no banco) é mais lento.
+    Ficheiros comprimidos são descomprimidos no processo principal e os blocos são
+    enviados aos processos junto com a tarefa.
+
+    O dicionário de categorias, quando pedido, é preenchido no processo principal à
+    medida que os produtos chegam. `backend` escolhe o parser usado em cada bloco.
+    """
+    max_pending = 2 * workers
+    with multiprocessing.Pool(workers) as pool:
+        if is_compressed(path):
+            stream = open_decompressed(path)
+            skip_bytes(stream, start_offset)
+            func = _parse_block
+            tasks = _block_tasks(iter_record_blocks(stream, chunk_size), backend, start_offset)
+        else:
+            stream = None
+            func = _parse_chunk
+            tasks = ((path, start, end, backend) for start, end in split_snap_chunks(path, chunk_size, start_offset))
+        try:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.apply_async(func, (task,)))
+                while len(pending) >= max_pending:
+                    yield from _register_all(_next_result(pending, ordered), categories)
+            while pending:
+                yield from _register_all(_next_result(pending, ordered), categories)
+        finally:
+            if stream is not None:
+                stream.close()
+
+
+def _block_tasks(blocks, backend, block_offset):
+    for block in blocks:
+        yield (block, backend, block_offset)
+        block_offset += len(block)
+
+
+def _register_all(products, categories):
+    for product in products:
+        if categories is not None:
+            _register_categories(product.categories, categories)
+        yield product
+
+
+TOTAL_ITEMS_RE = re.compile(rb"^Total items:\s*(\d+)", re.MULTILINE)
+
+
+def read_total_items(path):
+    """
+    Devolve o número de produtos indicado no cabeçalho do ficheiro ('Total items: N'), ou None.
+    """
+    stream = open_decompressed(path, block_size=64 * 1024) if is_compressed(path) else open(path, 'rb')
+    with stream:
+        match = TOTAL_ITEMS_RE.search(stream.read(4096))
+    return int(match.group(1)) if match else None
+
+
+def iter_snap(path, categories=None, workers=1, ordered=True, backend='text', start_offset=0):
+    """
+    Ponto de entrada usado pelo ETL: escolhe entre a leitura sequencial (workers=1)
+    e a leitura paralela com `workers` processos, e entre os backends 'text' e 'bytes'.
+    `start_offset` (o `offset` de um produto já lido) retoma a leitura nesse produto.
+    """
+    if workers > 1:
+        return parse_snap_parallel(path, workers, categories, ordered, backend=backend, start_offset=start_offset)
+    if backend == 'bytes':
+        return parse_snap_mmap(path, categories, start_offset)
+    return parse_snap(path, categories, start_offset)
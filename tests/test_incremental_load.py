@@ -0,0 +1,135 @@
+"""
+Carga incremental (tp1_3.2.py --incremental) de um dump mais recente sobre uma base já carregada:
+as reviews, as categorias e os pares de similares de um produto alterado são substituídos, não
+acumulados, e o resultado é o mesmo de uma carga completa do dump novo.
+
+O ETL apaga e recria as tabelas, por isso o teste só corre com um banco próprio para testes,
+indicado pelas variáveis de ambiente TEST_DB_NAME (obrigatória), TEST_DB_HOST, TEST_DB_PORT,
+TEST_DB_USER e TEST_DB_PASS:
+    TEST_DB_NAME=etl_test TEST_DB_PASS=postgres python -m pytest -q tests
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+DB_ARGS = {
+    'host': os.environ.get('TEST_DB_HOST', 'localhost'),
+    'port': int(os.environ.get('TEST_DB_PORT', '5432')),
+    'name': os.environ.get('TEST_DB_NAME'),
+    'user': os.environ.get('TEST_DB_USER', 'postgres'),
+    'pass': os.environ.get('TEST_DB_PASS', 'postgres'),
+}
+
+
+def product(source_id, asin, similar, categories, reviews):
+    lines = [
+        f"Id:   {source_id}",
+        f"ASIN: {asin}",
+        f"  title: Product {source_id}",
+        "  group: Book",
+        f"  salesrank: {100 + source_id}",
+        f"  similar: {len(similar)}" + ''.join(f"  {other}" for other in similar),
+        f"  categories: {len(categories)}",
+    ]
+    lines += [f"   |Books[283155]|{category}" for category in categories]
+    lines.append(f"  reviews: total: {len(reviews)}  downloaded: {len(reviews)}  avg rating: 4")
+    lines += [f"    {day}  cutomer: {customer}  rating: {rating}  votes:  {votes}  helpful:   {helpful}"
+              for day, customer, rating, votes, helpful in reviews]
+    return '\n'.join(lines) + '\n'
+
+
+def dump(products):
+    return f"# Full information about Amazon Share the Love products\nTotal items: {len(products)}\n\n" + '\n'.join(products)
+
+
+# B, C e D não mudam entre os dois dumps; A muda os similares, as categorias e as reviews.
+# B lista A como similar nos dois dumps, por isso o par (A, B) tem de continuar a existir
+B = product(1, '000000000B', ['000000000A'], ['Fiction[10]'], [('2001-1-1', 'C1', 5, 3, 2)])
+C = product(2, '000000000C', [], ['Fiction[10]'], [('2002-2-2', 'C2', 4, 1, 1)])
+D = product(3, '000000000D', [], ['History[20]'], [])
+OLD_DUMP = dump([
+    product(0, '000000000A', ['000000000B', '000000000C'], ['Fiction[10]', 'Fiction[10]|Crime[11]'],
+            [('2000-1-1', 'C1', 5, 10, 8), ('2000-1-2', 'C2', 2, 4, 1)]),
+    B, C, D,
+])
+NEW_DUMP = dump([
+    product(0, '000000000A', ['000000000D'], ['History[20]'], [('2005-5-5', 'C3', 3, 2, 2)]),
+    B, C, D,
+])
+
+TABLES_SQL = {
+    'reviews': """
+        SELECT p.asin, c.customer_code, r.rating, r.review_date, r.votes, r.helpful
+        FROM reviews r JOIN Products p ON p.source_id = r.product_id JOIN Customers c ON c.customer_id = r.customer_id
+    """,
+    'product_category': """
+        SELECT p.asin, cat.category_source_id
+        FROM Product_category pc JOIN Products p ON p.source_id = pc.product_id JOIN Categories cat ON cat.category_id = pc.category_id
+    """,
+    'related': """
+        SELECT p1.asin, p2.asin
+        FROM Related_products rp JOIN Products p1 ON p1.source_id = rp.product1_id JOIN Products p2 ON p2.source_id = rp.product2_id
+    """,
+}
+
+
+@unittest.skipUnless(DB_ARGS['name'], "TEST_DB_NAME não definida (o teste recria as tabelas do banco indicado)")
+class IncrementalLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def load(self, content, name, *options):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        command = [sys.executable, os.path.join(ROOT, 'src', 'tp1_3.2.py'), '--input', path, *options]
+        for key, value in DB_ARGS.items():
+            command += [f"--db-{key}", str(value)]
+        result = subprocess.run(command, capture_output=True, text=True)
+        self.assertIn("Processo de ETL concluído com sucesso", result.stdout, result.stdout + result.stderr)
+
+    def tables(self):
+        from db import get_conn
+        conn = get_conn(DB_ARGS['host'], DB_ARGS['port'], DB_ARGS['name'], DB_ARGS['user'], DB_ARGS['pass'])
+        try:
+            with conn.cursor() as cur:
+                rows = {}
+                for table, sql in TABLES_SQL.items():
+                    cur.execute(sql)
+                    rows[table] = sorted(cur.fetchall())
+                return rows
+        finally:
+            conn.close()
+
+    def check_incremental(self, loader):
+        self.load(NEW_DUMP, 'new.txt', '--loader', loader)
+        expected = self.tables()
+
+        self.load(OLD_DUMP, 'old.txt', '--loader', loader)
+        self.load(NEW_DUMP, 'new.txt', '--loader', loader, '--incremental')
+        actual = self.tables()
+
+        self.assertEqual(actual, expected)
+        self.assertEqual([row[1] for row in actual['reviews'] if row[0] == '000000000A'], ['C3'])
+        self.assertEqual(sorted({row[1] for row in actual['product_category'] if row[0] == '000000000A'}), [20, 283155])
+        self.assertEqual(actual['related'], [('000000000A', '000000000B'), ('000000000A', '000000000D')])
+
+    def test_incremental_replaces_changed_product_executemany(self):
+        self.check_incremental('executemany')
+
+    def test_incremental_replaces_changed_product_copy(self):
+        self.check_incremental('copy')
+
+
+if __name__ == '__main__':
+    unittest.main()
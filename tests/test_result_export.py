@@ -0,0 +1,104 @@
+"""
+Exportação dos resultados do dashboard através da cache de resultados (--cache-dir): um
+resultado grande é lido do cursor em blocos (fetchmany), nunca com fetchall, e não é guardado
+na cache; um resultado pequeno é guardado e reutilizado.
+
+Não precisa do banco: a conexão e o cursor do psycopg são substituídos por objetos com a
+parte da interface usada pela cache e pela exportação.
+"""
+
+import csv
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from result_cache import MAX_CACHED_ROWS, ResultCache
+from result_export import FETCH_SIZE, ResultOutput, export_results
+
+
+class FakeCursor:
+    """
+    Cursor que gera `total` linhas (i, 'linha i') e regista como foram lidas.
+    """
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.description = [('id', 23), ('texto', 25)]
+        self._next = 0
+
+    def execute(self, sql, params=None):
+        self.conn.executed += 1
+        self._next = 0
+
+    def fetchmany(self, size):
+        self.conn.largest_fetch = max(self.conn.largest_fetch, size)
+        end = min(self._next + size, self.conn.total)
+        rows = [(i, f"linha {i}") for i in range(self._next, end)]
+        self._next = end
+        return rows
+
+    def fetchall(self):
+        raise AssertionError("o resultado não deve ser lido todo de uma vez")
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, total):
+        self.total = total
+        self.executed = 0
+        self.largest_fetch = 0
+        self.cursor_names = []
+
+    def cursor(self, name=None):
+        self.cursor_names.append(name)
+        return FakeCursor(self, name)
+
+
+class ExportThroughCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(os.path.join(self.dir.name, 'cache'), 'versao-1')
+        self.output = ResultOutput(os.path.join(self.dir.name, 'out'), 'csv', 5)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def export(self, conn, filename):
+        export_results(self.cache.connection(conn, 'query'), "SELECT ...", (filename,), "Resultado", self.output, filename)
+        with open(os.path.join(self.output.directory, f"{filename}.csv"), newline='', encoding='utf-8') as f:
+            return list(csv.reader(f))
+
+    def cached_files(self):
+        return [name for name in os.listdir(self.cache._dir)]
+
+    def test_large_result_is_streamed_and_not_cached(self):
+        total = MAX_CACHED_ROWS + 2 * FETCH_SIZE + 7
+        conn = FakeConnection(total)
+        rows = self.export(conn, 'grande')
+        self.assertEqual(len(rows), total + 1)
+        self.assertEqual(rows[-1], [str(total - 1), f"linha {total - 1}"])
+        self.assertIsNotNone(conn.cursor_names[0]) # cursor do lado do servidor
+        self.assertLessEqual(conn.largest_fetch, FETCH_SIZE)
+        self.assertEqual(self.cached_files(), [])
+
+    def test_small_result_is_cached(self):
+        first = FakeConnection(10)
+        rows = self.export(first, 'pequeno')
+        self.assertEqual(len(self.cached_files()), 1)
+
+        second = FakeConnection(10)
+        self.assertEqual(self.export(second, 'pequeno'), rows)
+        self.assertEqual(second.executed, 0)
+        self.assertEqual(self.cache.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()